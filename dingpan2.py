@@ -3,7 +3,8 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
+from collections import deque
 import plotly.graph_objects as go
 import plotly.express as px
 from selenium import webdriver
@@ -19,13 +20,334 @@ import logging
 import shutil
 import io
 import re
-import calendar
-from dateutil.relativedelta import relativedelta
+import json
+import queue
+import threading
+import uuid
+from contextlib import contextmanager
+from dingpan_core import (IwencaiExportParser, ParsePool, PriceHistoryStore, PriceSnapshot, RankHistory, top_k_indices,
+                          QueryResultCache, encode_dataframe, decode_dataframe, save_checkpoint, load_checkpoint)
+from dingpan_archive import ExportArchive
+from dingpan_alerts import AlertManager, load_alert_config, save_alert_config
+from dingpan_calendar import (TradingCalendar, MonitorScheduler, TradingDayIndex, QueryTemplateExpander,
+                              load_holidays, save_holidays)
 warnings.filterwarnings('ignore')
 
 # 设置 logging 配置
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# ====================== 页面资源拦截配置 ======================
+# 问财页面只需要搜索框、结果表格和导数据按钮的 DOM，图片、字体、广告和统计脚本都可以拦截
+_AD_ANALYTICS_URL_PATTERNS = [
+    '*hm.baidu.com*',
+    '*google-analytics.com*',
+    '*googletagmanager.com*',
+    '*doubleclick.net*',
+    '*cnzz.com*',
+    '*growingio.com*',
+    '*sensorsdata*',
+    '*stat.10jqka.com.cn*',
+    '*adm.10jqka.com.cn*',
+]
+_IMAGE_URL_PATTERNS = ['*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.ico', '*.bmp']
+_FONT_MEDIA_URL_PATTERNS = ['*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot', '*.mp4', '*.mp3', '*.webm']
+
+RESOURCE_BLOCK_PROFILES = {
+    'off': {
+        'description': '不拦截',
+        'blocked_urls': [],
+        'block_images': False,
+    },
+    'light': {
+        'description': '仅拦截广告和统计脚本',
+        'blocked_urls': _AD_ANALYTICS_URL_PATTERNS,
+        'block_images': False,
+    },
+    'standard': {
+        'description': '拦截图片、字体、媒体、广告和统计脚本',
+        'blocked_urls': _AD_ANALYTICS_URL_PATTERNS + _IMAGE_URL_PATTERNS + _FONT_MEDIA_URL_PATTERNS,
+        'block_images': True,
+    },
+}
+
+# 持久化数据目录（选择器缓存等），可通过环境变量 DINGPAN_DATA_DIR 覆盖
+APP_DATA_DIR = os.environ.get('DINGPAN_DATA_DIR', os.path.join(os.path.expanduser('~'), '.dingpan'))
+
+# 问财页面地址，基准测试时指向本地替身站点（dingpan_standin.py）
+IWENCAI_URL = "https://www.iwencai.com/unifiedwap/"
+
+# 无头模式下减少渲染和后台活动的启动参数（不依赖虚拟显示器，便于一台服务器运行多个实例）
+HEADLESS_ARGUMENTS = [
+    '--headless=new',
+    '--hide-scrollbars',
+    '--mute-audio',
+    '--disable-background-networking',
+    '--disable-component-update',
+    '--disable-default-apps',
+    '--disable-sync',
+    '--no-first-run',
+    '--renderer-process-limit=2',
+]
+
+# 分片查询的板块分区: 结果过大的宽泛查询拆成每个板块一个子查询，合并后按股票代码去重
+BOARD_SHARDS = ['沪市主板', '深市主板', '创业板', '科创板']
+
+# 默认查询，最近7个交易日的日期在每次抓取时自动展开
+DEFAULT_SEARCH_QUERY = "{最近7个交易日:{日期}收盘价大于5日均线}，非ST，非北交所，财务综合评分大于2.5"
+
+# ====================== 页面元素选择器 ======================
+SEARCH_BOX_SELECTORS = [
+    "//textarea[contains(@placeholder,'请输入')]",
+    "//input[contains(@placeholder,'请输入')]",
+    "//textarea",
+]
+
+SEARCH_BUTTON_SELECTORS = [
+    "//*[contains(@class,'search-icon')]",
+    "//*[contains(@class,'search-btn')]",
+    "//button[contains(text(), '搜索')]",
+]
+
+LOGIN_INDICATOR_SELECTORS = [
+    "//div[contains(text(), '扫码登录')]",
+    "//div[contains(@class, 'login')]",
+    "//div[contains(@class, 'qrcode')]",
+]
+
+DOWNLOAD_BUTTON_SELECTORS = [
+    "//div[contains(@class, 'item')]//div[contains(@class, 'download')]/../div[contains(@class, 'text') and text()='导数据']",
+    "//div[contains(@class, 'text') and text()='导数据']",
+    "//div[contains(@class, 'item')]//div[contains(@class, 'download')]",
+    "//button[contains(text(), '导数据')]",
+    "//span[contains(text(), '导数据')]",
+    "//a[contains(text(), '导数据')]",
+    "//div[contains(text(), '导数据')]",
+]
+
+ALTERNATIVE_DOWNLOAD_SELECTORS = [
+    "//*[contains(@class, 'download')]",
+    "//*[contains(text(), '导出')]",
+    "//*[contains(text(), '下载')]",
+    "//button[contains(@class, 'btn-download')]",
+    "//a[contains(@class, 'download')]",
+    "//span[contains(text(), '导出')]",
+    "//span[contains(text(), '下载')]",
+]
+
+RESULT_MARKER_SELECTORS = [
+    "//table//tbody//tr",
+    "//*[contains(@class, 'table-container')]",
+    "//*[contains(@class, 'iwc-table')]",
+]
+
+# 一次 execute_script 往返内评估所有选择器组，返回每个选择器的命中数、可见数以及第一个可用元素
+PAGE_STATE_PROBE_JS = """
+var groups = arguments[0];
+var state = {};
+function isVisible(el) {
+    if (!el.getClientRects || el.getClientRects().length === 0) {
+        return false;
+    }
+    var style = window.getComputedStyle(el);
+    return style.visibility !== 'hidden' && style.display !== 'none' && parseFloat(style.opacity || '1') > 0;
+}
+function isEnabled(el) {
+    return !el.disabled && el.getAttribute('aria-disabled') !== 'true';
+}
+Object.keys(groups).forEach(function (name) {
+    var group = groups[name];
+    var matches = [];
+    var first = null;
+    group.selectors.forEach(function (selector) {
+        var snapshot;
+        try {
+            snapshot = document.evaluate(selector, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+        } catch (e) {
+            matches.push({selector: selector, count: 0, visible: 0, error: String(e)});
+            return;
+        }
+        var visible = 0;
+        for (var i = 0; i < snapshot.snapshotLength; i++) {
+            var el = snapshot.snapshotItem(i);
+            if (el.nodeType !== 1 || !isVisible(el)) {
+                continue;
+            }
+            if (group.require_enabled && !isEnabled(el)) {
+                continue;
+            }
+            visible++;
+            if (first === null) {
+                first = {selector: selector, element: el, text: (el.innerText || '').trim().slice(0, 50)};
+            }
+        }
+        matches.push({selector: selector, count: snapshot.snapshotLength, visible: visible});
+    });
+    state[name] = {present: first !== null, first: first, matches: matches};
+});
+return state;
+"""
+
+# 在浏览器内把渲染好的结果表格（含多行表头和分页）序列化为 JSON，一次 execute_async_script 完成
+# 合并单元格只在左上角保留文本；表头中横向合并的其余列写 'undefined'（与问财导出文件相同），其余位置为 null
+TABLE_EXTRACT_JS = """
+var maxPages = arguments[0];
+var pageTimeoutMs = arguments[1];
+var done = arguments[arguments.length - 1];
+var header = null;
+var rows = [];
+var pages = 0;
+
+function cellText(cell) {
+    return (cell.innerText || cell.textContent || '').replace(/\\s+/g, ' ').trim();
+}
+function isVisible(el) {
+    return el.getClientRects().length > 0;
+}
+function isDisabled(el) {
+    return el.disabled || /disabled/.test(el.className) ||
+        (el.parentElement !== null && /disabled/.test(el.parentElement.className));
+}
+function findBodyTable() {
+    var best = null;
+    var bestRows = 0;
+    var tables = document.querySelectorAll('table');
+    for (var i = 0; i < tables.length; i++) {
+        if (!isVisible(tables[i])) {
+            continue;
+        }
+        var count = tables[i].querySelectorAll('tbody tr').length;
+        if (count > bestRows) {
+            best = tables[i];
+            bestRows = count;
+        }
+    }
+    return best;
+}
+function findHeaderRows(table) {
+    var own = table.querySelectorAll('thead tr');
+    if (own.length) {
+        return own;
+    }
+    // 表头和表体分成两个 table 时，在相邻的祖先节点中查找表头
+    var node = table.parentElement;
+    for (var depth = 0; node && depth < 4; depth++, node = node.parentElement) {
+        var theads = node.querySelectorAll('thead');
+        for (var i = 0; i < theads.length; i++) {
+            var headerRows = theads[i].querySelectorAll('tr');
+            if (headerRows.length) {
+                return headerRows;
+            }
+        }
+    }
+    return [];
+}
+function expandRows(trs, spanText) {
+    var grid = [];
+    for (var r = 0; r < trs.length; r++) {
+        grid[r] = grid[r] || [];
+        var c = 0;
+        var cells = trs[r].children;
+        for (var k = 0; k < cells.length; k++) {
+            while (grid[r][c] !== undefined) {
+                c++;
+            }
+            var colspan = parseInt(cells[k].getAttribute('colspan') || '1', 10);
+            var rowspan = parseInt(cells[k].getAttribute('rowspan') || '1', 10);
+            var text = cellText(cells[k]);
+            for (var dr = 0; dr < rowspan; dr++) {
+                grid[r + dr] = grid[r + dr] || [];
+                for (var dc = 0; dc < colspan; dc++) {
+                    if (dr === 0 && dc === 0) {
+                        grid[r + dr][c + dc] = text !== '' ? text : null;
+                    } else {
+                        grid[r + dr][c + dc] = (dr === 0 && dc > 0) ? spanText : null;
+                    }
+                }
+            }
+            c += colspan;
+        }
+    }
+    grid = grid.slice(0, trs.length);
+    var width = 0;
+    grid.forEach(function (row) {
+        width = Math.max(width, row.length);
+    });
+    return grid.map(function (row) {
+        var out = [];
+        for (var i = 0; i < width; i++) {
+            out.push(row[i] === undefined ? null : row[i]);
+        }
+        return out;
+    });
+}
+function findNextButton() {
+    var selectors = ['.pager .next', '.pagination .next', 'li.next a', 'a.next', '.page-next', 'button.btn-next'];
+    for (var i = 0; i < selectors.length; i++) {
+        var el = document.querySelector(selectors[i]);
+        if (el && isVisible(el) && !isDisabled(el)) {
+            return el;
+        }
+    }
+    var candidates = document.querySelectorAll('a, li, button, span');
+    for (var j = 0; j < candidates.length; j++) {
+        if (cellText(candidates[j]) === '下一页' && isVisible(candidates[j]) && !isDisabled(candidates[j])) {
+            return candidates[j];
+        }
+    }
+    return null;
+}
+function expectedRows() {
+    var match = (document.body.innerText || '').match(/共\\s*(\\d+)\\s*条/);
+    return match ? parseInt(match[1], 10) : null;
+}
+function finish(allPages) {
+    var expected = expectedRows();
+    done({
+        header: header || [],
+        rows: rows,
+        pages: pages,
+        expected_rows: expected,
+        complete: allPages && rows.length > 0 && (expected === null || rows.length >= expected)
+    });
+}
+function collect() {
+    var table = findBodyTable();
+    if (!table) {
+        finish(false);
+        return;
+    }
+    if (header === null) {
+        header = expandRows(findHeaderRows(table), 'undefined');
+    }
+    var bodyRows = table.querySelectorAll('tbody tr');
+    rows = rows.concat(expandRows(bodyRows, null));
+    pages++;
+    var next = findNextButton();
+    if (!next || pages >= maxPages) {
+        finish(!next);
+        return;
+    }
+    var marker = bodyRows.length ? cellText(bodyRows[0]) : '';
+    next.click();
+    var waited = 0;
+    (function poll() {
+        var current = findBodyTable();
+        var first = current ? current.querySelector('tbody tr') : null;
+        if (first && cellText(first) !== marker) {
+            collect();
+            return;
+        }
+        waited += 100;
+        if (waited >= pageTimeoutMs) {
+            finish(false);
+            return;
+        }
+        setTimeout(poll, 100);
+    })();
+}
+collect();
+"""
+
 # ====================== 页面配置 ======================
 st.set_page_config(
     page_title="同花顺问财监控系统",
@@ -35,45 +357,319 @@ st.set_page_config(
 st.title("同花监控系统")
 st.markdown("---")
 
+# ====================== 选择器缓存 ======================
+class SelectorCache:
+    """持久化到磁盘的选择器缓存，记录每个选择器的命中/未命中次数和耗时，按历史成功率排序候选"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.elements = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.elements = json.load(f).get('elements', {})
+            logging.debug(f"步骤: Loaded selector cache from {self.path}")
+        except FileNotFoundError:
+            self.elements = {}
+        except Exception as e:
+            logging.warning(f"Could not load selector cache {self.path}: {str(e)}")
+            self.elements = {}
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'elements': self.elements}, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logging.warning(f"Could not save selector cache {self.path}: {str(e)}")
+
+    def _element(self, element_type):
+        return self.elements.setdefault(element_type, {'lookups': 0, 'first_try_hits': 0, 'selectors': {}})
+
+    @staticmethod
+    def _score(stats):
+        # 拉普拉斯平滑的成功率，没有记录的选择器得分 0.5，排在历史成功的选择器之后
+        success_rate = (stats['hits'] + 1) / (stats['hits'] + stats['misses'] + 2)
+        avg_latency = stats['total_latency_ms'] / stats['hits'] if stats['hits'] else float('inf')
+        return -success_rate, avg_latency
+
+    def ranked(self, element_type, candidates):
+        """按历史成功率从高到低排序候选选择器，同分时保持原顺序"""
+        with self.lock:
+            known = self.elements.get(element_type, {}).get('selectors', {})
+            empty = {'hits': 0, 'misses': 0, 'total_latency_ms': 0.0}
+            order = {sel: i for i, sel in enumerate(candidates)}
+            return sorted(candidates, key=lambda sel: (*self._score(known.get(sel, empty)), order[sel]))
+
+    def record_lookup(self, element_type, ranked_selectors, hit_selector, latency_ms, description=""):
+        """记录一次查找: 命中选择器之前尝试过的选择器计为未命中"""
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self.lock:
+            element = self._element(element_type)
+            element['lookups'] += 1
+            for sel in ranked_selectors:
+                stats = element['selectors'].setdefault(
+                    sel, {'hits': 0, 'misses': 0, 'total_latency_ms': 0.0, 'description': '', 'last_hit': None}
+                )
+                if sel == hit_selector:
+                    stats['hits'] += 1
+                    stats['total_latency_ms'] += latency_ms
+                    stats['last_hit'] = now
+                    if description:
+                        stats['description'] = description
+                    if ranked_selectors and sel == ranked_selectors[0]:
+                        element['first_try_hits'] += 1
+                    break
+                stats['misses'] += 1
+        self.save()
+
+    def best(self, element_type):
+        """历史表现最好且至少命中过一次的选择器"""
+        with self.lock:
+            selectors = self.elements.get(element_type, {}).get('selectors', {})
+            hit_selectors = [(sel, stats) for sel, stats in selectors.items() if stats['hits'] > 0]
+        if not hit_selectors:
+            return None
+        sel, stats = min(hit_selectors, key=lambda item: self._score(item[1]))
+        return {'selector': sel, 'description': stats['description'], 'timestamp': stats['last_hit']}
+
+    def summary(self):
+        """每种元素的首选选择器、首次命中率和平均耗时，供侧边栏显示"""
+        rows = []
+        with self.lock:
+            items = [(element_type, dict(element)) for element_type, element in self.elements.items()]
+        for element_type, element in items:
+            best = self.best(element_type)
+            stats = element['selectors'].get(best['selector']) if best else None
+            rows.append({
+                '元素类型': element_type,
+                '选择器': best['selector'] if best else '未缓存',
+                '描述': best['description'] if best else '未缓存',
+                '首次命中率': f"{element['first_try_hits'] / element['lookups']:.0%}" if element['lookups'] else 'N/A',
+                '查找次数': element['lookups'],
+                '平均耗时(ms)': round(stats['total_latency_ms'] / stats['hits'], 1) if stats else None,
+            })
+        return rows
+
+# ====================== 监控流水线 ======================
+class MonitoringPipeline:
+    """抓取(Selenium) → 解析/计算 → 发布 三段流水线，阶段之间用有界队列连接，各阶段在独立线程中运行"""
+    STAGES = ('fetch', 'parse', 'publish')
+    STAGE_LABELS = {'fetch': '抓取', 'parse': '解析计算', 'publish': '发布'}
+
+    def __init__(self, monitor, queue_size=2):
+        self.monitor = monitor
+        self.queues = {stage: queue.Queue(maxsize=queue_size) for stage in self.STAGES}
+        # 抓取队列只保留一个待执行的周期，浏览器跟不上时跳过而不是堆积
+        self.queues['fetch'] = queue.Queue(maxsize=1)
+        self.stats = {
+            stage: {'busy': False, 'done': 0, 'failed': 0, 'dropped': 0, 'last_seconds': None}
+            for stage in self.STAGES
+        }
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def start(self):
+        if self.threads and all(thread.is_alive() for thread in self.threads):
+            return
+        handlers = {'fetch': self._fetch, 'parse': self._parse, 'publish': self._publish}
+        self.threads = [
+            threading.Thread(target=self._run_stage, args=(stage, handlers[stage]), name=f"pipeline-{stage}", daemon=True)
+            for stage in self.STAGES
+        ]
+        for thread in self.threads:
+            thread.start()
+        logging.debug("步骤: Monitoring pipeline started.")
+
+    def stop(self):
+        for stage in self.STAGES:
+            self._handoff(stage, None)
+        self.threads = []
+
+    def is_fetching(self):
+        """抓取阶段正在执行或已有周期在排队"""
+        with self.lock:
+            busy = self.stats['fetch']['busy']
+        return busy or not self.queues['fetch'].empty()
+
+    def submit(self, search_query):
+        """提交一次抓取；上一次抓取还在排队时直接跳过，避免周期堆积
+
+        定时周期总是重新抓取，不读查询结果缓存（缓存有效期可能长于监控间隔，命中时会重复发布旧数据）。
+        """
+        try:
+            self.queues['fetch'].put_nowait({'search_query': search_query, 'submitted_at': time.time()})
+            return True
+        except queue.Full:
+            with self.lock:
+                self.stats['fetch']['dropped'] += 1
+            logging.warning("步骤: Fetch queue full, skipping this cycle.")
+            return False
+
+    def _handoff(self, stage, item):
+        """交给下游阶段；下游队列已满时丢弃最旧的一项，上游永远不会被阻塞"""
+        q = self.queues[stage]
+        while True:
+            try:
+                q.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    stale = q.get_nowait()
+                except queue.Empty:
+                    continue
+                if stale is not None:
+                    self.monitor.discard_raw(stale)
+                    with self.lock:
+                        self.stats[stage]['dropped'] += 1
+                    logging.warning(f"步骤: {stage} queue full, dropped the oldest item.")
+
+    def _run_stage(self, stage, handler):
+        q = self.queues[stage]
+        while True:
+            item = q.get()
+            if item is None:
+                break
+            if stage == 'parse':
+                # 解析阶段一次取走队列中所有待解析项，多个文件交给进程池并行处理
+                item = [item]
+                while True:
+                    try:
+                        extra = q.get_nowait()
+                    except queue.Empty:
+                        break
+                    if extra is None:
+                        q.put(None)
+                        break
+                    item.append(extra)
+            with self.lock:
+                self.stats[stage]['busy'] = True
+            stage_start = time.time()
+            ok = False
+            try:
+                ok = handler(item)
+            except Exception as e:
+                logging.error(f"Error in pipeline stage {stage}: {str(e)}")
+            finally:
+                with self.lock:
+                    stats = self.stats[stage]
+                    stats['busy'] = False
+                    stats['last_seconds'] = time.time() - stage_start
+                    stats['done' if ok else 'failed'] += 1
+
+    def _fetch(self, job):
+        raw = self.monitor.fetch_raw(job['search_query'])
+        if raw is None:
+            return False
+        self._handoff('parse', raw)
+        return True
+
+    def _parse(self, raws):
+        ok = False
+        for data in self.monitor.parse_raw_batch(raws):
+            if data is not None:
+                self._handoff('publish', data)
+                ok = True
+        return ok
+
+    def _publish(self, data):
+        self.monitor.append_snapshot(data)
+        return True
+
+    def get_status(self):
+        """每个阶段的队列深度、运行状态和最近耗时，供侧边栏显示"""
+        rows = []
+        with self.lock:
+            for stage in self.STAGES:
+                stats = self.stats[stage]
+                rows.append({
+                    '阶段': self.STAGE_LABELS[stage],
+                    '队列深度': self.queues[stage].qsize(),
+                    '运行中': '是' if stats['busy'] else '否',
+                    '完成': stats['done'],
+                    '失败': stats['failed'],
+                    '丢弃': stats['dropped'],
+                    '最近耗时(秒)': round(stats['last_seconds'], 2) if stats['last_seconds'] is not None else None,
+                })
+        return rows
+
 # ====================== StockMonitor 类 ======================
-class StockMonitor:
+class StockMonitor(IwencaiExportParser):
     def __init__(self):
         self.driver = None
+        # 下载根目录: 每个周期在其中新建独立子目录，通过 CDP 设为浏览器的下载目录
         self.download_dir = tempfile.mkdtemp()
+        self.download_retention_seconds = 600
+        self.active_download_dirs = set()
+        self.download_cleanup_thread = None
         self.profile_dir = tempfile.mkdtemp()
-        # 固化匹配缓存
-        self.cached_selectors = {
-            'search_box': {
-                'selector': "//textarea[contains(@placeholder,'请输入')]",
-                'description': "搜索框 - 请输入概念、价升量缩等，多个条",
-                'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            },
-            'search_button': {
-                'selector': "//*[contains(@class,'search-icon')]",
-                'description': "搜索按钮 - 无文本",
-                'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            },
-            'download_button': None
-        }
+        # 下载完成的文件移到暂存目录后交给解析阶段，周期目录随后即可删除
+        self.staging_dir = tempfile.mkdtemp()
+        # 解析完的原始导出文件压缩归档（按内容去重），可用 dingpan_tools.py reprocess 重新处理
+        self.archive = ExportArchive(os.path.join(APP_DATA_DIR, 'archive'))
+        self.archive_enabled = True
+        # 固化匹配缓存，持久化到磁盘并按历史成功率排序
+        self.selector_cache = SelectorCache(os.path.join(APP_DATA_DIR, 'selector_cache.json'))
         # 监控数据存储
         self.monitoring_data = {
             'timestamps': [],
             'stock_counts': [],
             'stock_lists': [],
-            'slope_data': [],
-            'closing_sequences': [],
-            'date_columns': [],
-            'stock_names': [],
+            'price_snapshots': [],
+            'feature_tables': [],
+            'snapshot_stats': [],
             'new_stocks': []
         }
+        # 跨周期累积的 (股票代码, 交易日) 收盘价库
+        self.price_store = PriceHistoryStore()
+        # 按技术指标排名的历史，每次发布只追加一列
+        self.rank_metric = '7日斜率(%)'
+        self.rank_history = RankHistory()
+        # 每次发布（或从检查点恢复）递增，仪表板按版本缓存渲染用的数据视图
+        self.data_version = 0
+        self.dashboard_cache = None
         # 监控状态
         self.is_monitoring = False
         self.last_execution_time = None
         self.next_execution_time = None
         self.monitoring_interval = 5
         self.cycle_count = 1
+        # 交易时段感知调度: 休市时跳过周期，节假日列表持久化到磁盘
+        self.holidays_path = os.path.join(APP_DATA_DIR, 'holidays.json')
+        self.trading_calendar = TradingCalendar(load_holidays(self.holidays_path))
+        self.scheduler = MonitorScheduler(self.trading_calendar)
+        # 查询模板中的 "最近N个交易日" 按磁盘缓存的交易日序列展开，每个交易日只展开一次
+        self.trading_days = TradingDayIndex(self.trading_calendar, APP_DATA_DIR)
+        self.query_templates = QueryTemplateExpander(self.trading_days)
+        # 快照变化告警: 发布时立即评估规则，配置持久化到磁盘
+        self.alerts_path = os.path.join(APP_DATA_DIR, 'alerts.json')
+        self.alert_manager = AlertManager()
+        try:
+            self.alert_manager.configure(load_alert_config(self.alerts_path))
+        except Exception as e:
+            logging.error(f"Error applying alert config: {str(e)}")
         # 延迟初始化浏览器
         self.driver_initialized = False
+        self.target_url = IWENCAI_URL
+        # 无头模式（可用环境变量 DINGPAN_HEADLESS=1 默认开启），切换后在下一次启动浏览器时生效
+        self.headless = os.environ.get('DINGPAN_HEADLESS') == '1'
+        self.window_size = (1920, 1080)
+        self.browser_name = None
+        self.driver_paths = {}
+        # 热备浏览器: 主浏览器启动后在后台预先启动一个实例，主浏览器无响应时直接接管
+        self.standby_enabled = True
+        self.standby = None
+        self.standby_lock = threading.Lock()
+        self.standby_thread = None
+        self.session_cookies = []
+        self.failover_stats = {'failovers': 0, 'retries': 0, 'cold_starts': 0, 'last_failover_seconds': None}
+        # 追加到浏览器启动参数的额外参数
+        self.browser_arguments = []
         # 登录状态
         self.is_logged_in = False
         self.login_attempted = False
@@ -82,181 +678,650 @@ class StockMonitor:
         self.downloaded_files_history = []
         # 倒计时
         self.countdown_seconds = 0
+        # 共享服务: 所有会话共用一个查询，只有一个会话拥有控制权，其余会话只读订阅
+        self.search_query = DEFAULT_SEARCH_QUERY
+        self.controller_id = None
+        self.session_last_seen = {}
+        self.session_lock = threading.Lock()
+        # 定时周期由后台调度线程触发，与打开了多少个页面无关
+        self.scheduler_stop = threading.Event()
+        self.scheduler_thread = None
+        # 后台线程（流水线、调度）没有 ScriptRunContext，st.* 调用会被丢弃；状态消息记录在这里，由页面渲染
+        self.status_messages = deque(maxlen=50)
+        # 流水线: 浏览器只允许一个线程操作，监控数据的追加和读取在锁内进行
+        self.driver_lock = threading.Lock()
+        self.data_lock = threading.RLock()
+        self.pipeline = MonitoringPipeline(self)
+        # 多个导出文件同时待解析时使用进程池
+        self.parse_pool = ParsePool()
+        # 页面加载优化: 资源拦截方案、页面加载策略以及每个方案实测的加载耗时(秒)
+        self.resource_block_profile = 'standard'
+        self.page_load_strategy = 'eager'
+        self.page_load_stats = {}
+        # 浏览器当前生效的 URL 拦截方案，在下一次加载页面前切换（测基线时临时切到 'off'）
+        self.active_block_profile = self.resource_block_profile
+        # 主浏览器启动时的图片内容设置: 只在启动时读取，跟随配置的方案而不是基线，变化时才重启浏览器
+        self.launched_block_images = None
+        # 每隔多少次计时的页面加载用 'off' 方案测一次基线（0 为不测），用于计算每周期节省的时间
+        self.baseline_every = 30
+        self.loads_since_baseline = 0
+        # 启动后的第一次加载缓存为空，不计入耗时统计
+        self.loads_since_launch = 0
+        # 隐式等待秒数，页面状态探测路径上会临时关闭
+        self.implicit_wait_seconds = 5
+        # 数据来源: 'download' 点击导数据读取导出文件, 'dom' 直接序列化页面表格（不完整时回退到下载）
+        self.data_source = 'download'
+        # 分片查询: 'off' 不拆分，'board' 按板块，'custom' 按自定义分区（每个分区是追加到查询后的条件）
+        self.shard_mode = 'off'
+        self.custom_shards = []
+        # 查询结果缓存: 每次解析完的快照按规范化查询缓存，TTL 内的重复查询（任意会话）直接返回，不再走浏览器
+        self.result_cache = QueryResultCache()
+        # 检查点: 保存最近几次快照和累积状态，重启时在第一个周期之前恢复
+        # 每发布 checkpoint_every 次或距上次写盘超过 checkpoint_interval_seconds 才写一次，关闭时补写
+        self.checkpoint_path = os.path.join(APP_DATA_DIR, 'monitor_state.ckpt')
+        self.checkpoint_snapshots = 10
+        self.checkpoint_every = 5
+        self.checkpoint_interval_seconds = 600
+        self.snapshots_since_checkpoint = 0
+        self.last_checkpoint_time = time.time()
+        self.checkpoint_info = {}
+        # 编码和写盘在后台线程完成，写盘期间又到期的检查点只保留最新的一份
+        self.checkpoint_lock = threading.Lock()
+        self.checkpoint_thread = None
+        self.pending_checkpoint = None
+        self.restore_checkpoint()
 
     # ==================== 使用 webdriver-manager 自动管理浏览器驱动 ====================
     def initialize_driver(self):
         if self.driver_initialized and self.driver:
-            logging.debug("步骤: Driver already initialized.")
-            return True
+            if self.check_driver_health():
+                logging.debug("步骤: Driver already initialized.")
+                return True
+            logging.warning("步骤: Driver is not responding, failing over...")
+            if self.fail_over():
+                return True
+            self.discard_driver()
+            # 只统计替换无响应浏览器的冷启动，首次启动和切换配置后的重启不计入
+            self.failover_stats['cold_starts'] += 1
+            self.post_status('warning', "浏览器无响应且没有可用的热备，正在冷启动新的浏览器")
         
         try:
-            return self.initialize_chrome_with_manager()
+            self.initialize_chrome_with_manager()
         except Exception as e:
             logging.error(f"Chrome initialization failed: {str(e)}")
             try:
-                return self.initialize_edge_with_manager()
+                self.initialize_edge_with_manager()
             except Exception as e2:
                 logging.error(f"Edge initialization also failed: {str(e2)}")
-                st.error(f"所有浏览器初始化失败。错误: {str(e)}")
+                self.post_status('error', f"所有浏览器初始化失败。错误: {str(e)}")
                 return False
+        self.launched_block_images = self.configured_block_images()
+        self.loads_since_launch = 0
+        if self.session_cookies:
+            self.restore_session_cookies()
+        self.start_standby()
+        return True
 
     def initialize_chrome_with_manager(self):
         """使用 webdriver-manager 自动管理 Chrome 驱动"""
         try:
             logging.debug("步骤: Initializing Chrome with webdriver-manager...")
-            
-            from selenium.webdriver.chrome.options import Options as ChromeOptions
-            from selenium.webdriver.chrome.service import Service as ChromeService
-            from webdriver_manager.chrome import ChromeDriverManager
-            
-            chrome_options = ChromeOptions()
-            
-            # 基本配置
-            chrome_options.add_argument('--no-sandbox')
-            chrome_options.add_argument('--disable-dev-shm-usage')
-            chrome_options.add_argument('--disable-blink-features=AutomationControlled')
-            chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-            chrome_options.add_experimental_option('useAutomationExtension', False)
-            
-            # 用户数据目录配置
-            if self.profile_dir:
-                chrome_options.add_argument(f'--user-data-dir={self.profile_dir}')
-            
-            # 性能优化参数
-            chrome_options.add_argument('--disable-gpu')
-            chrome_options.add_argument('--disable-extensions')
-            chrome_options.add_argument('--disable-plugins')
-            
-            # 下载配置
-            prefs = {
-                "download.default_directory": self.download_dir,
-                "download.prompt_for_download": False,
-                "download.directory_upgrade": True,
-                "safebrowsing.enabled": False,
-                "profile.default_content_settings.popups": 0,
-            }
-            chrome_options.add_experimental_option("prefs", prefs)
-            
-            # 使用 webdriver-manager 自动下载和管理 ChromeDriver
-            service = ChromeService(ChromeDriverManager().install())
-            self.driver = webdriver.Chrome(service=service, options=chrome_options)
-            
-            self.driver.maximize_window()
-            self.driver.implicitly_wait(5)
+            self.driver = self.create_chrome_driver(self.profile_dir)
+            self.browser_name = 'chrome'
             self.driver_initialized = True
             logging.debug("步骤: Chrome driver initialized successfully with webdriver-manager.")
-            st.success("✅ 已成功使用 Chrome 浏览器")
+            self.post_status('success', "✅ 已成功使用 Chrome 浏览器")
             return True
             
         except Exception as e:
             logging.error(f"Error initializing Chrome with webdriver-manager: {str(e)}")
             raise e
 
+    def create_chrome_driver(self, profile_dir):
+        """按当前配置启动一个 Chrome 实例（主浏览器和热备浏览器共用）"""
+        from selenium.webdriver.chrome.options import Options as ChromeOptions
+        from selenium.webdriver.chrome.service import Service as ChromeService
+        
+        chrome_options = ChromeOptions()
+        
+        # 基本配置
+        chrome_options.add_argument('--no-sandbox')
+        chrome_options.add_argument('--disable-dev-shm-usage')
+        chrome_options.add_argument('--disable-blink-features=AutomationControlled')
+        chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
+        chrome_options.add_experimental_option('useAutomationExtension', False)
+        
+        # 用户数据目录配置
+        if profile_dir:
+            chrome_options.add_argument(f'--user-data-dir={profile_dir}')
+        
+        # 性能优化参数
+        chrome_options.add_argument('--disable-gpu')
+        chrome_options.add_argument('--disable-extensions')
+        chrome_options.add_argument('--disable-plugins')
+        self.apply_window_options(chrome_options)
+        for argument in self.browser_arguments:
+            chrome_options.add_argument(argument)
+        
+        # 下载配置
+        prefs = {
+            "download.default_directory": self.download_dir,
+            "download.prompt_for_download": False,
+            "download.directory_upgrade": True,
+            "safebrowsing.enabled": False,
+            "profile.default_content_settings.popups": 0,
+            # 分片查询会在多个标签页中连续导出，允许同一站点自动下载多个文件
+            "profile.default_content_setting_values.automatic_downloads": 1,
+        }
+        self.apply_page_load_options(chrome_options, prefs)
+        chrome_options.add_experimental_option("prefs", prefs)
+        
+        # 使用 webdriver-manager 自动下载和管理驱动，解析出的路径在进程内复用
+        service = ChromeService(self.driver_executable('chrome'))
+        driver = webdriver.Chrome(service=service, options=chrome_options)
+        self.prepare_driver(driver)
+        return driver
+
     def initialize_edge_with_manager(self):
         """使用 webdriver-manager 自动管理 Edge 驱动"""
         try:
             logging.debug("步骤: Initializing Edge with webdriver-manager...")
-            
-            from selenium.webdriver.edge.options import Options as EdgeOptions
-            from selenium.webdriver.edge.service import Service as EdgeService
-            from webdriver_manager.microsoft import EdgeChromiumDriverManager
-            
-            edge_options = EdgeOptions()
-            
-            # 基本配置
-            edge_options.add_argument('--no-sandbox')
-            edge_options.add_argument('--disable-dev-shm-usage')
-            edge_options.add_argument('--disable-blink-features=AutomationControlled')
-            edge_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-            edge_options.add_experimental_option('useAutomationExtension', False)
-            
-            # 用户数据目录配置
-            if self.profile_dir:
-                edge_options.add_argument(f'--user-data-dir={self.profile_dir}')
-            
-            # 性能优化参数
-            edge_options.add_argument('--disable-gpu')
-            edge_options.add_argument('--disable-extensions')
-            edge_options.add_argument('--disable-plugins')
-            
-            # 下载配置
-            prefs = {
-                "download.default_directory": self.download_dir,
-                "download.prompt_for_download": False,
-                "download.directory_upgrade": True,
-                "safebrowsing.enabled": False,
-                "profile.default_content_settings.popups": 0,
-            }
-            edge_options.add_experimental_option("prefs", prefs)
-            
-            # 使用 webdriver-manager 自动下载和管理 EdgeDriver
-            service = EdgeService(EdgeChromiumDriverManager().install())
-            self.driver = webdriver.Edge(service=service, options=edge_options)
-            
-            self.driver.maximize_window()
-            self.driver.implicitly_wait(5)
+            self.driver = self.create_edge_driver(self.profile_dir)
+            self.browser_name = 'edge'
             self.driver_initialized = True
             logging.debug("步骤: Edge driver initialized successfully with webdriver-manager.")
-            st.success("✅ 已成功使用 Edge 浏览器")
+            self.post_status('success', "✅ 已成功使用 Edge 浏览器")
             return True
             
         except Exception as e:
             logging.error(f"Error initializing Edge with webdriver-manager: {str(e)}")
             raise e
 
+    def create_edge_driver(self, profile_dir):
+        """按当前配置启动一个 Edge 实例（主浏览器和热备浏览器共用）"""
+        from selenium.webdriver.edge.options import Options as EdgeOptions
+        from selenium.webdriver.edge.service import Service as EdgeService
+        
+        edge_options = EdgeOptions()
+        
+        # 基本配置
+        edge_options.add_argument('--no-sandbox')
+        edge_options.add_argument('--disable-dev-shm-usage')
+        edge_options.add_argument('--disable-blink-features=AutomationControlled')
+        edge_options.add_experimental_option("excludeSwitches", ["enable-automation"])
+        edge_options.add_experimental_option('useAutomationExtension', False)
+        
+        # 用户数据目录配置
+        if profile_dir:
+            edge_options.add_argument(f'--user-data-dir={profile_dir}')
+        
+        # 性能优化参数
+        edge_options.add_argument('--disable-gpu')
+        edge_options.add_argument('--disable-extensions')
+        edge_options.add_argument('--disable-plugins')
+        self.apply_window_options(edge_options)
+        for argument in self.browser_arguments:
+            edge_options.add_argument(argument)
+        
+        # 下载配置
+        prefs = {
+            "download.default_directory": self.download_dir,
+            "download.prompt_for_download": False,
+            "download.directory_upgrade": True,
+            "safebrowsing.enabled": False,
+            "profile.default_content_settings.popups": 0,
+            # 分片查询会在多个标签页中连续导出，允许同一站点自动下载多个文件
+            "profile.default_content_setting_values.automatic_downloads": 1,
+        }
+        self.apply_page_load_options(edge_options, prefs)
+        edge_options.add_experimental_option("prefs", prefs)
+        
+        # 使用 webdriver-manager 自动下载和管理驱动，解析出的路径在进程内复用
+        service = EdgeService(self.driver_executable('edge'))
+        driver = webdriver.Edge(service=service, options=edge_options)
+        self.prepare_driver(driver)
+        return driver
+
+    def driver_executable(self, browser_name):
+        """webdriver-manager 解析驱动路径需要访问缓存甚至网络，每种浏览器只解析一次"""
+        if browser_name not in self.driver_paths:
+            if browser_name == 'chrome':
+                from webdriver_manager.chrome import ChromeDriverManager
+                self.driver_paths[browser_name] = ChromeDriverManager().install()
+            else:
+                from webdriver_manager.microsoft import EdgeChromiumDriverManager
+                self.driver_paths[browser_name] = EdgeChromiumDriverManager().install()
+        return self.driver_paths[browser_name]
+
+    def prepare_driver(self, driver):
+        self.configure_window(driver)
+        self.set_download_directory(self.download_dir, driver)
+        driver.implicitly_wait(self.implicit_wait_seconds)
+        self.apply_resource_blocking(driver)
+
+    # ==================== 健康检查与热备浏览器 ====================
+    def check_driver_health(self, driver=None):
+        """驱动进程仍在运行，且浏览器能执行脚本"""
+        driver = driver or self.driver
+        if driver is None:
+            return False
+        process = getattr(getattr(driver, 'service', None), 'process', None)
+        if process is not None and process.poll() is not None:
+            return False
+        try:
+            return driver.execute_script("return document.readyState") is not None
+        except Exception as e:
+            logging.warning(f"Driver health check failed: {str(e)}")
+            return False
+
+    def start_standby(self):
+        """后台预先启动一个热备浏览器并打开问财页面，主浏览器崩溃时直接接管"""
+        if not self.standby_enabled or self.browser_name is None:
+            return
+        with self.standby_lock:
+            if self.standby is not None or (self.standby_thread and self.standby_thread.is_alive()):
+                return
+            self.standby_thread = threading.Thread(target=self._spawn_standby, name="standby-driver", daemon=True)
+            self.standby_thread.start()
+
+    def _spawn_standby(self):
+        profile_dir = tempfile.mkdtemp()
+        block_images = self.configured_block_images()
+        start = time.time()
+        try:
+            create = self.create_chrome_driver if self.browser_name == 'chrome' else self.create_edge_driver
+            driver = create(profile_dir)
+            driver.get(self.target_url)
+        except Exception as e:
+            logging.error(f"Error starting standby driver: {str(e)}")
+            shutil.rmtree(profile_dir, ignore_errors=True)
+            return
+        with self.standby_lock:
+            keep = self.standby_enabled and self.standby is None
+            if keep:
+                self.standby = {'driver': driver, 'profile_dir': profile_dir, 'headless': self.headless,
+                                'block_images': block_images}
+        if not keep:
+            self.quit_driver(driver, profile_dir)
+            return
+        logging.debug(f"步骤: Standby driver ready after {time.time() - start:.1f}s.")
+
+    def discard_standby(self):
+        with self.standby_lock:
+            standby, self.standby = self.standby, None
+        if standby:
+            self.quit_driver(standby['driver'], standby['profile_dir'])
+
+    def set_standby_enabled(self, enabled):
+        if enabled == self.standby_enabled:
+            return
+        self.standby_enabled = enabled
+        if enabled and self.driver_initialized:
+            self.start_standby()
+        elif not enabled:
+            threading.Thread(target=self.discard_standby, name="standby-discard", daemon=True).start()
+
+    @staticmethod
+    def quit_driver(driver, profile_dir=None):
+        try:
+            driver.quit()
+        except Exception as e:
+            logging.warning(f"Error closing browser: {str(e)}")
+        if profile_dir:
+            shutil.rmtree(profile_dir, ignore_errors=True)
+
+    def fail_over(self):
+        """用热备浏览器替换无响应的主浏览器，旧实例在后台关闭，随后补充新的热备；没有可用热备时返回 False"""
+        start = time.time()
+        with self.standby_lock:
+            standby, self.standby = self.standby, None
+        if standby is None:
+            return False
+        if (standby['headless'] != self.headless or standby['block_images'] != self.configured_block_images()
+                or not self.check_driver_health(standby['driver'])):
+            threading.Thread(target=self.quit_driver, args=(standby['driver'], standby['profile_dir']),
+                             daemon=True).start()
+            return False
+        
+        old_driver, old_profile_dir = self.driver, self.profile_dir
+        self.driver = standby['driver']
+        self.profile_dir = standby['profile_dir']
+        self.launched_block_images = standby['block_images']
+        self.is_logged_in = False
+        self.loads_since_launch = 0
+        threading.Thread(target=self.quit_driver, args=(old_driver, old_profile_dir), daemon=True).start()
+        self.apply_resource_blocking()
+        self.restore_session_cookies()
+        self.failover_stats['failovers'] += 1
+        self.failover_stats['last_failover_seconds'] = time.time() - start
+        logging.warning(f"步骤: Failed over to standby driver in {time.time() - start:.2f}s.")
+        self.post_status('warning', f"浏览器无响应，已切换到热备浏览器（{time.time() - start:.1f} 秒）")
+        self.start_standby()
+        return True
+
+    def discard_driver(self):
+        """没有热备时丢弃无响应的浏览器，下次冷启动使用新的用户数据目录（旧实例可能仍占用原目录）"""
+        old_driver, old_profile_dir = self.driver, self.profile_dir
+        self.driver = None
+        self.driver_initialized = False
+        self.is_logged_in = False
+        self.profile_dir = tempfile.mkdtemp()
+        threading.Thread(target=self.quit_driver, args=(old_driver, old_profile_dir), daemon=True).start()
+
+    def save_session_cookies(self):
+        try:
+            self.session_cookies = self.driver.get_cookies()
+        except Exception as e:
+            logging.warning(f"Could not read session cookies: {str(e)}")
+
+    def restore_session_cookies(self):
+        """把主浏览器最近一次成功周期的 cookie（含登录状态）写入接管的浏览器"""
+        if not self.session_cookies:
+            return
+        try:
+            if self.target_url not in self.driver.current_url:
+                self.driver.get(self.target_url)
+            for cookie in self.session_cookies:
+                try:
+                    self.driver.add_cookie(cookie)
+                except Exception:
+                    continue
+            logging.debug(f"步骤: Restored {len(self.session_cookies)} session cookies.")
+        except Exception as e:
+            logging.warning(f"Could not restore session cookies: {str(e)}")
+
+    # ==================== 窗口与无头模式 ====================
+    def apply_window_options(self, options):
+        """无头模式使用 --headless=new 和显式窗口大小，页面布局与有界面时一致"""
+        if self.headless:
+            for argument in HEADLESS_ARGUMENTS:
+                options.add_argument(argument)
+            options.add_argument(f'--window-size={self.window_size[0]},{self.window_size[1]}')
+        else:
+            options.add_argument('--start-maximized')
+
+    def configure_window(self, driver=None):
+        driver = driver or self.driver
+        try:
+            if self.headless:
+                driver.set_window_size(*self.window_size)
+            else:
+                driver.maximize_window()
+        except Exception as e:
+            logging.warning(f"Could not configure browser window: {str(e)}")
+
+    def set_download_directory(self, path, driver=None):
+        """通过 CDP 允许下载并指定目录；无头模式默认拒绝下载，必须显式设置"""
+        driver = driver or self.driver
+        params = {'behavior': 'allow', 'downloadPath': path}
+        try:
+            driver.execute_cdp_cmd('Browser.setDownloadBehavior', params)
+        except Exception:
+            # 旧版本浏览器只支持页面级的下载设置
+            driver.execute_cdp_cmd('Page.setDownloadBehavior', params)
+
+    def set_headless(self, headless):
+        """切换无头模式，已启动的浏览器在当前周期结束后重启"""
+        if headless == self.headless:
+            return
+        self.headless = headless
+        if self.driver_initialized:
+            threading.Thread(target=self.restart_driver, name="driver-restart", daemon=True).start()
+
+    def restart_driver(self):
+        """关闭当前浏览器，下一个周期按最新配置重新启动（用户数据目录保留，登录状态随之保留）"""
+        with self.driver_lock:
+            self.close_driver()
+        logging.debug(f"步骤: Browser closed, next cycle starts it with headless={self.headless}.")
+
+    def close_driver(self):
+        """关闭主浏览器和按旧配置启动的热备浏览器（调用方持有 driver_lock）"""
+        if self.driver:
+            try:
+                self.driver.quit()
+            except Exception as e:
+                logging.warning(f"Error closing browser: {str(e)}")
+        self.driver = None
+        self.driver_initialized = False
+        self.is_logged_in = False
+        self.discard_standby()
+
+    # ==================== 页面资源拦截 ====================
+    def apply_page_load_options(self, options, prefs):
+        """设置页面加载策略，并按配置的拦截方案通过内容设置禁用图片"""
+        options.page_load_strategy = self.page_load_strategy
+        if self.configured_block_images():
+            prefs["profile.managed_default_content_settings.images"] = 2
+
+    def configured_block_images(self):
+        return RESOURCE_BLOCK_PROFILES.get(self.resource_block_profile, RESOURCE_BLOCK_PROFILES['off'])['block_images']
+
+    def apply_resource_blocking(self, driver=None):
+        """通过 CDP Network.setBlockedURLs 拦截当前方案中的资源，可在运行中切换"""
+        driver = driver or self.driver
+        if not driver:
+            return False
+        profile = RESOURCE_BLOCK_PROFILES.get(self.active_block_profile, RESOURCE_BLOCK_PROFILES['off'])
+        try:
+            driver.execute_cdp_cmd('Network.enable', {})
+            driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': profile['blocked_urls']})
+            logging.debug(f"步骤: Resource blocking profile '{self.active_block_profile}' applied "
+                          f"with {len(profile['blocked_urls'])} URL patterns.")
+            return True
+        except Exception as e:
+            logging.warning(f"Could not apply resource blocking: {str(e)}")
+            return False
+
+    def set_resource_block_profile(self, profile_name):
+        """修改配置的方案，在下一次加载页面前生效（见 activate_block_profile）"""
+        if profile_name in RESOURCE_BLOCK_PROFILES:
+            self.resource_block_profile = profile_name
+
+    def activate_block_profile(self, profile_name):
+        """让浏览器使用指定方案的 URL 拦截（调用方持有 driver_lock），运行中切换，不重启浏览器
+
+        图片内容设置是启动参数，只跟随配置的方案: 配置改变了图片设置时关闭浏览器，由随后的 initialize_driver
+        按新配置启动。测基线时只放开 URL 拦截，图片设置保持启动时的状态，所以基线不会引起重启。
+        """
+        if self.driver_initialized and self.launched_block_images != self.configured_block_images():
+            logging.debug(f"步骤: Restarting browser for the image setting of profile '{self.resource_block_profile}'.")
+            self.active_block_profile = profile_name
+            self.close_driver()
+            return
+        if profile_name == self.active_block_profile:
+            return
+        self.active_block_profile = profile_name
+        if not self.driver_initialized:
+            return
+        self.apply_resource_blocking()
+        standby = self.standby
+        if standby:
+            self.apply_resource_blocking(standby['driver'])
+
+    def baseline_due(self):
+        if not self.baseline_every or self.resource_block_profile == 'off':
+            return False
+        return not self.page_load_stats.get('off') or self.loads_since_baseline >= self.baseline_every
+
+    def record_page_load(self, seconds):
+        self.loads_since_launch += 1
+        if self.loads_since_launch == 1:
+            logging.debug(f"步骤: First page load after launch took {seconds:.2f}s, not counted.")
+            return
+        profile_name = self.active_block_profile
+        samples = self.page_load_stats.setdefault(profile_name, [])
+        samples.append(seconds)
+        del samples[:-50]
+        self.loads_since_baseline = 0 if profile_name == 'off' else self.loads_since_baseline + 1
+        logging.debug(f"步骤: Page load took {seconds:.2f}s with profile '{profile_name}'.")
+
+    def get_page_load_summary(self):
+        """每个拦截方案的平均页面加载耗时，以及相对不拦截时每个周期节省的时间"""
+        summary = []
+        baseline = self.page_load_stats.get('off')
+        baseline_avg = float(np.mean(baseline)) if baseline else None
+        for profile_name, samples in self.page_load_stats.items():
+            if not samples:
+                continue
+            avg = float(np.mean(samples))
+            row = {
+                '拦截方案': profile_name,
+                '样本数': len(samples),
+                '平均加载(秒)': round(avg, 2),
+                '每周期节省(秒)': None,
+            }
+            if baseline_avg is not None and profile_name != 'off':
+                row['每周期节省(秒)'] = round(baseline_avg - avg, 2)
+            summary.append(row)
+        return summary
+
     # ==================== 简化的导航方法 ====================
+    def post_status(self, level, message):
+        """记录一条状态消息（level 为 success/info/warning/error），同时写日志，任何线程都可以调用"""
+        self.status_messages.append({'time': datetime.now(), 'level': level, 'message': message})
+        log = {'error': logging.error, 'warning': logging.warning}.get(level, logging.info)
+        log(f"Status: {message}")
+
+    def show_status_messages(self, limit=5):
+        """在侧边栏显示最近的状态消息（新的在前）"""
+        messages = list(self.status_messages)[-limit:][::-1]
+        if not messages:
+            return
+        st.sidebar.subheader("运行状态")
+        for item in messages:
+            getattr(st.sidebar, item['level'])(f"{item['time'].strftime('%H:%M:%S')} {item['message']}")
+
     def ensure_navigation(self, force_refresh=False):
+        # 拦截方案在加载页面前切换；基线到期时本次加载不拦截，之后的加载恢复配置的方案
+        baseline = force_refresh and self.baseline_due()
+        self.activate_block_profile('off' if baseline else self.resource_block_profile)
         if not self.initialize_driver():
             logging.error("步骤: Failed to initialize driver for navigation.")
-            st.error("❌ 浏览器初始化失败，请检查控制台输出")
+            self.post_status('error', "❌ 浏览器初始化失败，请检查控制台输出")
             return False
         
         try:
             logging.debug("步骤: Ensuring navigation...")
-            target_url = "https://www.iwencai.com/unifiedwap/"
+            target_url = self.target_url
+            load_start = time.time()
+            navigated = False
             
             if force_refresh:
                 logging.debug(f"步骤: Force refreshing to {target_url}")
+                if baseline and self.loads_since_launch == 0:
+                    # 浏览器刚启动，第一次加载不计时，先预热一次再测基线
+                    self.driver.get(target_url)
+                    self.loads_since_launch += 1
+                    load_start = time.time()
                 self.driver.get(target_url)
+                navigated = True
             else:
                 current_url = self.driver.current_url
                 if target_url not in current_url:
                     logging.debug(f"步骤: Navigating to {target_url}")
                     self.driver.get(target_url)
+                    navigated = True
             
             WebDriverWait(self.driver, 10).until(
                 EC.presence_of_element_located((By.TAG_NAME, "body"))
             )
+            if navigated:
+                self.record_page_load(time.time() - load_start)
             
             logging.debug("步骤: Navigation successful.")
             return True
             
         except Exception as e:
             logging.error(f"Error in navigation: {str(e)}")
-            st.error(f"❌ 导航失败: {str(e)}")
+            self.post_status('error', f"❌ 导航失败: {str(e)}")
             return False
 
+    # ==================== 页面状态探测 ====================
+    @contextmanager
+    def implicit_wait_disabled(self):
+        """临时关闭隐式等待，避免每个未命中的 find_elements 阻塞整个等待时间"""
+        self.driver.implicitly_wait(0)
+        try:
+            yield
+        finally:
+            self.driver.implicitly_wait(self.implicit_wait_seconds)
+
+    @property
+    def cached_selectors(self):
+        return {
+            element_type: self.selector_cache.best(element_type)
+            for element_type in ('search_box', 'search_button', 'download_button')
+        }
+
+    def selectors_with_hint(self, element_type, selectors):
+        """按缓存中的历史成功率排序候选选择器"""
+        return self.selector_cache.ranked(element_type, selectors)
+
+    def probe_page_state(self, groups=('login', 'download', 'alternative_download', 'result')):
+        """单次 execute_script 返回登录弹窗、下载候选和结果标记的存在与可见状态，失败时返回 None"""
+        all_groups = {
+            'login': {'selectors': LOGIN_INDICATOR_SELECTORS, 'require_enabled': False},
+            'download': {
+                'selectors': self.selectors_with_hint('download_button', DOWNLOAD_BUTTON_SELECTORS),
+                'require_enabled': True
+            },
+            'alternative_download': {
+                'selectors': self.selectors_with_hint('alternative_download_button', ALTERNATIVE_DOWNLOAD_SELECTORS),
+                'require_enabled': True
+            },
+            'result': {'selectors': RESULT_MARKER_SELECTORS, 'require_enabled': False},
+        }
+        try:
+            probe_start = time.time()
+            with self.implicit_wait_disabled():
+                state = self.driver.execute_script(PAGE_STATE_PROBE_JS, {name: all_groups[name] for name in groups})
+            state['latency_ms'] = (time.time() - probe_start) * 1000
+            logging.debug(f"步骤: Page state probed in {(time.time() - probe_start) * 1000:.0f}ms: "
+                          f"{ {name: state[name]['present'] for name in groups} }")
+            return state
+        except Exception as e:
+            logging.warning(f"Page state probe failed: {str(e)}")
+            return None
+
+    def wait_for_results(self, timeout=5, poll_interval=0.5):
+        """轮询页面状态直到结果表格或下载按钮出现，替代固定等待"""
+        start_time = time.time()
+        while time.time() - start_time < timeout:
+            state = self.probe_page_state(groups=('download', 'result'))
+            if state is None:
+                time.sleep(max(0, timeout - (time.time() - start_time)))
+                return False
+            if state['download']['present'] or state['result']['present']:
+                logging.debug(f"步骤: Results ready after {time.time() - start_time:.2f}s.")
+                return True
+            time.sleep(poll_interval)
+        logging.debug("步骤: Result markers not detected before timeout.")
+        return False
+
     # ==================== 简化的登录处理 ====================
     def handle_login_smartly(self):
         """简化的登录处理"""
         try:
             logging.debug("步骤: Checking for login requirement...")
             
-            login_indicators = [
-                "//div[contains(text(), '扫码登录')]",
-                "//div[contains(@class, 'login')]",
-                "//div[contains(@class, 'qrcode')]",
-            ]
+            state = self.probe_page_state(groups=('login',))
+            if state is not None:
+                if state['login']['present']:
+                    logging.debug(f"步骤: Login popup detected with: {state['login']['first']['selector']}")
+                    return self.wait_for_login_completion()
+                logging.debug("步骤: No login required.")
+                return True
             
-            for selector in login_indicators:
-                try:
-                    elements = self.driver.find_elements(By.XPATH, selector)
-                    for element in elements:
-                        if element.is_displayed():
-                            logging.debug(f"步骤: Login popup detected with: {selector}")
-                            return self.wait_for_login_completion()
-                except:
-                    continue
+            with self.implicit_wait_disabled():
+                for selector in LOGIN_INDICATOR_SELECTORS:
+                    try:
+                        elements = self.driver.find_elements(By.XPATH, selector)
+                        for element in elements:
+                            if element.is_displayed():
+                                logging.debug(f"步骤: Login popup detected with: {selector}")
+                                return self.wait_for_login_completion()
+                    except:
+                        continue
             
             logging.debug("步骤: No login required.")
             return True
@@ -272,14 +1337,19 @@ class StockMonitor:
         start_time = time.time()
         while time.time() - start_time < timeout:
             login_visible = False
-            try:
-                login_elements = self.driver.find_elements(By.XPATH, "//div[contains(text(), '扫码登录')]")
-                for element in login_elements:
-                    if element.is_displayed():
-                        login_visible = True
-                        break
-            except:
-                pass
+            state = self.probe_page_state(groups=('login',))
+            if state is not None:
+                login_visible = state['login']['present']
+            else:
+                try:
+                    with self.implicit_wait_disabled():
+                        login_elements = self.driver.find_elements(By.XPATH, "//div[contains(text(), '扫码登录')]")
+                        for element in login_elements:
+                            if element.is_displayed():
+                                login_visible = True
+                                break
+                except:
+                    pass
             
             if not login_visible:
                 self.is_logged_in = True
@@ -294,20 +1364,22 @@ class StockMonitor:
 
     # ==================== 改进的下载流程 ====================
     def smart_download_flow_optimized(self):
-        """改进的下载流程"""
+        """改进的下载流程，文件下载到本周期独立的目录，返回下载完成的文件路径"""
+        cycle_dir = None
         try:
             logging.debug("步骤: Starting optimized download flow...")
             
-            download_start_time = time.time()
-            
-            self.clean_download_directory()
+            cycle_dir = self.begin_cycle_download()
+            if cycle_dir is None:
+                return None
             
-            btn = self.find_and_cache_download_button()
+            page_state = self.probe_page_state(groups=('download', 'alternative_download'))
+            btn = self.find_and_cache_download_button(page_state)
             if not btn:
                 logging.error("步骤: Download button not found.")
-                btn = self.find_alternative_download_button()
+                btn = self.find_alternative_download_button(page_state)
                 if not btn:
-                    return False
+                    return None
             
             logging.debug("步骤: Clicking download button...")
             try:
@@ -320,7 +1392,7 @@ class StockMonitor:
                     btn.click()
                 except Exception as e2:
                     logging.error(f"Regular click also failed: {str(e2)}")
-                    return False
+                    return None
             
             time.sleep(3)
             if not self.is_logged_in:
@@ -335,768 +1407,822 @@ class StockMonitor:
                     except:
                         btn.click()
             
-            return self.wait_for_download_complete_fast(download_start_time, timeout=60)
+            return self.wait_for_download_complete_fast(cycle_dir, timeout=60)
             
         except Exception as e:
             logging.error(f"Error in download flow: {str(e)}")
-            return False
+            return None
+        finally:
+            if cycle_dir:
+                self.active_download_dirs.discard(cycle_dir)
 
-    def clean_download_directory(self):
-        """清空下载目录"""
+    def begin_cycle_download(self):
+        """为本周期新建独立的下载目录，并通过 CDP Browser.setDownloadBehavior 设为浏览器的下载目录"""
+        cycle_dir = os.path.join(self.download_dir, f"cycle_{time.time_ns()}")
         try:
-            files = os.listdir(self.download_dir)
-            for file in files:
-                file_path = os.path.join(self.download_dir, file)
-                try:
-                    if os.path.isfile(file_path):
-                        os.remove(file_path)
-                        logging.debug(f"步骤: Removed old file: {file}")
-                except Exception as e:
-                    logging.warning(f"Could not remove file {file}: {str(e)}")
+            os.makedirs(cycle_dir)
+            self.active_download_dirs.add(cycle_dir)
+            self.set_download_directory(cycle_dir)
+            logging.debug(f"步骤: Download directory for this cycle: {cycle_dir}")
+            self.start_download_cleanup()
+            return cycle_dir
         except Exception as e:
-            logging.error(f"Error cleaning download directory: {str(e)}")
+            logging.error(f"Error preparing download directory: {str(e)}")
+            self.active_download_dirs.discard(cycle_dir)
+            return None
 
-    def find_alternative_download_button(self):
+    def start_download_cleanup(self, interval_seconds=60):
+        """后台线程定期删除超过保留时间的周期下载目录（例如超时后浏览器才写完的文件）"""
+        if self.download_cleanup_thread and self.download_cleanup_thread.is_alive():
+            return
+        
+        def cleanup_loop():
+            while not self.scheduler_stop.wait(interval_seconds):
+                self.cleanup_download_dirs()
+        
+        self.download_cleanup_thread = threading.Thread(target=cleanup_loop, name="download-cleanup", daemon=True)
+        self.download_cleanup_thread.start()
+
+    def cleanup_download_dirs(self):
+        """删除超过保留时间且不在使用中的周期下载目录"""
+        cutoff = time.time() - self.download_retention_seconds
+        removed = 0
+        try:
+            with os.scandir(self.download_dir) as entries:
+                for entry in entries:
+                    if not entry.is_dir() or entry.path in self.active_download_dirs:
+                        continue
+                    if entry.stat().st_mtime < cutoff:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                        removed += 1
+        except Exception as e:
+            logging.error(f"Error cleaning download directories: {str(e)}")
+        if removed:
+            logging.debug(f"步骤: Removed {removed} expired download directories.")
+        return removed
+
+    def find_alternative_download_button(self, page_state=None):
         """尝试其他下载按钮选择器"""
-        alternative_selectors = [
-            "//*[contains(@class, 'download')]",
-            "//*[contains(text(), '导出')]",
-            "//*[contains(text(), '下载')]",
-            "//button[contains(@class, 'btn-download')]",
-            "//a[contains(@class, 'download')]",
-            "//span[contains(text(), '导出')]",
-            "//span[contains(text(), '下载')]",
-        ]
+        state = page_state or self.probe_page_state(groups=('alternative_download',))
+        if state is not None and 'alternative_download' in state:
+            hit = self.record_probe_lookup('alternative_download_button', state, 'alternative_download', "备用下载按钮")
+            if hit:
+                logging.debug(f"步骤: Alternative download button found: {hit['selector']} - {hit['text'] or '无文本'}")
+                return hit['element']
+            logging.warning("步骤: No alternative download button found.")
+            return None
         
-        for sel in alternative_selectors:
-            try:
-                elements = self.driver.find_elements(By.XPATH, sel)
-                for element in elements:
-                    if element.is_displayed() and element.is_enabled():
-                        text = element.text or '无文本'
-                        logging.debug(f"步骤: Alternative download button found: {sel} - {text}")
-                        return element
-            except:
-                continue
+        element = self.find_with_ranked_selectors(
+            'alternative_download_button', ALTERNATIVE_DOWNLOAD_SELECTORS, "备用下载按钮", require_enabled=True
+        )
+        if element:
+            return element
         
         logging.warning("步骤: No alternative download button found.")
         return None
 
-    def wait_for_download_complete_fast(self, start_time, timeout=60):
-        """改进的下载等待方法，基于时间戳检测新文件"""
+    def wait_for_download_complete_fast(self, cycle_dir, timeout=60):
+        """等待本周期下载目录中出现下载完成的文件，目录只属于本周期，无需按时间戳比较"""
         try:
             logging.debug("步骤: Waiting for download...")
-            temp_extensions = ['.crdownload', '.part', '.tmp', '.temp']
-            
-            wait_start_time = time.time()
-            
-            while time.time() - wait_start_time < timeout:
-                try:
-                    files = os.listdir(self.download_dir)
-                    logging.debug(f"步骤: Current files in directory: {files}")
-                    
-                    for file in files:
-                        file_path = os.path.join(self.download_dir, file)
-                        
-                        if any(file.endswith(ext) for ext in temp_extensions):
-                            logging.debug(f"步骤: Skipping temp file: {file}")
-                            continue
-                            
-                        if os.path.getsize(file_path) > 0:
-                            mtime = os.path.getmtime(file_path)
-                            ctime = os.path.getctime(file_path)
-                            file_time = max(mtime, ctime)
-                            
-                            if file_time >= start_time:
-                                logging.debug(f"步骤: Download completed with file: {file}")
-                                logging.debug(f"步骤: File time: {file_time}, Start time: {start_time}")
-                                return True
-                            
-                            file_size = os.path.getsize(file_path)
-                            logging.debug(f"步骤: File {file} - Size: {file_size}, Time: {file_time}")
-                except Exception as e:
-                    logging.error(f"Error checking download directory: {str(e)}")
-                
-                time.sleep(2)
-            
-            files = os.listdir(self.download_dir)
-            if files:
-                logging.warning(f"步骤: Timeout but found files: {files}")
-                for file in files:
-                    file_path = os.path.join(self.download_dir, file)
-                    if os.path.getsize(file_path) > 0:
-                        logging.warning(f"步骤: Using existing file: {file}")
-                        return True
-                
+            deadline = time.time() + timeout
+            while time.time() < deadline:
+                file_path = self.find_completed_download(cycle_dir)
+                if file_path:
+                    logging.debug(f"步骤: Download completed with file: {os.path.basename(file_path)}")
+                    return file_path
+                time.sleep(0.5)
             logging.warning("步骤: Download timeout.")
-            return False
-            
+            return None
         except Exception as e:
             logging.error(f"Error waiting for download: {str(e)}")
-            return False
+            return None
 
-    def find_and_cache_download_button(self):
+    def find_completed_download(self, cycle_dir):
+        """周期目录中已下载完成（非临时文件且非空）的文件"""
+        files = self.find_completed_downloads(cycle_dir)
+        return files[0] if files else None
+
+    def find_completed_downloads(self, cycle_dir):
+        temp_extensions = ('.crdownload', '.part', '.tmp', '.temp')
+        with os.scandir(cycle_dir) as entries:
+            return sorted(
+                entry.path for entry in entries
+                if entry.is_file() and not entry.name.endswith(temp_extensions) and entry.stat().st_size > 0
+            )
+
+    def find_and_cache_download_button(self, page_state=None):
         logging.debug("步骤: Searching for download button...")
-        selectors = [
-            "//div[contains(@class, 'item')]//div[contains(@class, 'download')]/../div[contains(@class, 'text') and text()='导数据']",
-            "//div[contains(@class, 'text') and text()='导数据']",
-            "//div[contains(@class, 'item')]//div[contains(@class, 'download')]",
-            "//button[contains(text(), '导数据')]",
-            "//span[contains(text(), '导数据')]",
-            "//a[contains(text(), '导数据')]",
-            "//div[contains(text(), '导数据')]",
-        ]
-        for sel in selectors:
+        state = page_state or self.probe_page_state(groups=('download',))
+        if state is not None and 'download' in state:
+            hit = self.record_probe_lookup('download_button', state, 'download', "下载按钮")
+            if hit:
+                logging.debug(f"步骤: Download button found: {hit['selector']}")
+                return hit['element']
+            logging.warning("步骤: No download button found.")
+            return None
+        
+        element = self.find_with_ranked_selectors(
+            'download_button', DOWNLOAD_BUTTON_SELECTORS, "下载按钮", require_enabled=True
+        )
+        if element:
+            return element
+        logging.warning("步骤: No download button found.")
+        return None
+
+    def record_probe_lookup(self, element_type, state, group, label):
+        """把页面探测结果记入选择器缓存，返回命中的候选"""
+        ranked = [match['selector'] for match in state[group]['matches']]
+        hit = state[group]['first']
+        self.selector_cache.record_lookup(
+            element_type,
+            ranked,
+            hit['selector'] if hit else None,
+            state.get('latency_ms', 0.0),
+            f"{label} - {hit['text'] or '无文本'}" if hit else ""
+        )
+        return hit
+
+    def find_with_ranked_selectors(self, element_type, selectors, label, require_enabled=False, wait_first=False):
+        """按历史成功率依次尝试选择器，只有第一个候选使用隐式等待，命中结果写回缓存"""
+        ranked = self.selectors_with_hint(element_type, selectors)
+        for i, sel in enumerate(ranked):
+            lookup_start = time.time()
             try:
-                elements = self.driver.find_elements(By.XPATH, sel)
+                if i == 0 and wait_first:
+                    elements = self.driver.find_elements(By.XPATH, sel)
+                else:
+                    with self.implicit_wait_disabled():
+                        elements = self.driver.find_elements(By.XPATH, sel)
                 for element in elements:
-                    if element.is_displayed() and element.is_enabled():
+                    if element.is_displayed() and (element.is_enabled() or not require_enabled):
                         text = element.text or '无文本'
-                        self.save_selector_to_cache('download_button', sel, f"下载按钮 - {text}")
-                        logging.debug(f"步骤: Download button found: {sel}")
+                        latency_ms = (time.time() - lookup_start) * 1000
+                        self.selector_cache.record_lookup(element_type, ranked, sel, latency_ms, f"{label} - {text}")
+                        logging.debug(f"步骤: {element_type} found: {sel}")
                         return element
             except:
                 continue
-        logging.warning("步骤: No download button found.")
+        self.selector_cache.record_lookup(element_type, ranked, None, 0.0)
         return None
 
-    def save_selector_to_cache(self, element_type, selector, description=""):
-        self.cached_selectors[element_type] = {
-            'selector': selector,
-            'description': description,
-            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }
-
     # ==================== 一键自动化 ====================
     def one_click_automation_with_refresh(self, search_query):
+        """搜索并导出数据，返回下载完成的文件路径"""
         try:
             logging.debug("步骤: Starting automation...")
             
-            if not self.ensure_navigation(force_refresh=True):
-                return False
-            time.sleep(3)
-            
-            if not self.find_search_box_with_cache(search_query):
-                return False
-            
-            if not self.find_search_button_with_cache():
-                return False
-            time.sleep(5)
+            if not self.run_search(search_query):
+                return None
             
-            if not self.smart_download_flow_optimized():
-                return False
+            file_path = self.smart_download_flow_optimized()
+            if not file_path:
+                return None
             
             logging.debug("步骤: Automation completed successfully.")
-            return True
+            return file_path
             
         except Exception as e:
             logging.error(f"Error in automation: {str(e)}")
+            return None
+
+    def run_search(self, search_query):
+        """刷新页面并提交查询，等待结果出现"""
+        if not self.ensure_navigation(force_refresh=True):
             return False
+        time.sleep(3)
+        
+        if not self.find_search_box_with_cache(search_query):
+            return False
+        
+        if not self.find_search_button_with_cache():
+            return False
+        self.wait_for_results(timeout=5)
+        return True
 
-    def find_search_box_with_cache(self, search_query):
+    def fetch_snapshot(self, search_query):
+        """一键测试用: 按配置的数据来源同步执行抓取和解析，返回处理后的快照；缓存中有未过期的相同查询结果时直接返回"""
+        data = self.cached_snapshot(search_query)
+        if data is not None:
+            return data
+        raw = self.fetch_raw(search_query)
+        if raw is None:
+            return None
+        return self.parse_raw(raw)
+
+    def cache_variant(self):
+        """分片方式和数据来源不同时结果可能不同，作为缓存键的一部分"""
+        shards = tuple(self.custom_shards) if self.shard_mode == 'custom' else ()
+        return self.shard_mode, shards, self.data_source
+
+    def cached_snapshot(self, search_query):
         try:
-            logging.debug(f"步骤: Filling search box: {search_query}")
-            sel = self.cached_selectors['search_box']['selector']
-            el = self.driver.find_element(By.XPATH, sel)
-            if el.is_displayed() and el.is_enabled():
-                el.click()
-                time.sleep(0.5)
-                el.clear()
-                time.sleep(0.5)
-                el.send_keys(search_query)
-                logging.debug("步骤: Search box filled.")
-                return True
+            data = self.result_cache.get(self.query_templates.expand(search_query), variant=self.cache_variant())
         except Exception as e:
-            logging.error(f"Error with search box: {str(e)}")
-        return False
+            logging.error(f"Error reading query result cache: {str(e)}")
+            return None
+        if data is not None:
+            logging.debug(f"步骤: Query result cache hit, snapshot from {data['timestamp'].strftime('%H:%M:%S')}.")
+        return data
+
+    def fetch_raw(self, search_query):
+        """抓取阶段: 浏览器自动化，返回暂存的导出文件或页面表格 JSON，不做解析
 
-    def find_search_button_with_cache(self):
+        抓取失败且浏览器已无响应时，切换到热备浏览器（没有热备时冷启动）立即重试一次，不用等下一个周期。
+        """
         try:
-            logging.debug("步骤: Clicking search button...")
-            sel = self.cached_selectors['search_button']['selector']
-            el = self.driver.find_element(By.XPATH, sel)
-            if el.is_displayed() and el.is_enabled():
-                el.click()
-                time.sleep(3)
-                logging.debug("步骤: Search button clicked.")
-                return True
+            # 模板在抓取时按当天展开，定时周期不会用到过期的日期
+            search_query = self.query_templates.expand(search_query)
         except Exception as e:
-            logging.error(f"Error with search button: {str(e)}")
-        return False
+            logging.error(f"Error expanding query template: {str(e)}")
+            return None
+        # 按抓取开始时的设置写缓存，解析期间修改设置不会把结果记到新设置下
+        variant = self.cache_variant()
+        raw = self.fetch_raw_once(search_query)
+        if raw is None and self.driver_initialized and not self.check_driver_health():
+            logging.warning("步骤: Browser stopped responding during fetch, retrying on a replacement driver...")
+            self.failover_stats['retries'] += 1
+            raw = self.fetch_raw_once(search_query)
+        if raw is not None:
+            raw['cache_variant'] = variant
+        return raw
 
-    # ==================== 专门优化的双表头处理方法 ====================
-    def process_downloaded_data(self):
+    def fetch_raw_once(self, search_query):
         try:
-            logging.debug("步骤: Processing downloaded data...")
-            files = os.listdir(self.download_dir)
-            logging.debug(f"步骤: All files in download directory: {files}")
-            
-            if not files:
-                logging.warning("步骤: No files in download directory.")
-                return None
-            
-            latest_file = None
-            latest_time = 0
-            
-            for file in files:
-                file_path = os.path.join(self.download_dir, file)
-                file_time = os.path.getmtime(file_path)
-                if file_time > latest_time:
-                    latest_time = file_time
-                    latest_file = file
-            
-            if not latest_file:
-                logging.warning("步骤: Could not determine latest file.")
-                return None
-                
-            file_path = os.path.join(self.download_dir, latest_file)
-            logging.debug(f"步骤: Processing latest file: {latest_file}")
-            
-            if latest_file.endswith('.csv'):
-                df = self.read_iwencai_csv_improved(file_path)
-            elif latest_file.endswith(('.xls', '.xlsx')):
-                df = self.read_iwencai_excel_improved(file_path)
-            else:
-                df = self.auto_detect_iwencai_file_improved(file_path)
+            with self.driver_lock:
+                shards = self.shard_queries(search_query)
+                if len(shards) > 1:
+                    parts = self.fetch_sharded(shards)
+                    if not parts:
+                        return None
+                    self.save_session_cookies()
+                    return {'kind': 'shards', 'parts': parts, 'search_query': search_query, 'fetched_at': time.time()}
+                if self.data_source == 'dom':
+                    if not self.run_search(search_query):
+                        return None
+                    payload = self.read_result_table_from_dom()
+                    if payload is not None:
+                        self.save_session_cookies()
+                        return {'kind': 'dom', 'payload': payload, 'search_query': search_query}
+                    logging.warning("步骤: DOM table unavailable or incomplete, falling back to download.")
+                    file_path = self.smart_download_flow_optimized()
+                else:
+                    file_path = self.one_click_automation_with_refresh(search_query)
+                if not file_path:
+                    return None
                 
+                staged_path = self.stage_download(file_path)
+                if staged_path is None:
+                    return None
+                self.save_session_cookies()
+                return {'kind': 'file', 'path': staged_path, 'search_query': search_query, 'fetched_at': time.time()}
+        except Exception as e:
+            logging.error(f"Error fetching raw data: {str(e)}")
+            return None
+
+    def parse_raw(self, raw):
+        """解析阶段: 把抓取结果解析成表格并计算斜率"""
+        try:
+            df = self.read_raw_frame(raw)
             if df is None or df.empty:
                 logging.warning("步骤: Dataframe is empty or could not be read.")
                 return None
-                
-            stock_count = len(df)
-            slope_data, closing_sequences, date_columns, stock_names = self.calculate_slopes_improved(df)
-            
-            # 计算新出现的股票
-            new_stocks = self.calculate_new_stocks(df)
-            
-            logging.debug(f"步骤: Successfully processed {stock_count} stocks")
-            logging.debug(f"步骤: New stocks detected: {len(new_stocks)}")
-            
-            return {
-                'timestamp': datetime.now(),
-                'stock_count': stock_count,
-                'stock_list': df,
-                'slopes': slope_data,
-                'closing_sequences': closing_sequences,
-                'date_columns': date_columns,
-                'stock_names': stock_names,
-                'new_stocks': new_stocks
-            }
+            data = self.build_snapshot(df)
+            self.result_cache.put(raw.get('search_query', ''), data, variant=raw.get('cache_variant', ()))
+            return data
         except Exception as e:
-            logging.error(f"Error processing data: {str(e)}")
+            logging.error(f"Error parsing raw data: {str(e)}")
             return None
+        finally:
+            self.discard_raw(raw)
 
-    def calculate_new_stocks(self, current_df):
-        """计算新出现的股票"""
-        new_stocks = []
-        
-        # 如果没有历史数据，所有股票都是新的
-        if not self.monitoring_data['stock_lists']:
-            for index, row in current_df.iterrows():
-                stock_code = self.get_stock_code(row, current_df.columns)
-                stock_name = self.get_stock_name(row, current_df.columns)
-                new_stocks.append(f"{stock_code} {stock_name}".strip())
-            return new_stocks
-        
-        # 获取上一次的股票列表
-        last_df = self.monitoring_data['stock_lists'][-1]
-        
-        # 获取当前和上一次的股票代码集合
-        current_stocks = set()
-        for index, row in current_df.iterrows():
-            stock_code = self.get_stock_code(row, current_df.columns)
-            stock_name = self.get_stock_name(row, current_df.columns)
-            current_stocks.add(f"{stock_code} {stock_name}".strip())
-        
-        last_stocks = set()
-        for index, row in last_df.iterrows():
-            stock_code = self.get_stock_code(row, last_df.columns)
-            stock_name = self.get_stock_name(row, last_df.columns)
-            last_stocks.add(f"{stock_code} {stock_name}".strip())
-        
-        # 计算新出现的股票
-        new_stocks = list(current_stocks - last_stocks)
+    def read_raw_frame(self, raw):
+        if raw['kind'] == 'dom':
+            return self.dom_table_to_dataframe(raw['payload'])
+        if raw['kind'] == 'shards':
+            return self.merge_shard_frames([self.read_raw_frame(part) for part in raw['parts']])
+        return self.read_export_file(raw['path'])
+
+    def parse_raw_batch(self, raws):
+        """批量解析: 多个导出文件交给进程池并行处理，其余逐个在本进程解析，结果保持输入顺序"""
+        file_indices = [i for i, raw in enumerate(raws) if raw['kind'] == 'file']
+        if len(file_indices) < 2:
+            return [self.parse_raw(raw) for raw in raws]
         
-        return new_stocks
+        results = [None] * len(raws)
+        try:
+            parsed = self.parse_pool.parse_files([raws[i]['path'] for i in file_indices])
+            for i, data in zip(file_indices, parsed):
+                results[i] = data
+                self.result_cache.put(raws[i].get('search_query', ''), data,
+                                      variant=raws[i].get('cache_variant', ()))
+        finally:
+            for i in file_indices:
+                self.discard_raw(raws[i])
+        for i, raw in enumerate(raws):
+            if raw['kind'] != 'file':
+                results[i] = self.parse_raw(raw)
+        return results
+
+    def replay_export_files(self, file_paths):
+        """回放一批已有的导出文件: 进程池并行解析后按顺序发布，返回成功发布的数量"""
+        published = 0
+        for data in self.parse_pool.parse_files(list(file_paths)):
+            if data:
+                self.append_snapshot(data)
+                published += 1
+        return published
 
-    def read_iwencai_excel_improved(self, file_path):
-        """专门优化双表头处理的Excel读取方法 - 参考上传文件处理代码"""
+    def discard_raw(self, raw):
+        """删除暂存的导出文件，删除前先归档"""
+        if raw.get('kind') == 'shards':
+            for part in raw['parts']:
+                self.discard_raw({**part, 'search_query': raw['search_query'], 'fetched_at': raw.get('fetched_at')})
+            return
+        if raw.get('kind') == 'file' and raw.get('path') and os.path.exists(raw['path']):
+            self.archive_raw(raw)
+            try:
+                os.remove(raw['path'])
+            except Exception as e:
+                logging.warning(f"Could not remove staged file {raw['path']}: {str(e)}")
+
+    def archive_raw(self, raw):
+        if not self.archive_enabled:
+            return None
+        try:
+            return self.archive.store(raw['path'], raw.get('search_query', ''), raw.get('fetched_at'))
+        except Exception as e:
+            logging.error(f"Error archiving export file: {str(e)}")
+            return None
+
+    # ==================== 分片查询 ====================
+    def shard_queries(self, search_query):
+        """按分片设置把查询拆成子查询（每个子查询追加一个分区条件），未启用或分区少于两个时返回原查询"""
+        if self.shard_mode == 'board':
+            partitions = BOARD_SHARDS
+        elif self.shard_mode == 'custom':
+            partitions = self.custom_shards
+        else:
+            partitions = []
+        if len(partitions) < 2:
+            return [search_query]
+        base = search_query.rstrip('，,。 ')
+        return [f"{base}，{partition}" for partition in partitions]
+
+    def fetch_sharded(self, queries):
+        """在同一个浏览器的多个标签页中执行分片查询，返回各分片的原始结果（导出文件或页面表格）
+
+        先在所有标签页依次提交搜索，再依次导出，各分片在服务端的查询和导出耗时相互重叠。
+        """
+        start = time.time()
+        if not self.ensure_navigation(force_refresh=True):
+            return None
+        cycle_dir = self.begin_cycle_download()
+        if cycle_dir is None:
+            return None
+        main_handle = self.driver.current_window_handle
+        handles = [main_handle]
+        parts = []
+        try:
+            for _ in queries[1:]:
+                self.driver.switch_to.new_window('tab')
+                handles.append(self.driver.current_window_handle)
+                self.driver.get(self.target_url)
+            for handle, query in zip(handles, queries):
+                self.driver.switch_to.window(handle)
+                if not self.find_search_box_with_cache(query) or not self.find_search_button_with_cache(settle_seconds=0):
+                    logging.error(f"步骤: Could not submit shard query: {query}")
+                    return None
+            
+            expected_files = 0
+            for handle in handles:
+                self.driver.switch_to.window(handle)
+                self.wait_for_results(timeout=30)
+                if self.data_source == 'dom':
+                    payload = self.read_result_table_from_dom()
+                    if payload is not None:
+                        parts.append({'kind': 'dom', 'payload': payload})
+                        continue
+                if not self.click_shard_download():
+                    logging.error("步骤: Shard download could not be started.")
+                    return None
+                expected_files += 1
+            
+            files = self.wait_for_downloads(cycle_dir, expected_files) if expected_files else []
+            if len(files) < expected_files:
+                logging.error(f"步骤: Only {len(files)} of {expected_files} shard downloads completed.")
+                return None
+            for file_path in files:
+                staged_path = self.stage_download(file_path, remove_dir=False)
+                if staged_path is None:
+                    for part in parts:
+                        self.discard_raw(part)
+                    return None
+                parts.append({'kind': 'file', 'path': staged_path})
+            logging.debug(f"步骤: {len(queries)} shards fetched in {time.time() - start:.1f}s.")
+            return parts
+        except Exception as e:
+            logging.error(f"Error fetching shards: {str(e)}")
+            return None
+        finally:
+            self.close_extra_tabs(handles, main_handle)
+            self.active_download_dirs.discard(cycle_dir)
+            shutil.rmtree(cycle_dir, ignore_errors=True)
+
+    def click_shard_download(self):
+        """点击当前标签页的导数据；弹出扫码登录时等待登录完成后重新点击"""
+        btn = self.find_and_cache_download_button() or self.find_alternative_download_button()
+        if not btn:
+            return False
+        self.driver.execute_script("arguments[0].click();", btn)
+        if self.is_logged_in:
+            return True
+        time.sleep(1)
+        state = self.probe_page_state(groups=('login',))
+        if state is None or not state['login']['present']:
+            return True
+        if not self.wait_for_login_completion():
+            return False
+        btn = self.find_and_cache_download_button()
+        if not btn:
+            return False
+        self.driver.execute_script("arguments[0].click();", btn)
+        return True
+
+    def wait_for_downloads(self, cycle_dir, count, timeout=60):
+        """等待周期目录中出现 count 个下载完成的文件"""
+        deadline = time.time() + timeout
+        files = []
+        while time.time() < deadline:
+            files = self.find_completed_downloads(cycle_dir)
+            if len(files) >= count:
+                return files
+            time.sleep(0.5)
+        logging.warning(f"步骤: Download timeout with {len(files)} of {count} files.")
+        return files
+
+    def close_extra_tabs(self, handles, main_handle):
+        for handle in handles:
+            if handle == main_handle:
+                continue
+            try:
+                self.driver.switch_to.window(handle)
+                self.driver.close()
+            except Exception:
+                continue
         try:
-            # 先读取前几行来检测表头结构
-            df_raw = pd.read_excel(file_path, header=None, nrows=10)
-            logging.debug("步骤: Raw Excel data preview:")
-            for i in range(min(10, len(df_raw))):
-                logging.debug(f"Row {i}: {df_raw.iloc[i].tolist()}")
-            
-            # 检测表头行数
-            header_rows = self.detect_header_rows_improved(df_raw)
-            logging.debug(f"步骤: Detected header rows: {header_rows}")
-            
-            if header_rows == 1:
-                # 单表头情况
-                df = pd.read_excel(file_path, header=0)
-                df.columns = [str(c).strip() for c in df.columns]
-            else:
-                # 多行表头情况 - 使用上传文件处理代码的方法
-                df = self.process_double_header_excel_improved(file_path, header_rows)
-            
-            df = self.basic_data_cleaning(df)
-            
-            logging.debug(f"步骤: Final columns after processing: {list(df.columns)}")
-            return df
-            
+            self.driver.switch_to.window(main_handle)
         except Exception as e:
-            logging.error(f"Error reading improved Excel: {str(e)}")
-            return pd.read_excel(file_path)
+            logging.warning(f"Could not switch back to main tab: {str(e)}")
 
-    def detect_header_rows_improved(self, df_preview):
-        """改进的表头行数检测 - 参考上传文件处理代码"""
-        header_keywords = ['代码', '名称', '收盘价', '开盘价', '5日均线', '均线', '财务诊断评分', 'undefined']
-        
-        for i in range(min(5, len(df_preview))):
-            row_text = ' '.join([str(x) for x in df_preview.iloc[i] if pd.notna(x)])
-            if any(keyword in row_text for keyword in header_keywords):
-                if i == 0:
-                    # 检查下一行是否包含日期或技术指标
-                    if len(df_preview) > 1:
-                        next_row_text = ' '.join([str(x) for x in df_preview.iloc[1] if pd.notna(x)])
-                        if self.contains_date_or_technical_improved(next_row_text):
-                            return 2
-                    return 1
-                else:
-                    return i + 1
-        
-        return 1
+    # ==================== 页面表格直接提取 ====================
+    def read_result_table_from_dom(self, max_pages=50, page_timeout_ms=5000):
+        """在浏览器内序列化结果表格（含分页），返回表格 JSON，不完整时返回 None"""
+        try:
+            logging.debug("步骤: Extracting result table from DOM...")
+            extract_start = time.time()
+            self.driver.set_script_timeout(max_pages * page_timeout_ms / 1000 + 10)
+            payload = self.driver.execute_async_script(TABLE_EXTRACT_JS, max_pages, page_timeout_ms)
+            if not payload or not payload['header'] or not payload['complete']:
+                logging.warning(f"步骤: DOM table incomplete: rows={len(payload['rows']) if payload else 0}, "
+                                f"expected={payload.get('expected_rows') if payload else None}")
+                return None
+            logging.debug(f"步骤: DOM table extracted in {time.time() - extract_start:.2f}s: "
+                          f"{len(payload['rows'])} rows over {payload['pages']} pages")
+            return payload
+        except Exception as e:
+            logging.error(f"Error extracting DOM table: {str(e)}")
+            return None
 
-    def contains_date_or_technical_improved(self, text):
-        """检查文本是否包含日期或技术指标信息 - 改进版本"""
-        date_indicators = ['2024', '2025', '收盘价', '开盘价', '均线', 'MA', 'undefined', '前', '后']
-        text_str = str(text).lower()
-        return any(indicator in text_str for indicator in date_indicators)
+    def find_search_box_with_cache(self, search_query):
+        try:
+            logging.debug(f"步骤: Filling search box: {search_query}")
+            el = self.find_with_ranked_selectors(
+                'search_box', SEARCH_BOX_SELECTORS, "搜索框", require_enabled=True, wait_first=True
+            )
+            if el:
+                el.click()
+                time.sleep(0.5)
+                el.clear()
+                time.sleep(0.5)
+                el.send_keys(search_query)
+                logging.debug("步骤: Search box filled.")
+                return True
+        except Exception as e:
+            logging.error(f"Error with search box: {str(e)}")
+        return False
 
-    def process_double_header_excel_improved(self, file_path, header_rows):
-        """处理双表头 - 参考上传文件处理代码的方法"""
+    def find_search_button_with_cache(self, settle_seconds=3):
         try:
-            # 读取原始数据
-            df_raw = pd.read_excel(file_path, header=None)
-            
-            # 处理表头行，向前填充空值
-            header_df = df_raw.iloc[:header_rows].ffill(axis=1)
-            df = df_raw.iloc[header_rows:].reset_index(drop=True)
-            
-            # 构建合并列名 - 参考上传文件处理代码
-            columns = []
-            current_prefix = ""
-            
-            for col in header_df.values.T:
-                col_strs = [str(x).strip() for x in col if str(x) != "nan"]
-                if len(col_strs) == 0:
-                    columns.append("")
-                    continue
-                    
-                # 识别列类型前缀
-                if "收盘价" in col_strs[0]:
-                    current_prefix = "收盘价"
-                elif "5日均线" in col_strs[0] or "均线" in col_strs[0]:
-                    current_prefix = "5日均线"
-                elif "开盘价" in col_strs[0]:
-                    current_prefix = "开盘价"
-                elif "财务诊断评分" in col_strs[0]:
-                    current_prefix = "财务诊断评分"
-                
-                # 提取日期部分
-                date_part = col_strs[-1] if len(col_strs) > 1 else col_strs[0]
-                
-                # 构建列名
-                if current_prefix and "undefined" in col_strs[0]:
-                    merged = f"{current_prefix}_{date_part}"
-                else:
-                    merged = "_".join(col_strs).strip("_")
-                
-                columns.append(merged)
-            
-            df.columns = columns
-            return df
-            
+            logging.debug("步骤: Clicking search button...")
+            el = self.find_with_ranked_selectors(
+                'search_button', SEARCH_BUTTON_SELECTORS, "搜索按钮", require_enabled=True, wait_first=True
+            )
+            if el:
+                el.click()
+                time.sleep(settle_seconds)
+                logging.debug("步骤: Search button clicked.")
+                return True
         except Exception as e:
-            logging.error(f"Error processing double header improved: {str(e)}")
-            return pd.read_excel(file_path, header=1)
+            logging.error(f"Error with search button: {str(e)}")
+        return False
 
-    def basic_data_cleaning(self, df):
-        """基础数据清洗"""
-        if df is None or df.empty:
-            return df
-        
-        df_clean = df.copy()
-        
-        for col in df_clean.select_dtypes(include=['object']).columns:
-            try:
-                df_clean[col] = df_clean[col].astype(str).str.strip().replace({
-                    'nan': np.nan, 'None': np.nan, '': np.nan
-                })
-            except Exception:
-                pass
-        
-        replace_symbols = ["-", "—", "空值", "null", "None", "", "NaN", "--"]
-        df_clean.replace(replace_symbols, np.nan, inplace=True)
-        
-        for col in df_clean.columns:
-            if df_clean[col].dtype == object:
-                try:
-                    df_clean[col] = df_clean[col].astype(str).str.replace(',', '').str.replace(' ', '')
-                except Exception:
-                    pass
-                try:
-                    df_clean[col] = pd.to_numeric(df_clean[col], errors='ignore')
-                except Exception:
-                    pass
-        
-        df_clean = df_clean.dropna(how='all')
-        df_clean = df_clean.dropna(axis=1, how='all')
-        
-        df_clean = self.identify_stock_columns(df_clean)
-        
-        return df_clean
+    # ==================== 下载文件处理与快照发布 ====================
+    def append_snapshot(self, data, processed_at=None):
+        """发布阶段: 按发布顺序计算新增股票并追加到监控数据
 
-    def find_closing_price_columns(self, df):
-        """查找收盘价列 - 改进版本，区分收盘价、开盘价和5日均线"""
-        close_cols = []
-        date_info = []
-        
-        for col in df.columns:
-            col_str = str(col)
-            
-            # 只识别明确标记为收盘价的列
-            is_closing_col = False
-            if col_str.startswith('收盘价_'):
-                is_closing_col = True
-            elif '收盘价' in col_str and '开盘价' not in col_str and '5日均线' not in col_str:
-                is_closing_col = True
-            
-            if is_closing_col:
-                # 从列名中提取日期
-                parts = str(col).split('_')
-                if len(parts) > 1:
-                    date_str_raw = parts[-1]
-                    date_str = date_str_raw.split(' [')[0].strip()
-                    
-                    # 尝试多种日期格式解析
-                    date_obj = None
-                    for fmt in ("%Y.%m.%d", "%Y-%m-%d", "%Y%m%d", "%Y/%m/%d"):
-                        try:
-                            date_obj = datetime.strptime(date_str, fmt)
-                            break
-                        except:
-                            continue
-                    
-                    if date_obj:
-                        extracted_date = date_obj.strftime("%Y-%m-%d")
-                    else:
-                        # 如果无法解析，使用原始字符串
-                        extracted_date = date_str
-                else:
-                    extracted_date = col_str
-                
-                if self.is_valid_price_column(df[col]):
-                    close_cols.append(col)
-                    date_info.append(extracted_date)
-        
-        logging.debug(f"步骤: Closing price columns found: {close_cols}")
-        logging.debug(f"步骤: Corresponding dates: {date_info}")
-        
-        if close_cols and date_info:
-            close_cols, date_info = self.sort_columns_by_date(close_cols, date_info)
-            logging.debug(f"步骤: Sorted closing price columns: {close_cols}")
-            logging.debug(f"步骤: Sorted dates: {date_info}")
-        
-        return close_cols, date_info
+        processed_at 为告警延迟的起点（秒），默认取快照处理完成的时间；发布缓存中的旧快照时由调用方传入当前时间。
+        """
+        with self.data_lock:
+            # 新增股票必须和上一次已发布的快照比较，所以放在发布时计算
+            new_stocks = self.calculate_new_stocks(data['prices'])
+            logging.debug(f"步骤: New stocks detected: {len(new_stocks)}")
+            feature_tables = self.monitoring_data['feature_tables']
+            previous_features = feature_tables[-1] if feature_tables else None
+            timestamps = self.monitoring_data['timestamps']
+            previous_processed_at = timestamps[-1].timestamp() if timestamps else None
+            self.monitoring_data['timestamps'].append(data['timestamp'])
+            self.monitoring_data['stock_counts'].append(data['stock_count'])
+            self.monitoring_data['stock_lists'].append(data['stock_list'])
+            self.monitoring_data['price_snapshots'].append(data['prices'])
+            self.monitoring_data['feature_tables'].append(data['features'])
+            self.monitoring_data['snapshot_stats'].append(data['stats'])
+            self.monitoring_data['new_stocks'].append(new_stocks)
+            self.data_version += 1
+            self.price_store.merge(data['prices'])
+            features = data['features']
+            self.rank_history.append(
+                features['股票代码'].tolist(),
+                features['股票简称'].tolist(),
+                features[self.rank_metric].to_numpy(dtype=np.float64),
+                data['timestamp']
+            )
+            # 排名规则只比较上一次和本次快照，锁内截取这两列，之后的发布、恢复和切换排名指标都不影响告警
+            rank_view = self.rank_history.tail(2)
+            rank_metric = self.rank_metric
+            self.snapshots_since_checkpoint += 1
+            state = self.checkpoint_state() if self.checkpoint_due() else None
+        # 告警先于检查点，规则只读取快照中的表格和锁内截取的排名，不需要持有数据锁
+        try:
+            self.alert_manager.evaluate(previous_features, features, data['prices'], new_stocks,
+                                        processed_at or data['timestamp'].timestamp(), rank_history=rank_view,
+                                        rank_metric=rank_metric, previous_processed_at=previous_processed_at)
+        except Exception as e:
+            logging.error(f"Error evaluating alerts: {str(e)}")
+        if state is not None:
+            self.request_checkpoint(state)
 
-    def is_valid_price_column(self, series):
-        """检查列是否是有效的价格数据"""
-        if series.empty:
-            return False
-        
-        if not pd.api.types.is_numeric_dtype(series):
-            try:
-                series_numeric = pd.to_numeric(series, errors='coerce')
-                if series_numeric.isna().all():
-                    return False
-            except:
-                return False
-        
-        numeric_series = pd.to_numeric(series, errors='coerce')
-        valid_values = numeric_series.dropna()
-        if len(valid_values) == 0:
+    def is_published(self, data):
+        """快照是否已经发布过（缓存命中时返回的是同一个快照）"""
+        with self.data_lock:
+            return data['timestamp'] in self.monitoring_data['timestamps']
+
+    # ==================== 检查点 ====================
+    def checkpoint_due(self):
+        """距上次检查点已发布够 checkpoint_every 次或超过 checkpoint_interval_seconds（调用方持有数据锁）"""
+        if self.snapshots_since_checkpoint <= 0:
             return False
-        
-        avg_value = valid_values.mean()
-        return 0.1 <= avg_value <= 10000
+        return (self.snapshots_since_checkpoint >= self.checkpoint_every
+                or time.time() - self.last_checkpoint_time >= self.checkpoint_interval_seconds)
 
-    def sort_columns_by_date(self, columns, dates):
-        """按日期对列进行排序"""
-        pairs = list(zip(columns, dates))
-        
-        def parse_date(date_str):
-            try:
-                # 尝试多种日期格式
-                for fmt in ("%Y-%m-%d", "%Y.%m.%d", "%Y%m%d", "%Y/%m/%d"):
-                    try:
-                        return datetime.strptime(date_str, fmt)
-                    except:
-                        continue
-                return datetime(1900, 1, 1)
-            except:
-                return datetime(1900, 1, 1)
-        
-        sorted_pairs = sorted(pairs, key=lambda x: parse_date(x[1]))
-        
-        sorted_columns = [pair[0] for pair in sorted_pairs]
-        sorted_dates = [pair[1] for pair in sorted_pairs]
-        
-        return sorted_columns, sorted_dates
-
-    def calculate_slopes_improved(self, df):
-        """改进的斜率计算方法 - 使用7天数据"""
-        slopes = {}
-        closing_sequences = {}
-        date_columns_info = {}
-        stock_names = {}
-        
-        close_cols, date_info = self.find_closing_price_columns(df)
-        logging.debug(f"步骤: Found {len(close_cols)} closing price columns: {close_cols}")
-        logging.debug(f"步骤: Date info: {date_info}")
-        
-        if len(close_cols) < 2:
-            logging.warning(f"步骤: Not enough closing price columns found. Need at least 2, found {len(close_cols)}")
-            for index, row in df.iterrows():
-                stock_code = self.get_stock_code(row, df.columns)
-                stock_name = self.get_stock_name(row, df.columns)
-                key = f"{stock_code} {stock_name}".strip()
-                slopes[key] = 0
-                closing_sequences[key] = []
-                date_columns_info[key] = []
-                stock_names[key] = stock_name
-            return slopes, closing_sequences, date_columns_info, stock_names
-        
-        # 只取最近的7天数据
-        if len(close_cols) > 7:
-            close_cols = close_cols[-7:]
-            date_info = date_info[-7:]
-            logging.debug(f"步骤: Using last 7 days data: {close_cols}")
-            logging.debug(f"步骤: Corresponding dates: {date_info}")
-        
-        for index, row in df.iterrows():
-            stock_code = self.get_stock_code(row, df.columns)
-            stock_name = self.get_stock_name(row, df.columns)
-            
-            closes = []
-            valid_dates = []
-            
-            for i, col in enumerate(close_cols):
-                val = row.get(col, np.nan)
-                if pd.notna(val):
-                    val_str = str(val).replace(',', '').replace('—', '').replace('--', '').strip()
-                    if val_str in ["", "NaN", "None", "null"]:
-                        continue
-                    try:
-                        price = float(val_str)
-                        if price > 0:
-                            closes.append(price)
-                            valid_dates.append(date_info[i])
-                    except Exception as e:
-                        logging.debug(f"步骤: Failed to convert value '{val_str}' to float for column {col}: {str(e)}")
-                        continue
-            
-            logging.debug(f"步骤: Stock {stock_code} {stock_name} - Valid dates: {valid_dates}")
-            logging.debug(f"步骤: Stock {stock_code} {stock_name} - Raw prices: {closes}")
-            
-            key = f"{stock_code} {stock_name}".strip()
-            closing_sequences[key] = closes
-            date_columns_info[key] = valid_dates
-            stock_names[key] = stock_name
-            
-            if len(closes) < 2:
-                logging.debug(f"步骤: Insufficient price data for {stock_code} {stock_name}, only {len(closes)} valid values")
-                slopes[key] = 0
-                continue
-            
-            try:
-                x = np.arange(len(closes))
-                slope, intercept, r_value, p_value, std_err = stats.linregress(x, closes)
-                
-                avg_price = np.mean(closes)
-                slope_percentage = (slope / avg_price) * 100 if avg_price != 0 else 0
-                
-                slopes[key] = slope_percentage
-                logging.debug(f"步骤: Calculated slope for {key}: {slope_percentage:.4f}% (slope={slope:.4f}, avg_price={avg_price:.4f})")
-                
-            except Exception as e:
-                logging.warning(f"步骤: Failed to calculate slope for {stock_code} {stock_name}: {str(e)}")
-                slopes[key] = 0
-    
-        return slopes, closing_sequences, date_columns_info, stock_names
+    def checkpoint_state(self):
+        """收集需要跨重启保留的状态（调用方持有数据锁）
+
+        锁内只截取已发布快照的引用和累积状态的副本，快照发布后不再修改，编码留给写盘线程。
+        """
+        keep = self.checkpoint_snapshots
+        data = self.monitoring_data
+        self.snapshots_since_checkpoint = 0
+        self.last_checkpoint_time = time.time()
+        return {
+            'version': 1,
+            'saved_at': datetime.now(),
+            'cycle_count': self.cycle_count,
+            'search_query': self.search_query,
+            'timestamps': data['timestamps'][-keep:],
+            'stock_counts': data['stock_counts'][-keep:],
+            'stock_lists': data['stock_lists'][-keep:],
+            'price_snapshots': data['price_snapshots'][-keep:],
+            'feature_tables': data['feature_tables'][-keep:],
+            'snapshot_stats': data['snapshot_stats'][-keep:],
+            'new_stocks': data['new_stocks'][-keep:],
+            'price_store': self.price_store.to_arrays(),
+            'rank_history': self.rank_history.to_arrays(),
+        }
+
+    @staticmethod
+    def encode_checkpoint(state):
+        """把 checkpoint_state 收集的快照编码成只含数组的结构"""
+        return {
+            **state,
+            'stock_lists': [encode_dataframe(df) for df in state['stock_lists']],
+            'price_snapshots': [prices.to_arrays() for prices in state['price_snapshots']],
+            'feature_tables': [encode_dataframe(df) for df in state['feature_tables']],
+            'snapshot_stats': [{**stats, 'describe': encode_dataframe(stats['describe'])}
+                               for stats in state['snapshot_stats']],
+            'new_stocks': [np.asarray(new_stocks, dtype=str) for new_stocks in state['new_stocks']],
+        }
 
-    def read_iwencai_csv_improved(self, file_path):
-        """改进的CSV读取方法"""
+    def request_checkpoint(self, state):
+        """交给后台线程写盘，不占用发布阶段"""
+        with self.checkpoint_lock:
+            self.pending_checkpoint = state
+            if self.checkpoint_thread is not None:
+                return
+            self.checkpoint_thread = threading.Thread(target=self.checkpoint_loop, name="checkpoint-writer",
+                                                      daemon=True)
+            self.checkpoint_thread.start()
+
+    def checkpoint_loop(self):
+        while True:
+            with self.checkpoint_lock:
+                state, self.pending_checkpoint = self.pending_checkpoint, None
+                if state is None:
+                    self.checkpoint_thread = None
+                    return
+            self.save_checkpoint(state)
+
+    def flush_checkpoint(self):
+        """等待后台写盘结束，并把上次检查点之后发布的快照补写进去（关闭时调用）"""
+        with self.checkpoint_lock:
+            thread = self.checkpoint_thread
+        if thread is not None:
+            thread.join()
+        with self.data_lock:
+            state = self.checkpoint_state() if self.snapshots_since_checkpoint > 0 else None
+        if state is not None:
+            self.save_checkpoint(state)
+
+    def save_checkpoint(self, state):
         try:
-            encodings = ['gbk', 'utf-8', 'gb2312', 'utf-8-sig']
-            
-            for encoding in encodings:
-                try:
-                    df_raw = pd.read_csv(file_path, encoding=encoding, header=None, nrows=10)
-                    
-                    header_rows = self.detect_header_rows_improved(df_raw)
-                    
-                    if header_rows == 1:
-                        df = pd.read_csv(file_path, encoding=encoding, header=0)
-                    else:
-                        df = self.process_double_header_csv_improved(file_path, encoding, header_rows)
-                    
-                    df = self.basic_data_cleaning(df)
-                    return df
-                    
-                except UnicodeDecodeError:
-                    continue
-                except Exception as e:
-                    logging.debug(f"Failed to read CSV with encoding {encoding}: {str(e)}")
-                    continue
-            
-            return pd.read_csv(file_path)
-            
+            start = time.time()
+            os.makedirs(os.path.dirname(self.checkpoint_path), exist_ok=True)
+            size = save_checkpoint(self.checkpoint_path, self.encode_checkpoint(state))
+            self.checkpoint_info.update(saved_at=state['saved_at'], bytes=size, save_seconds=time.time() - start)
+            logging.debug(f"步骤: Checkpoint saved ({size / 1024:.0f} KB) in {time.time() - start:.3f}s")
         except Exception as e:
-            logging.error(f"Error reading improved CSV: {str(e)}")
-            return None
+            logging.error(f"Error saving checkpoint: {str(e)}")
 
-    def process_double_header_csv_improved(self, file_path, encoding, header_rows):
-        """处理CSV的双表头 - 改进版本"""
+    def restore_checkpoint(self):
+        """从检查点恢复最近的快照、新股票基准、价格库和排名历史，返回是否恢复成功"""
+        if not os.path.exists(self.checkpoint_path):
+            return False
         try:
-            df_raw = pd.read_csv(file_path, encoding=encoding, header=None)
-            header_df = df_raw.iloc[:header_rows].ffill(axis=1)
-            df = df_raw.iloc[header_rows:].reset_index(drop=True)
-            
-            columns = []
-            current_prefix = ""
-            
-            for col in header_df.values.T:
-                col_strs = [str(x).strip() for x in col if str(x) != "nan"]
-                if len(col_strs) == 0:
-                    columns.append("")
-                    continue
-                    
-                if "收盘价" in col_strs[0]:
-                    current_prefix = "收盘价"
-                elif "5日均线" in col_strs[0] or "均线" in col_strs[0]:
-                    current_prefix = "5日均线"
-                elif "开盘价" in col_strs[0]:
-                    current_prefix = "开盘价"
-                elif "财务诊断评分" in col_strs[0]:
-                    current_prefix = "财务诊断评分"
-                
-                date_part = col_strs[-1] if len(col_strs) > 1 else col_strs[0]
-                
-                if current_prefix and "undefined" in col_strs[0]:
-                    merged = f"{current_prefix}_{date_part}"
-                else:
-                    merged = "_".join(col_strs).strip("_")
-                
-                columns.append(merged)
-            
-            df.columns = columns
-            return df
-            
+            start = time.time()
+            state = load_checkpoint(self.checkpoint_path)
+            with self.data_lock:
+                self.monitoring_data = {
+                    'timestamps': state['timestamps'],
+                    'stock_counts': state['stock_counts'],
+                    'stock_lists': [decode_dataframe(df) for df in state['stock_lists']],
+                    'price_snapshots': [PriceSnapshot.from_arrays(prices) for prices in state['price_snapshots']],
+                    'feature_tables': [decode_dataframe(df) for df in state['feature_tables']],
+                    'snapshot_stats': [{**stats, 'describe': decode_dataframe(stats['describe'])}
+                                       for stats in state['snapshot_stats']],
+                    'new_stocks': [new_stocks.tolist() for new_stocks in state['new_stocks']],
+                }
+                self.price_store = PriceHistoryStore.from_arrays(state['price_store'])
+                self.rank_history = RankHistory.from_arrays(state['rank_history'])
+                self.data_version += 1
+                self.cycle_count = state['cycle_count']
+                self.search_query = state['search_query']
+            self.checkpoint_info.update(saved_at=state['saved_at'], restore_seconds=time.time() - start,
+                                        restored_snapshots=len(state['timestamps']))
+            logging.debug(f"步骤: Restored {len(state['timestamps'])} snapshots from checkpoint "
+                          f"in {time.time() - start:.3f}s")
+            return True
         except Exception as e:
-            logging.error(f"Error processing double header CSV improved: {str(e)}")
-            return pd.read_csv(file_path, encoding=encoding, header=1)
+            logging.error(f"Error restoring checkpoint: {str(e)}")
+            return False
 
-    def auto_detect_iwencai_file_improved(self, file_path):
-        """改进的自动文件检测"""
+    def stage_download(self, file_path, remove_dir=True):
+        """把本周期下载的文件移到暂存目录交给解析阶段，并删除已空的周期目录（分片查询在全部文件暂存后再删除）"""
         try:
-            df = self.read_iwencai_excel_improved(file_path)
-            if df is not None and not df.empty:
-                return df
-            
-            df = self.read_iwencai_csv_improved(file_path)
-            if df is not None and not df.empty:
-                return df
-                
-            return None
+            staged_path = os.path.join(self.staging_dir, f"{time.time_ns()}_{os.path.basename(file_path)}")
+            shutil.move(file_path, staged_path)
+            if remove_dir:
+                shutil.rmtree(os.path.dirname(file_path), ignore_errors=True)
+            logging.debug(f"步骤: Staged download {os.path.basename(file_path)} for parsing.")
+            return staged_path
         except Exception as e:
-            logging.error(f"Auto detect improved failed: {str(e)}")
+            logging.error(f"Error staging download: {str(e)}")
             return None
 
-    def identify_stock_columns(self, df):
-        """识别股票代码和名称列"""
-        df_clean = df.copy()
-        
-        code_patterns = ['代码', 'code', 'symbol']
-        for col in df_clean.columns:
-            col_lower = str(col).lower()
-            if any(pattern in col_lower for pattern in code_patterns):
-                df_clean = df_clean.rename(columns={col: '股票代码'})
-                break
+    def calculate_new_stocks(self, current_prices):
+        """计算新出现的股票，直接比较两次快照的股票键数组"""
+        # 如果没有历史数据，所有股票都是新的
+        if not self.monitoring_data['price_snapshots']:
+            return list(dict.fromkeys(current_prices.keys.tolist()))
         
-        name_patterns = ['名称', 'name', '股票名称', '股票简称']
-        for col in df_clean.columns:
-            col_lower = str(col).lower()
-            if any(pattern in col_lower for pattern in name_patterns):
-                df_clean = df_clean.rename(columns={col: '股票名称'})
-                break
+        # 获取上一次的股票键集合
+        last_stocks = set(self.monitoring_data['price_snapshots'][-1].keys.tolist())
         
-        return df_clean
-
-    def get_stock_code(self, row, columns):
-        code_keywords = ['代码', 'code', 'symbol', '股票代码']
-        for col in columns:
-            if any(keyword in str(col).lower() for keyword in code_keywords):
-                return str(row[col]) if pd.notna(row[col]) else f"代码{row.name}"
-        return f"代码{row.name}"
-
-    def get_stock_name(self, row, columns):
-        name_keywords = ['名称', 'name', '股票名称', '股票简称']
-        for col in columns:
-            if any(keyword in str(col).lower() for keyword in name_keywords):
-                return str(row[col]) if pd.notna(row[col]) else f"股票{row.name}"
-        return f"股票{row.name}"
+        # 计算新出现的股票
+        return [key for key in dict.fromkeys(current_prices.keys.tolist()) if key not in last_stocks]
 
     # ==================== 监控控制方法 ====================
     def start_monitoring(self, interval_minutes=5):
         if self.is_monitoring:
-            st.warning("监控已在运行")
+            self.post_status('warning', "监控已在运行")
             return
         self.monitoring_interval = interval_minutes
+        self.scheduler.interval_minutes = interval_minutes
         self.is_monitoring = True
         self.cycle_count = 1
-        st.success(f"监控启动，每{interval_minutes}分钟执行一次")
-        self.execute_monitoring_cycle(st.session_state.search_query)
-        self.next_execution_time = self.last_execution_time + timedelta(minutes=interval_minutes)
+        now = datetime.now()
+        if self.scheduler.should_run(now):
+            self.post_status('success', f"监控启动，每{interval_minutes}分钟执行一次")
+            self.execute_monitoring_cycle(self.search_query)
+            self.next_execution_time = self.scheduler.next_run(now)
+        else:
+            self.next_execution_time = self.trading_calendar.next_session_start(now)
+            self.post_status('success', f"监控启动，当前休市，将于 {self.next_execution_time.strftime('%m-%d %H:%M')} 开盘后执行")
 
     def stop_monitoring(self):
         self.is_monitoring = False
         self.next_execution_time = None
-        st.success("监控已停止")
+        self.post_status('success', "监控已停止")
 
     def execute_monitoring_cycle(self, search_query):
+        """把本周期的抓取提交给流水线，解析和发布在后台进行，不阻塞下一次调度"""
         try:
             cycle_start = datetime.now()
             self.last_execution_time = cycle_start
-            success = self.one_click_automation_with_refresh(search_query)
-            if success:
-                data = self.process_downloaded_data()
-                if data:
-                    self.monitoring_data['timestamps'].append(data['timestamp'])
-                    self.monitoring_data['stock_counts'].append(data['stock_count'])
-                    self.monitoring_data['stock_lists'].append(data['stock_list'])
-                    self.monitoring_data['slope_data'].append(data['slopes'])
-                    self.monitoring_data['closing_sequences'].append(data['closing_sequences'])
-                    self.monitoring_data['date_columns'].append(data['date_columns'])
-                    self.monitoring_data['stock_names'].append(data['stock_names'])
-                    self.monitoring_data['new_stocks'].append(data['new_stocks'])
-                    return True
-            return False
+            self.pipeline.start()
+            return self.pipeline.submit(search_query)
         except Exception as e:
             logging.error(f"Error in monitoring cycle: {str(e)}")
             return False
 
+    def run_scheduled_cycle(self, search_query):
+        """到点时由主循环调用: 休市或上一次抓取未完成时跳过本周期，然后按调度器安排下一次执行"""
+        now = datetime.now()
+        if not self.scheduler.should_run(now):
+            self.scheduler.record_skip('closed')
+        elif self.pipeline.is_fetching():
+            # 上一个周期超时，直接跳过而不是排队补跑
+            self.scheduler.record_skip('busy')
+        else:
+            self.execute_monitoring_cycle(search_query)
+            self.cycle_count += 1
+        self.next_execution_time = self.scheduler.next_run(now)
+
+    def start_scheduler(self):
+        """启动后台调度线程，到点时执行 run_scheduled_cycle"""
+        if self.scheduler_thread and self.scheduler_thread.is_alive():
+            return
+        self.scheduler_stop.clear()
+        self.scheduler_thread = threading.Thread(target=self._scheduler_loop, name="monitor-scheduler", daemon=True)
+        self.scheduler_thread.start()
+
+    def _scheduler_loop(self):
+        while not self.scheduler_stop.wait(1):
+            try:
+                if self.is_monitoring and self.next_execution_time and datetime.now() >= self.next_execution_time:
+                    self.run_scheduled_cycle(self.search_query)
+            except Exception as e:
+                self.post_status('error', f"定时周期执行失败: {str(e)}")
+
+    # ==================== 会话订阅 ====================
+    def heartbeat(self, session_id, timeout_seconds=30):
+        """记录会话活跃时间，没有控制者时由当前会话获得控制权；返回当前会话是否拥有控制权
+
+        超过 timeout_seconds 没有心跳的会话被移除，控制者也一样，关闭页面后控制权交给下一个活跃会话。
+        """
+        now = time.time()
+        with self.session_lock:
+            self.session_last_seen[session_id] = now
+            for sid, last_seen in list(self.session_last_seen.items()):
+                if now - last_seen > timeout_seconds:
+                    del self.session_last_seen[sid]
+                    if sid == self.controller_id:
+                        self.controller_id = None
+                        logging.debug(f"步骤: Controller session {sid} expired, releasing control.")
+            if self.controller_id is None:
+                self.controller_id = session_id
+                logging.debug(f"步骤: Session {session_id} took control of the monitor service.")
+            return self.controller_id == session_id
+
+    def claim_control(self, session_id):
+        with self.session_lock:
+            self.controller_id = session_id
+        logging.debug(f"步骤: Session {session_id} took over control of the monitor service.")
+
+    def active_sessions(self):
+        with self.session_lock:
+            return len(self.session_last_seen)
+
+    def update_holidays(self, holidays):
+        self.trading_calendar.set_holidays(holidays)
+        save_holidays(self.holidays_path, self.trading_calendar.holidays)
+        self.trading_days.load_or_build()
+        if self.is_monitoring and self.next_execution_time:
+            self.next_execution_time = self.scheduler.next_run(datetime.now())
+
+    def update_alert_config(self, config):
+        self.alert_manager.configure(config)
+        save_alert_config(self.alerts_path, self.alert_manager.config)
+
     def update_countdown(self):
         if self.next_execution_time and self.is_monitoring:
             now = datetime.now()
@@ -1113,14 +2239,14 @@ class StockMonitor:
             return f"{m:02d}:{s:02d}"
         return "00:00"
 
-    def create_stock_count_chart(self):
-        if len(self.monitoring_data['timestamps']) < 1:
+    def create_stock_count_chart(self, data):
+        if len(data['timestamps']) < 1:
             st.info("暂无数据，请先执行一键自动化测试")
             return
         fig = go.Figure()
         fig.add_trace(go.Scatter(
-            x=self.monitoring_data['timestamps'],
-            y=self.monitoring_data['stock_counts'],
+            x=data['timestamps'],
+            y=data['stock_counts'],
             mode='lines+markers',
             name='股票数量',
             line=dict(color='blue', width=2),
@@ -1135,19 +2261,20 @@ class StockMonitor:
         )
         st.plotly_chart(fig, use_container_width=True)
 
-    def create_slope_chart(self):
-        if not self.monitoring_data['slope_data']:
+    def top_slope_rows(self, prices, n=20):
+        """斜率从高到低的前 n 只股票在快照中的行号"""
+        return top_k_indices(prices.slopes, n)
+
+    def create_slope_chart(self, data):
+        if not data['price_snapshots']:
             st.info("暂无斜率数据")
             return
-        latest_slopes = self.monitoring_data['slope_data'][-1]
-        if not latest_slopes:
+        latest_prices = data['price_snapshots'][-1]
+        if len(latest_prices) == 0:
             return
-        sorted_slopes = sorted(latest_slopes.items(), key=lambda x: x[1], reverse=True)
-        top_stocks = sorted_slopes[:20]
-        if not top_stocks:
-            return
-        stocks = [item[0] for item in top_stocks]
-        slopes = [item[1] for item in top_stocks]
+        top_rows = self.top_slope_rows(latest_prices)
+        stocks = latest_prices.keys[top_rows].tolist()
+        slopes = latest_prices.slopes[top_rows].tolist()
         colors = ['red' if s < 0 else 'green' for s in slopes]
         fig = go.Figure()
         fig.add_trace(go.Bar(
@@ -1167,96 +2294,96 @@ class StockMonitor:
         )
         st.plotly_chart(fig, use_container_width=True)
 
-    def create_individual_stock_trend_charts(self):
+    def create_feature_table(self, data):
+        """最新快照的技术指标表，可按任意指标排序"""
+        if not data['feature_tables']:
+            return
+        features = data['feature_tables'][-1]
+        if features.empty:
+            return
+        st.subheader("技术指标")
+        sortable = [col for col in features.columns if col not in ('股票代码', '股票简称')]
+        col1, col2, col3 = st.columns([2, 1, 1])
+        with col1:
+            sort_by = st.selectbox("排序指标", sortable, index=sortable.index('7日斜率(%)'))
+        with col2:
+            ascending = st.checkbox("升序", value=False)
+        with col3:
+            top_n = st.number_input("显示数量", min_value=10, max_value=500, value=50, step=10)
+        ordered = features.sort_values(sort_by, ascending=ascending, na_position='last', kind='stable')
+        st.dataframe(ordered.head(int(top_n)).round(4), use_container_width=True, hide_index=True)
+
+    def create_rank_trajectory_chart(self, history, top_n=20):
+        """排名轨迹: 最新快照新进入前 top_n 的股票，没有新进入时显示当前前10名"""
+        if len(history.timestamps) < 2:
+            return
+        st.subheader(f"排名轨迹（{self.rank_metric}）")
+        # 只有两次快照时只能和上一次比较，滑块的最小值和最大值不能相同
+        if len(history.timestamps) > 2:
+            lookback = st.slider("对比几次快照之前", min_value=1, max_value=len(history.timestamps) - 1, value=1)
+        else:
+            lookback = 1
+        climbers = history.climbers(top_n=top_n, lookback=lookback)
+        if climbers:
+            st.success(f"{len(climbers)} 只股票新进入前{top_n}名")
+            st.dataframe(pd.DataFrame([
+                {'股票': history.label(row), '当前名次': rank,
+                 '之前名次': str(previous) if previous else f"{history.depth}名外"}
+                for row, rank, previous in climbers
+            ]), use_container_width=True, hide_index=True)
+            rows = [row for row, _, _ in climbers]
+        else:
+            st.info(f"没有新进入前{top_n}名的股票，显示当前前10名的排名轨迹")
+            rows = history.current_top(10)
+        
+        times = [timestamp.strftime("%H:%M:%S") for timestamp in history.timestamps]
+        fig = go.Figure()
+        for row in rows:
+            fig.add_trace(go.Scatter(
+                x=times,
+                y=history.trajectory(history.codes[row]),
+                mode='lines+markers',
+                name=history.label(row),
+                connectgaps=False
+            ))
+        fig.add_hline(y=top_n + 0.5, line_dash='dash', line_color='gray', annotation_text=f"前{top_n}名")
+        fig.update_layout(
+            xaxis_title='快照时间',
+            yaxis_title='名次',
+            yaxis=dict(autorange='reversed'),
+            template='plotly_white',
+            height=400
+        )
+        st.plotly_chart(fig, use_container_width=True)
+
+    def create_individual_stock_trend_charts(self, data):
         """为每个股票创建单独的走势图 - 使用改进的日期处理"""
-        if (not self.monitoring_data['slope_data'] or 
-            not self.monitoring_data['closing_sequences'] or
-            not self.monitoring_data['date_columns'] or
-            not self.monitoring_data['stock_names'] or
-            not self.monitoring_data['new_stocks']):
+        if not data['price_snapshots'] or not data['new_stocks']:
             st.info("暂无走势数据")
             return
         
-        latest_slopes = self.monitoring_data['slope_data'][-1]
-        latest_sequences = self.monitoring_data['closing_sequences'][-1]
-        latest_dates = self.monitoring_data['date_columns'][-1]
-        latest_stock_names = self.monitoring_data['stock_names'][-1]
-        latest_new_stocks = self.monitoring_data['new_stocks'][-1]
+        latest_prices = data['price_snapshots'][-1]
+        latest_new_stocks = set(data['new_stocks'][-1])
         
-        if not latest_slopes or not latest_sequences or not latest_dates or not latest_stock_names or not latest_new_stocks:
+        if len(latest_prices) == 0 or len(latest_prices.dates) == 0:
             return
         
-        sorted_slopes = sorted(latest_slopes.items(), key=lambda x: x[1], reverse=True)
-        top_stocks = sorted_slopes[:20]
-        
-        if not top_stocks:
-            return
+        top_rows = self.top_slope_rows(latest_prices)
+        top_stocks = list(zip(latest_prices.keys[top_rows].tolist(), latest_prices.slopes[top_rows].tolist()))
         
         st.subheader("斜率前20股票走势图 - 7天数据")
         
         for i, (stock, slope) in enumerate(top_stocks):
-            if stock in latest_sequences and stock in latest_dates and stock in latest_stock_names:
-                price_sequence = latest_sequences[stock]
-                date_sequence = latest_dates[stock]
-                stock_name = latest_stock_names[stock]
+            # 快照的日期轴已按时间升序排列，这里只保留最近7个交易日（不含周末和交易日历中的休市日）
+            date_sequence, price_sequence = latest_prices.series(
+                stock, trading_only=True, last_n=7, holidays=self.trading_calendar.holidays)
+            if date_sequence:
+                stock_name = latest_prices.names[latest_prices.index_of(stock)]
                 
                 # 检查是否是新增股票
                 is_new_stock = stock in latest_new_stocks
                 
                 if len(price_sequence) >= 2 and len(date_sequence) == len(price_sequence):
-                    # 改进的日期处理：确保日期按正确顺序排列且只包含交易日
-                    try:
-                        # 将日期字符串转换为datetime对象进行排序
-                        date_objs = []
-                        valid_prices = []
-                        
-                        for date_str, price in zip(date_sequence, price_sequence):
-                            try:
-                                # 尝试多种日期格式
-                                date_obj = None
-                                for fmt in ("%Y.%m.%d", "%Y-%m-%d", "%Y%m%d", "%Y/%m/%d"):
-                                    try:
-                                        date_obj = datetime.strptime(date_str, fmt)
-                                        break
-                                    except:
-                                        continue
-                                
-                                if date_obj:
-                                    # 检查是否为交易日（排除周六周日）
-                                    if date_obj.weekday() < 5:  # 0-4表示周一到周五
-                                        date_objs.append(date_obj)
-                                        valid_prices.append(price)
-                                    else:
-                                        logging.debug(f"跳过非交易日: {date_str}")
-                                else:
-                                    logging.warning(f"无法解析日期: {date_str}")
-                            except Exception as e:
-                                logging.warning(f"日期解析错误 {date_str}: {str(e)}")
-                                continue
-                        
-                        # 如果成功解析了日期，按日期排序
-                        if len(date_objs) > 0:
-                            # 按日期排序（从早到晚）
-                            sorted_data = sorted(zip(date_objs, valid_prices))
-                            sorted_dates = [date.strftime('%Y-%m-%d') for date, _ in sorted_data]
-                            sorted_prices = [price for _, price in sorted_data]
-                            
-                            # 确保只显示7个交易日的数据
-                            if len(sorted_dates) > 7:
-                                sorted_dates = sorted_dates[-7:]
-                                sorted_prices = sorted_prices[-7:]
-                            
-                            date_sequence = sorted_dates
-                            price_sequence = sorted_prices
-                            logging.debug(f"步骤: Successfully processed dates for {stock}: {date_sequence}")
-                        else:
-                            # 如果日期解析失败，使用原始顺序但记录警告
-                            logging.warning(f"步骤: Date parsing incomplete for {stock}, using original order")
-                            st.warning(f"股票 {stock} 的日期数据不完整，可能影响图表显示")
-                    except Exception as e:
-                        logging.warning(f"Failed to process dates for {stock}: {str(e)}")
-                        # 出错时保持原始顺序
-                    
                     # 创建折线图
                     fig = go.Figure()
                     
@@ -1364,18 +2491,53 @@ class StockMonitor:
                 st.warning(f"股票 {stock} 缺少价格、日期或名称数据")
 
     def show_monitoring_dashboard(self):
+        # 只在取视图时持有数据锁，渲染期间发布线程可以继续追加快照
+        self.render_monitoring_dashboard(self.dashboard_view())
+
+    def dashboard_view(self):
+        """渲染所需数据的一致视图: 快照列表只复制引用（已发布的快照不再修改），原地更新的排名历史和累积价格库
+        每个发布版本复制一次，所有会话共用"""
+        with self.data_lock:
+            if self.dashboard_cache is None or self.dashboard_cache['version'] != self.data_version:
+                self.dashboard_cache = {
+                    'version': self.data_version,
+                    'monitoring_data': {key: list(values) for key, values in self.monitoring_data.items()},
+                    'rank_history': RankHistory.from_arrays(self.rank_history.to_arrays()),
+                    'price_store': PriceHistoryStore.from_arrays(self.price_store.to_arrays()),
+                }
+            return self.dashboard_cache
+
+    def export_files(self):
+        """最新快照导出的 CSV 和 Excel 文件内容，从仪表板视图生成，每个发布版本只生成一次"""
+        view = self.dashboard_view()
+        stock_lists = view['monitoring_data']['stock_lists']
+        if not stock_lists:
+            return None
+        if 'exports' not in view:
+            latest_data = stock_lists[-1]
+            excel_buffer = io.BytesIO()
+            with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
+                latest_data.to_excel(writer, index=False, sheet_name='股票数据')
+            view['exports'] = {
+                'csv': latest_data.to_csv(index=False).encode('utf-8-sig'),
+                'excel': excel_buffer.getvalue(),
+            }
+        return view['exports']
+
+    def render_monitoring_dashboard(self, view):
+        data = view['monitoring_data']
         st.header("监控仪表板")
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.metric("监控数据点", len(self.monitoring_data['timestamps']))
+            st.metric("监控数据点", len(data['timestamps']))
         with col2:
-            if self.monitoring_data['stock_counts']:
-                st.metric("最新股票数量", self.monitoring_data['stock_counts'][-1])
+            if data['stock_counts']:
+                st.metric("最新股票数量", data['stock_counts'][-1])
             else:
                 st.metric("最新股票数量", 0)
         with col3:
-            if self.monitoring_data['timestamps']:
-                st.metric("最后更新时间", self.monitoring_data['timestamps'][-1].strftime("%H:%M:%S"))
+            if data['timestamps']:
+                st.metric("最后更新时间", data['timestamps'][-1].strftime("%H:%M:%S"))
             else:
                 st.metric("最后更新时间", "无数据")
         with col4:
@@ -1387,167 +2549,480 @@ class StockMonitor:
                 st.metric("监控状态", "已停止")
         
         # 显示新出现股票的信息
-        if self.monitoring_data['new_stocks'] and len(self.monitoring_data['new_stocks']) > 0:
-            latest_new_stocks = self.monitoring_data['new_stocks'][-1]
+        if data['new_stocks'] and len(data['new_stocks']) > 0:
+            latest_new_stocks = data['new_stocks'][-1]
             if latest_new_stocks:
                 st.subheader("🎉 新出现股票")
                 st.info(f"本次刷新发现了 {len(latest_new_stocks)} 只新股票")
-                for i, stock in enumerate(latest_new_stocks):
+                # 首次快照时全部股票都是新股票，只列出前20只，完整标记见下方股票列表
+                for i, stock in enumerate(latest_new_stocks[:20]):
                     st.success(f"{i+1}. {stock}")
+                if len(latest_new_stocks) > 20:
+                    st.caption(f"……其余 {len(latest_new_stocks) - 20} 只见下方股票列表（勾选\"只看新股票\"）")
         
-        self.create_stock_count_chart()
+        self.show_recent_alerts()
+        
+        self.create_stock_count_chart(data)
         
         col1, col2 = st.columns(2)
         with col1:
-            self.create_slope_chart()
+            self.create_slope_chart(data)
         with col2:
             st.subheader("股票走势分析")
             st.info("下方将显示每个股票的详细走势图，基于7天收盘价计算斜率")
             st.info("🆕 标记表示新出现的股票")
             st.info("📈 时间轴已按正确的时间顺序排列，不含周六周日")
         
-        self.create_individual_stock_trend_charts()
+        self.create_feature_table(data)
+        
+        self.create_rank_trajectory_chart(view['rank_history'])
         
-        if self.monitoring_data['stock_lists']:
+        self.create_individual_stock_trend_charts(data)
+        
+        if data['stock_lists']:
             st.subheader("最新股票列表")
-            latest_df = self.monitoring_data['stock_lists'][-1]
+            latest_df = data['stock_lists'][-1]
+            self.show_latest_stock_table(data, latest_df)
             
-            # 标记新出现的股票
-            if self.monitoring_data['new_stocks'] and len(self.monitoring_data['new_stocks']) > 0:
-                latest_new_stocks = self.monitoring_data['new_stocks'][-1]
-                
-                # 创建显示用的DataFrame，添加新股票标记
-                display_df = latest_df.copy()
-                
-                # 添加新股票标记列
-                display_df['是否新股票'] = ''
-                for index, row in display_df.iterrows():
-                    stock_code = self.get_stock_code(row, display_df.columns)
-                    stock_name = self.get_stock_name(row, display_df.columns)
-                    stock_key = f"{stock_code} {stock_name}".strip()
-                    if stock_key in latest_new_stocks:
-                        display_df.at[index, '是否新股票'] = '🆕'
-                
-                st.dataframe(display_df, use_container_width=True)
-            else:
-                st.dataframe(latest_df, use_container_width=True)
+            self.show_price_history(view['price_store'])
             
-            with st.expander("数据统计信息"):
-                st.write(f"总股票数: {len(latest_df)}")
-                st.write(f"数据列数: {len(latest_df.columns)}")
-                
-                numeric_cols = latest_df.select_dtypes(include=[np.number]).columns.tolist()
-                if numeric_cols:
-                    st.write("数值列统计:")
-                    st.dataframe(latest_df[numeric_cols].describe(), use_container_width=True)
+            self.show_snapshot_stats(data)
+
+    def show_recent_alerts(self):
+        """最近触发的告警（新的在前）和每个输出的发送延迟"""
+        alerts = self.alert_manager.recent_alerts()
+        if not alerts:
+            return
+        st.subheader("🔔 最近告警")
+        st.dataframe(pd.DataFrame([{
+            '时间': datetime.fromtimestamp(alert['triggered_at']).strftime("%H:%M:%S"),
+            '规则': alert['rule'],
+            '股票代码': alert['code'],
+            '股票简称': alert['name'],
+            '说明': alert['message'],
+            '触发延迟(ms)': round((alert['triggered_at'] - alert['processed_at']) * 1000, 1),
+        } for alert in alerts]), use_container_width=True, height=240)
+        latency = self.alert_manager.latency_summary()
+        if latency:
+            st.caption("处理完成到发送的延迟")
+            st.dataframe(pd.DataFrame(latency).round(1), use_container_width=True)
+
+    def show_snapshot_stats(self, data):
+        """显示解析时已算好的快照统计，不再对表格重新 describe"""
+        if not data['snapshot_stats']:
+            return
+        latest_stats = data['snapshot_stats'][-1]
+        with st.expander("数据统计信息"):
+            st.write(f"总股票数: {latest_stats['stock_count']}")
+            st.write(f"数据列数: {latest_stats['column_count']}")
+            
+            if not latest_stats['describe'].empty:
+                st.write("数值列统计:")
+                st.dataframe(latest_stats['describe'], use_container_width=True)
+            
+            null_rates = {col: rate for col, rate in latest_stats['null_rates'].items() if rate > 0}
+            if null_rates:
+                st.write("缺失率:")
+                st.dataframe(pd.DataFrame({'列': list(null_rates.keys()), '缺失率': list(null_rates.values())}),
+                             use_container_width=True, hide_index=True)
+            
+            if len(data['snapshot_stats']) > 1:
+                st.write("历次快照:")
+                st.dataframe(pd.DataFrame([
+                    {'时间': timestamp.strftime("%H:%M:%S"), '股票数': stats['stock_count'],
+                     '列数': stats['column_count'], '数值列数': stats['numeric_column_count'],
+                     '平均缺失率': round(stats['overall_null_rate'], 4)}
+                    for timestamp, stats in zip(data['timestamps'], data['snapshot_stats'])
+                ]), use_container_width=True, hide_index=True)
+
+    def show_latest_stock_table(self, data, latest_df, default_columns=10):
+        """最新股票列表: 按快照的股票键一次 isin 标记新股票，只发送当前页和选中的列"""
+        latest_prices = data['price_snapshots'][-1]
+        new_stocks = set(data['new_stocks'][-1]) if data['new_stocks'] else set()
+        is_new = pd.Series(latest_prices.keys).isin(new_stocks).to_numpy()
+        
+        col1, col2, col3 = st.columns([3, 1, 1])
+        with col1:
+            columns = st.multiselect(
+                "显示列",
+                list(latest_df.columns),
+                default=list(latest_df.columns[:default_columns]),
+                key="stock_table_columns"
+            )
+        with col2:
+            only_new = st.checkbox("只看新股票", value=False, disabled=not is_new.any())
+        with col3:
+            page_size = st.selectbox("每页行数", [50, 100, 200, 500], index=1)
+        
+        rows = np.nonzero(is_new)[0] if only_new else np.arange(len(latest_df))
+        n_pages = max(1, -(-len(rows) // page_size))
+        page = st.number_input(f"页码（共 {n_pages} 页，{len(rows)} 行）", min_value=1, max_value=n_pages, value=1)
+        page_rows = rows[(page - 1) * page_size:page * page_size]
+        
+        display_df = latest_df.iloc[page_rows][columns or list(latest_df.columns[:default_columns])]
+        display_df.insert(0, '是否新股票', np.where(is_new[page_rows], '🆕', ''))
+        st.dataframe(display_df, use_container_width=True, hide_index=True)
+
+    def show_price_history(self, store):
+        """累积价格库的规模、最近一次合并的写入量，以及单只股票的完整历史走势"""
+        store_stats = store.stats()
+        if store_stats['stocks'] == 0:
+            return
+        with st.expander("累积历史价格"):
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("股票数", store_stats['stocks'])
+            col2.metric("交易日数", store_stats['dates'])
+            col3.metric("价格单元格", store_stats['cells'])
+            if store.last_merge:
+                last_merge = store.last_merge
+                col4.metric("最近一次写入", last_merge['new_cells'] + last_merge['changed_cells'],
+                            help=f"新增 {last_merge['new_cells']}，变化 {last_merge['changed_cells']}，"
+                                 f"未变化 {last_merge['unchanged_cells']}")
+            
+            code = st.selectbox(
+                "查看股票",
+                store.codes,
+                format_func=lambda c: f"{c} {store.names[store.code_index[c]]}"
+            )
+            dates, prices = store.series(code)
+            if dates:
+                fig = go.Figure(go.Scatter(x=dates, y=prices, mode='lines+markers', name=code))
+                fig.update_layout(
+                    title=f"{code} 累积收盘价（{len(dates)}个交易日）",
+                    xaxis=dict(type='category'),
+                    template='plotly_white',
+                    height=300
+                )
+                st.plotly_chart(fig, use_container_width=True)
 
     def close(self):
+        self.standby_enabled = False
+        self.discard_standby()
         self.stop_monitoring()
+        self.scheduler_stop.set()
+        self.pipeline.stop()
+        self.alert_manager.stop()
+        self.flush_checkpoint()
+        self.parse_pool.shutdown()
         if self.driver:
             self.driver.quit()
         if os.path.exists(self.profile_dir):
             shutil.rmtree(self.profile_dir)
+        if os.path.exists(self.staging_dir):
+            shutil.rmtree(self.staging_dir)
+        if os.path.exists(self.download_dir):
+            shutil.rmtree(self.download_dir, ignore_errors=True)
 
 # ====================== 数据导出功能 ======================
 def add_export_functionality(monitor):
     """添加数据导出功能"""
     st.sidebar.subheader("数据导出")
     
-    if monitor.monitoring_data['stock_lists']:
-        latest_data = monitor.monitoring_data['stock_lists'][-1]
-        
-        csv_data = latest_data.to_csv(index=False).encode('utf-8-sig')
+    exports = monitor.export_files()
+    if exports:
         st.sidebar.download_button(
             label="导出CSV",
-            data=csv_data,
+            data=exports['csv'],
             file_name=f"stock_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
             mime="text/csv"
         )
         
-        excel_buffer = io.BytesIO()
-        with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-            latest_data.to_excel(writer, index=False, sheet_name='股票数据')
         st.sidebar.download_button(
             label="导出Excel",
-            data=excel_buffer.getvalue(),
+            data=exports['excel'],
             file_name=f"stock_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
         )
 
 # ====================== 主函数 ======================
+@st.cache_resource
+def get_monitor_service():
+    """进程内唯一的监控服务: 所有浏览器会话共享同一个浏览器、流水线和快照历史"""
+    monitor = StockMonitor()
+    monitor.start_scheduler()
+    return monitor
+
+
 def main():
-    if 'monitor' not in st.session_state:
-        st.session_state.monitor = StockMonitor()
-    if 'search_query' not in st.session_state:
-        st.session_state.search_query = "2025年11月12日收盘价大于5日均线，2025年11月13日收盘价大于5日均线，2025年11月14日收盘价大于5日均线，2025年11月17日收盘价大于5日均线，2025年11月18日收盘价大于5日均线，2025年11月19日收盘价大于5日均线，2025年11月20日收盘价大于5日均线，非ST，非北交所，财务综合评分大于2.5"  # 修改为7个交易日
+    monitor = get_monitor_service()
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    is_controller = monitor.heartbeat(st.session_state.session_id)
     
     st.sidebar.title("控制面板")
     
+    st.sidebar.subheader("会话")
+    st.sidebar.caption(f"{monitor.active_sessions()} 个活跃会话共享同一个监控服务（一个浏览器、一条流水线）")
+    if is_controller:
+        st.sidebar.success("本会话拥有控制权")
+    else:
+        st.sidebar.info("只读订阅: 数据随监控服务自动更新")
+        if st.sidebar.button("接管控制"):
+            monitor.claim_control(st.session_state.session_id)
+            st.rerun()
+    monitor.show_status_messages()
+    
     st.sidebar.subheader("固化匹配状态")
-    cache_data = []
-    for element_type, cache_info in st.session_state.monitor.cached_selectors.items():
-        if cache_info:
-            cache_data.append({
-                '元素类型': element_type,
-                '选择器': cache_info['selector'],
-                '描述': cache_info['description']
-            })
-        else:
+    cache_data = monitor.selector_cache.summary()
+    for element_type in ('search_box', 'search_button', 'download_button'):
+        if not any(row['元素类型'] == element_type for row in cache_data):
             cache_data.append({
                 '元素类型': element_type,
                 '选择器': '未缓存',
-                '描述': '未缓存'
+                '描述': '未缓存',
+                '首次命中率': 'N/A',
+                '查找次数': 0,
+                '平均耗时(ms)': None
             })
     st.sidebar.dataframe(pd.DataFrame(cache_data), use_container_width=True)
     
+    st.sidebar.subheader("浏览器")
+    headless = st.sidebar.checkbox("无头模式（不显示浏览器窗口）", value=monitor.headless, disabled=not is_controller,
+                                   help="服务器上无需虚拟显示器，内存和 CPU 占用更低；切换后浏览器在当前周期结束后重启。"
+                                   "需要扫码登录时先在有界面模式下登录，切换后登录状态保留")
+    if is_controller:
+        monitor.set_headless(headless)
+    standby_enabled = st.sidebar.checkbox("热备浏览器（崩溃时立即接管）", value=monitor.standby_enabled,
+                                          disabled=not is_controller, help="多占用一个浏览器实例的内存，换取秒级故障切换")
+    if is_controller:
+        monitor.set_standby_enabled(standby_enabled)
+    failover_stats = monitor.failover_stats
+    if monitor.driver_initialized:
+        standby_status = "就绪" if monitor.standby else ("启动中" if monitor.standby_enabled else "关闭")
+        last_failover = failover_stats['last_failover_seconds']
+        st.sidebar.caption(
+            f"热备: {standby_status}，故障切换 {failover_stats['failovers']} 次"
+            + (f"（最近一次 {last_failover:.1f} 秒）" if last_failover is not None else "")
+            + f"，周期内重试 {failover_stats['retries']} 次，冷启动 {failover_stats['cold_starts']} 次"
+        )
+    
+    st.sidebar.subheader("页面加载优化")
+    profile_names = list(RESOURCE_BLOCK_PROFILES.keys())
+    block_profile = st.sidebar.selectbox(
+        "资源拦截方案",
+        profile_names,
+        index=profile_names.index(monitor.resource_block_profile),
+        format_func=lambda name: f"{name} - {RESOURCE_BLOCK_PROFILES[name]['description']}",
+        disabled=not is_controller
+    )
+    baseline_every = st.sidebar.number_input(
+        "每隔几次页面加载测一次不拦截基线（0 为不测）", min_value=0, max_value=500, value=monitor.baseline_every,
+        help="基线加载前如需切换图片设置会重启浏览器；启动后的第一次加载不计入统计",
+        disabled=not is_controller
+    )
+    if is_controller:
+        monitor.set_resource_block_profile(block_profile)
+        monitor.baseline_every = int(baseline_every)
+    page_load_summary = monitor.get_page_load_summary()
+    if page_load_summary:
+        st.sidebar.dataframe(pd.DataFrame(page_load_summary), use_container_width=True)
+    else:
+        st.sidebar.caption("暂无页面加载耗时数据")
+    
+    st.sidebar.subheader("数据来源")
+    data_sources = {'download': '导出文件（导数据）', 'dom': '页面表格（DOM 直接提取）'}
+    data_source = st.sidebar.radio(
+        "数据来源",
+        list(data_sources.keys()),
+        index=list(data_sources.keys()).index(monitor.data_source),
+        format_func=lambda key: data_sources[key],
+        label_visibility="collapsed",
+        disabled=not is_controller
+    )
+    if is_controller:
+        monitor.data_source = data_source
+    
+    st.sidebar.subheader("分片查询")
+    shard_modes = {'off': '不拆分', 'board': '按板块（' + '/'.join(BOARD_SHARDS) + '）', 'custom': '自定义分区'}
+    shard_mode = st.sidebar.selectbox(
+        "分片方式",
+        list(shard_modes.keys()),
+        index=list(shard_modes.keys()).index(monitor.shard_mode),
+        format_func=lambda key: shard_modes[key],
+        help="宽泛查询结果过大时拆成多个子查询，在多个标签页中并发执行，结果按股票代码合并去重",
+        disabled=not is_controller
+    )
+    custom_shards_text = monitor.custom_shards
+    if shard_mode == 'custom':
+        custom_shards_text = st.sidebar.text_area(
+            "每行一个分区条件", value="\n".join(monitor.custom_shards), height=100, disabled=not is_controller
+        ).splitlines()
+    if is_controller:
+        monitor.shard_mode = shard_mode
+        monitor.custom_shards = [line.strip() for line in custom_shards_text if line.strip()]
+    
     st.sidebar.subheader("搜索设置")
-    search_query = st.sidebar.text_area("搜索查询", value=st.session_state.search_query, height=100)
-    if search_query != st.session_state.search_query:
-        st.session_state.search_query = search_query
+    search_query = st.sidebar.text_area("搜索查询", value=monitor.search_query, height=100, disabled=not is_controller)
+    if is_controller and search_query != monitor.search_query:
+        monitor.search_query = search_query
         st.sidebar.success("搜索查询已更新")
+    if QueryTemplateExpander.is_template(monitor.search_query):
+        st.sidebar.caption("实际查询: " + monitor.query_templates.expand(monitor.search_query))
+    st.sidebar.caption("模板: {最近N个交易日:{日期}...} 按最近N个交易日展开，{T} / {T-k} 为最近交易日 / 往前第k个交易日")
     
-    if st.sidebar.button("一键自动化测试", type="primary"):
+    if st.sidebar.button("一键自动化测试", type="primary", disabled=not is_controller):
         with st.spinner("执行一键自动化测试..."):
-            if st.session_state.monitor.one_click_automation_with_refresh(st.session_state.search_query):
-                data = st.session_state.monitor.process_downloaded_data()
-                if data:
-                    st.session_state.monitor.monitoring_data['timestamps'].append(data['timestamp'])
-                    st.session_state.monitor.monitoring_data['stock_counts'].append(data['stock_count'])
-                    st.session_state.monitor.monitoring_data['stock_lists'].append(data['stock_list'])
-                    st.session_state.monitor.monitoring_data['slope_data'].append(data['slopes'])
-                    st.session_state.monitor.monitoring_data['closing_sequences'].append(data['closing_sequences'])
-                    st.session_state.monitor.monitoring_data['date_columns'].append(data['date_columns'])
-                    st.session_state.monitor.monitoring_data['stock_names'].append(data['stock_names'])
-                    st.session_state.monitor.monitoring_data['new_stocks'].append(data['new_stocks'])
-                    st.success("一键自动化测试成功")
-                else:
-                    st.error("数据处理失败")
+            data = monitor.fetch_snapshot(monitor.search_query)
+            if data and monitor.is_published(data):
+                st.success("一键自动化测试成功（缓存命中，结果已是最新快照）")
+            elif data:
+                # 缓存命中时快照可能处理于几分钟前，告警延迟从本次发布算起
+                monitor.append_snapshot(data, processed_at=time.time())
+                st.success("一键自动化测试成功")
             else:
                 st.error("一键自动化测试失败")
     
+    st.sidebar.subheader("查询结果缓存")
+    cache = monitor.result_cache
+    cache_ttl = st.sidebar.number_input("缓存有效期(秒，0 为关闭)", min_value=0, max_value=3600,
+                                        value=int(cache.ttl_seconds), step=30, disabled=not is_controller)
+    cache_size = st.sidebar.number_input("最多缓存查询数", min_value=1, max_value=256,
+                                         value=cache.max_entries, disabled=not is_controller)
+    if is_controller:
+        cache.ttl_seconds = int(cache_ttl)
+        cache.max_entries = int(cache_size)
+    cache_stats = cache.stats()
+    st.sidebar.caption(
+        f"{cache_stats['entries']} 条缓存，命中 {cache_stats['hits']} 次 / 未命中 {cache_stats['misses']} 次"
+        f"（命中率 {cache_stats['hit_rate']:.0%}）；只有一键测试读缓存，定时周期总是重新抓取；分片方式和数据来源不同的结果分开缓存"
+    )
+    
     st.sidebar.subheader("自动监控")
-    interval = st.sidebar.slider("监控间隔(分钟)", 1, 30, 5)
+    interval = st.sidebar.slider("监控间隔(分钟)", 1, 30, monitor.monitoring_interval, disabled=not is_controller)
+    scheduler = monitor.scheduler
+    sessions_only = st.sidebar.checkbox(
+        "仅在交易时段运行", value=scheduler.sessions_only,
+        help="工作日 09:30-11:30、13:00-15:00，节假日休市",
+        disabled=not is_controller
+    )
+    fast_polling = st.sidebar.checkbox("开盘/收盘前后加快轮询", value=scheduler.fast_interval_minutes is not None,
+                                       disabled=not is_controller)
+    if fast_polling:
+        fast_interval = st.sidebar.slider("加快后的间隔(分钟)", 1, 10, scheduler.fast_interval_minutes or 1,
+                                          disabled=not is_controller)
+        fast_window = st.sidebar.slider("开盘后/收盘前(分钟)", 5, 30, scheduler.fast_window_minutes,
+                                        disabled=not is_controller)
+    if is_controller:
+        scheduler.sessions_only = sessions_only
+        scheduler.fast_interval_minutes = fast_interval if fast_polling else None
+        if fast_polling:
+            scheduler.fast_window_minutes = fast_window
+    with st.sidebar.expander("休市日"):
+        holidays_text = st.text_area(
+            "每行一个日期（只需列出工作日）",
+            value="\n".join(monitor.trading_calendar.holidays),
+            height=150,
+            disabled=not is_controller
+        )
+        if st.button("保存休市日", disabled=not is_controller):
+            try:
+                holidays = [line.strip() for line in holidays_text.splitlines() if line.strip()]
+                monitor.update_holidays(holidays)
+                st.success(f"已保存 {len(holidays)} 个休市日")
+            except Exception as e:
+                st.error(f"日期格式错误: {str(e)}")
     col1, col2 = st.sidebar.columns(2)
     with col1:
-        if st.button("开始监控", type="primary"):
-            if not st.session_state.monitor.is_monitoring:
-                st.session_state.monitor.start_monitoring(interval)
+        if st.button("开始监控", type="primary", disabled=not is_controller):
+            if not monitor.is_monitoring:
+                monitor.start_monitoring(interval)
             else:
                 st.warning("监控已在运行")
     with col2:
-        if st.button("停止监控"):
-            st.session_state.monitor.stop_monitoring()
+        if st.button("停止监控", disabled=not is_controller):
+            monitor.stop_monitoring()
     
-    if st.session_state.monitor.is_monitoring:
+    if monitor.is_monitoring:
         st.sidebar.success("监控运行中")
-        if st.session_state.monitor.next_execution_time:
-            st.sidebar.info(f"下次执行时间: {st.session_state.monitor.next_execution_time.strftime('%H:%M:%S')}")
+        if monitor.next_execution_time:
+            st.sidebar.info(f"下次执行时间: {monitor.next_execution_time.strftime('%m-%d %H:%M:%S')}")
+        if not scheduler.should_run(datetime.now()):
+            st.sidebar.warning("当前休市，周期将在开盘后恢复")
+        skipped = scheduler.skipped
+        if skipped['closed'] or skipped['busy']:
+            st.sidebar.caption(f"已跳过周期: 休市 {skipped['closed']} 次，上一周期未完成 {skipped['busy']} 次")
     else:
         st.sidebar.info("监控已停止")
     
-    add_export_functionality(st.session_state.monitor)
+    st.sidebar.subheader("告警")
+    alert_manager = monitor.alert_manager
+    with st.sidebar.expander("告警规则和输出"):
+        rules = {rule['type']: rule for rule in alert_manager.config['rules']}
+        sinks = {sink['type']: sink for sink in alert_manager.config['sinks']}
+        enter_enabled = st.checkbox("股票新进入筛选结果", value='enter' in rules, disabled=not is_controller)
+        threshold_enabled = st.checkbox("7日斜率穿越阈值", value='threshold' in rules, disabled=not is_controller)
+        threshold_rule = rules.get('threshold', {})
+        threshold = st.number_input("斜率阈值(%)", value=float(threshold_rule.get('threshold', 5.0)), step=0.5,
+                                    disabled=not is_controller)
+        direction = st.radio("穿越方向", ['up', 'down'], index=0 if threshold_rule.get('direction', 'up') == 'up' else 1,
+                             format_func=lambda value: "向上" if value == 'up' else "向下", horizontal=True,
+                             disabled=not is_controller)
+        rank_enabled = st.checkbox("进入7日斜率前 N 名", value='rank' in rules, disabled=not is_controller)
+        top_n = st.number_input("N", min_value=1, max_value=500, value=int(rules.get('rank', {}).get('top_n', 10)),
+                                disabled=not is_controller)
+        webhook_url = st.text_input("Webhook 地址（留空不发送）", value=sinks.get('webhook', {}).get('url', ''),
+                                    disabled=not is_controller)
+        file_path = st.text_input("写入文件（JSON Lines，留空不写）", value=sinks.get('file', {}).get('path', ''),
+                                  disabled=not is_controller)
+        stdout_enabled = st.checkbox("输出到控制台", value='stdout' in sinks, disabled=not is_controller)
+        if st.button("保存告警设置", disabled=not is_controller):
+            rule_specs = []
+            if enter_enabled:
+                rule_specs.append({'type': 'enter'})
+            if threshold_enabled:
+                rule_specs.append({'type': 'threshold', 'column': '7日斜率(%)', 'threshold': float(threshold),
+                                   'direction': direction})
+            if rank_enabled:
+                rule_specs.append({'type': 'rank', 'column': '7日斜率(%)', 'top_n': int(top_n)})
+            sink_specs = []
+            if webhook_url.strip():
+                sink_specs.append({'type': 'webhook', 'url': webhook_url.strip()})
+            if file_path.strip():
+                sink_specs.append({'type': 'file', 'path': file_path.strip()})
+            if stdout_enabled:
+                sink_specs.append({'type': 'stdout'})
+            try:
+                monitor.update_alert_config({'rules': rule_specs, 'sinks': sink_specs})
+                st.success(f"已保存 {len(rule_specs)} 条规则，{len(sink_specs)} 个输出")
+            except Exception as e:
+                st.error(f"告警设置无效: {str(e)}")
+    alert_stats = alert_manager.stats
+    if alert_stats['evaluations']:
+        st.sidebar.caption(
+            f"已评估 {alert_stats['evaluations']} 次快照，触发 {alert_stats['alerts']} 条告警，"
+            f"发送成功 {alert_stats['sent']} 条 / 失败 {alert_stats['failed']} 条"
+        )
+    
+    st.sidebar.subheader("原始数据归档")
+    archive_enabled = st.sidebar.checkbox("归档原始导出文件", value=monitor.archive_enabled, disabled=not is_controller)
+    retention_days = st.sidebar.number_input("保留天数", min_value=1, max_value=3650,
+                                             value=monitor.archive.retention_days, disabled=not is_controller)
+    if is_controller:
+        monitor.archive_enabled = archive_enabled
+        monitor.archive.retention_days = int(retention_days)
+    archive_summary = monitor.archive.summary()
+    if archive_summary['entries']:
+        st.sidebar.caption(
+            f"{archive_summary['downloads']} 次下载，{archive_summary['objects']} 个不同文件，"
+            f"{archive_summary['raw_bytes'] / 1024:.0f} KB → {archive_summary['stored_bytes'] / 1024:.0f} KB"
+            f"（{archive_summary['codec']}）"
+        )
+    
+    if monitor.checkpoint_info:
+        info = monitor.checkpoint_info
+        parts = [f"检查点 {info['saved_at'].strftime('%m-%d %H:%M:%S')}"]
+        if 'restore_seconds' in info:
+            parts.append(f"启动时恢复 {info['restored_snapshots']} 次快照，耗时 {info['restore_seconds'] * 1000:.0f} ms")
+        if 'bytes' in info:
+            parts.append(f"{info['bytes'] / 1024:.0f} KB")
+        st.sidebar.caption("，".join(parts))
+    
+    st.sidebar.subheader("流水线状态")
+    st.sidebar.dataframe(pd.DataFrame(monitor.pipeline.get_status()), use_container_width=True)
     
-    st.session_state.monitor.show_monitoring_dashboard()
+    add_export_functionality(monitor)
+    
+    monitor.show_monitoring_dashboard()
     
     with st.expander("使用说明"):
         st.markdown("""
@@ -1559,7 +3034,15 @@ def main():
         - **股票简称显示**: 在折线图标题和第二列中显示股票简称
         - **日期匹配**: 自动匹配收盘价列与对应日期，确保走势图横坐标显示正确日期
         - **时间轴优化**: 坐标轴按正确的时间顺序排列，以一天为单位，不含周六周日
-        - **实时监控**: 可设置定时自动执行
+        - **多会话共享**: 所有打开的页面共享同一个监控服务（一个浏览器、一条流水线、一份快照历史），一个会话拥有控制权，其余会话只读订阅
+        - **实时监控**: 可设置定时自动执行，默认只在交易时段（工作日 09:30-11:30、13:00-15:00，可配置休市日）运行，开盘/收盘前后可加快轮询；上一周期未完成时跳过，不会堆积
+        - **流水线周期**: 抓取、解析计算、发布三个阶段在后台线程中并行，解析大文件不会推迟下一次抓取，侧边栏显示各阶段队列深度
+        - **页面表格直接提取**: 数据来源可选 DOM 模式，在浏览器内一次性序列化结果表格（含多行表头和分页），省去下载和文件读取；表格不完整时自动回退到导数据
+        - **选择器缓存**: 选择器命中/未命中次数和耗时持久化到 ~/.dingpan，按历史成功率排序，重启后通常一次查找即可命中
+        - **页面资源拦截**: 通过 CDP 拦截图片、字体、广告和统计脚本，配合 eager 加载策略缩短每个周期的页面加载时间，侧边栏显示各方案的实测耗时
+        - **滚动日期查询**: 查询中的 {最近N个交易日:...}、{T-k} 按交易日历自动展开，日期不会过期
+        - **快照变化告警**: 每次发布快照时立即评估规则（新进入筛选、7日斜率穿越阈值、进入斜率前 N 名），命中的告警在后台发送到 webhook、JSON Lines 文件或控制台，并记录处理完成到发送的延迟
+        - **原始数据归档**: 每个导出文件按内容去重压缩保存（zstd 或 gzip）并记录查询和时间，修复解析逻辑后可用 `python dingpan_tools.py reprocess` 批量重新处理
         - **数据导出**: 支持CSV和Excel格式导出
         
         ### 7天斜率计算
@@ -1587,17 +3070,15 @@ def main():
         """)
     
     st.sidebar.markdown("---")
-    if st.sidebar.button("关闭系统"):
-        st.session_state.monitor.close()
+    if st.sidebar.button("关闭系统", disabled=not is_controller):
+        monitor.close()
+        # 下一次访问时重新创建监控服务
+        get_monitor_service.clear()
         st.sidebar.success("系统已关闭")
     
-    if st.session_state.monitor.is_monitoring:
-        now = datetime.now()
-        if now >= st.session_state.monitor.next_execution_time:
-            st.session_state.monitor.execute_monitoring_cycle(st.session_state.search_query)
-            st.session_state.monitor.cycle_count += 1
-            st.session_state.monitor.next_execution_time = datetime.now() + timedelta(minutes=st.session_state.monitor.monitoring_interval)
-        st.session_state.monitor.update_countdown()
+    # 周期由监控服务的调度线程触发，页面只负责定时刷新
+    if monitor.is_monitoring:
+        monitor.update_countdown()
         time.sleep(1)
         st.rerun()
 
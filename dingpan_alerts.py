@@ -0,0 +1,356 @@
+# dingpan_alerts.py
+# 快照变化告警: 快照发布时立即按规则比较上一次和本次结果，命中的告警交给后台线程分发到 webhook、文件或标准输出
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import urllib.request
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+
+from dingpan_core import RankHistory
+
+# 默认规则: 新进入筛选、7日斜率向上穿越 5%、进入斜率前 10 名；默认不配置输出，只在页面显示
+DEFAULT_ALERT_CONFIG = {
+    'rules': [
+        {'type': 'enter'},
+        {'type': 'threshold', 'column': '7日斜率(%)', 'threshold': 5.0, 'direction': 'up'},
+        {'type': 'rank', 'column': '7日斜率(%)', 'top_n': 10},
+    ],
+    'sinks': [],
+}
+
+
+def make_alert(rule, code, name, message, value=None):
+    return {
+        'rule': rule,
+        'code': str(code),
+        'name': str(name),
+        'message': message,
+        'value': None if value is None or not np.isfinite(value) else float(value),
+    }
+
+
+# ====================== 规则 ======================
+# 每条规则的 evaluate(context) 返回告警列表；context 包含上一次和本次的技术指标表、本次价格快照和新增股票，
+# 两次快照的处理时间戳（previous_processed_at、processed_at），以及监控最近的排名历史（rank_history，
+# 最后一列是本次快照）和它的排名指标（rank_metric）
+# 没有上一次快照（首个周期）时规则都不触发，避免把全部股票当成变化
+class EnterScreenRule:
+    """股票新进入查询结果"""
+    name = 'enter'
+
+    def describe(self):
+        return "新进入筛选结果"
+
+    def evaluate(self, context):
+        if context['previous'] is None:
+            return []
+        prices = context['prices']
+        alerts = []
+        for key in context['new_stocks']:
+            row = prices.index_of(key)
+            if row is None:
+                continue
+            alerts.append(make_alert(self.name, prices.codes[row], prices.names[row], "新进入筛选结果",
+                                     prices.slopes[row]))
+        return alerts
+
+
+class ThresholdCrossRule:
+    """指标从阈值一侧穿越到另一侧（direction 为 up 时从下方向上，down 时从上方向下），上一次不在结果中的股票不算穿越"""
+    name = 'threshold'
+
+    def __init__(self, column='7日斜率(%)', threshold=5.0, direction='up'):
+        self.column = column
+        self.threshold = float(threshold)
+        self.direction = direction
+
+    def describe(self):
+        return f"{self.column}{'上穿' if self.direction == 'up' else '下穿'} {self.threshold:g}"
+
+    def evaluate(self, context):
+        previous, current = context['previous'], context['current']
+        if previous is None or self.column not in previous.columns or self.column not in current.columns:
+            return []
+        before = (previous.drop_duplicates('股票代码').set_index('股票代码')[self.column]
+                  .reindex(current['股票代码']).to_numpy(dtype=np.float64))
+        after = current[self.column].to_numpy(dtype=np.float64)
+        # NaN 参与比较结果为 False，缺少上一次数值的股票不会触发
+        if self.direction == 'up':
+            crossed = (before < self.threshold) & (after >= self.threshold)
+        else:
+            crossed = (before > self.threshold) & (after <= self.threshold)
+        codes = current['股票代码'].to_numpy()
+        names = current['股票简称'].to_numpy()
+        return [
+            make_alert(self.name, codes[i], names[i],
+                       f"{self.describe()}（{before[i]:.2f} → {after[i]:.2f}）", after[i])
+            for i in np.flatnonzero(crossed)
+        ]
+
+
+class RankTopNRule:
+    """按指标从高到低排名，股票进入前 top_n 名（上一次不在前 top_n 名）
+
+    名次直接读取监控的排名历史（和仪表板的排名变化一致）；监控没有按该列排名或 top_n 超过历史深度时，
+    规则自己维护一份只记前 top_n 名、只保留上一次快照的排名历史，每个快照同样只排名一次。
+    """
+    name = 'rank'
+
+    def __init__(self, column='7日斜率(%)', top_n=10):
+        self.column = column
+        self.top_n = int(top_n)
+        self.history = None
+        self.history_source = None
+
+    def describe(self):
+        return f"进入{self.column}前 {self.top_n} 名"
+
+    def append_rank(self, history, features, processed_at):
+        history.append(features['股票代码'].tolist(), features['股票简称'].tolist(),
+                       features[self.column].to_numpy(dtype=np.float64), datetime.fromtimestamp(processed_at))
+
+    def own_history(self, context):
+        """上一次和本次快照的排名；上次评估的不是上一次快照时（首次评估或中间跳过），先给上一次快照排名"""
+        previous, current = context['previous'], context['current']
+        if self.history is not None and self.history_source is previous:
+            history = self.history
+        else:
+            history = RankHistory(depth=self.top_n)
+            previous_processed_at = context.get('previous_processed_at')
+            # 不知道上一次快照的时间时只记录本次，下一个快照再比较
+            if previous_processed_at is not None and self.column in previous.columns:
+                self.append_rank(history, previous, previous_processed_at)
+        self.append_rank(history, current, context['processed_at'])
+        # 下一次只和本次比较，历史不随快照数增长
+        self.history, self.history_source = history.tail(1), current
+        return history
+
+    def evaluate(self, context):
+        previous, current = context['previous'], context['current']
+        if previous is None or self.column not in current.columns:
+            return []
+        history = context.get('rank_history')
+        if history is None or context.get('rank_metric') != self.column or self.top_n > history.depth:
+            history = self.own_history(context)
+        return [
+            make_alert(self.name, history.codes[row], history.names[row],
+                       f"进入{self.column}前 {self.top_n} 名（第 {rank} 名）", history.value_at(rank))
+            for row, rank, _ in history.climbers(self.top_n)
+        ]
+
+
+RULE_TYPES = {'enter': EnterScreenRule, 'threshold': ThresholdCrossRule, 'rank': RankTopNRule}
+
+
+# ====================== 输出 ======================
+# 每个输出的 send(alerts) 一次接收同一快照的全部告警
+class StdoutSink:
+    name = 'stdout'
+
+    def describe(self):
+        return "标准输出"
+
+    def send(self, alerts):
+        for alert in alerts:
+            sys.stdout.write(json.dumps(alert, ensure_ascii=False) + '\n')
+        sys.stdout.flush()
+
+
+class FileSink:
+    """追加写入 JSON Lines 文件，每行一条告警"""
+    name = 'file'
+
+    def __init__(self, path):
+        self.path = path
+
+    def describe(self):
+        return f"文件 {self.path}"
+
+    def send(self, alerts):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for alert in alerts:
+                f.write(json.dumps(alert, ensure_ascii=False) + '\n')
+
+
+class WebhookSink:
+    """POST {"alerts": [...]} JSON 到指定地址，同一快照的告警合并为一次请求"""
+    name = 'webhook'
+
+    def __init__(self, url, timeout=5.0):
+        self.url = url
+        self.timeout = float(timeout)
+
+    def describe(self):
+        return f"Webhook {self.url}"
+
+    def send(self, alerts):
+        body = json.dumps({'alerts': alerts}, ensure_ascii=False).encode('utf-8')
+        request = urllib.request.Request(self.url, data=body, method='POST',
+                                         headers={'Content-Type': 'application/json; charset=utf-8'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+SINK_TYPES = {'stdout': StdoutSink, 'file': FileSink, 'webhook': WebhookSink}
+
+
+def build_from_config(spec, types):
+    options = {key: value for key, value in spec.items() if key != 'type'}
+    return types[spec['type']](**options)
+
+
+# ====================== 告警管理 ======================
+class AlertManager:
+    """发布线程调用 evaluate 同步执行规则（只做向量比较，毫秒级），命中的告警放入队列由后台线程发送，慢的 webhook 不阻塞发布
+
+    每条告警带 processed_at（快照处理完成时间）和 triggered_at（规则命中时间）；发送给输出时再加上 sent_at
+    和 latency_ms（处理完成到发送的延迟），延迟按输出分别统计。
+    """
+
+    def __init__(self, config=None, history=200):
+        self.rules = []
+        self.sinks = []
+        self.config = None
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.recent = deque(maxlen=history)
+        self.latencies = {}
+        self.stats = {'evaluations': 0, 'alerts': 0, 'sent': 0, 'failed': 0}
+        self.thread = None
+        self.configure(config or DEFAULT_ALERT_CONFIG)
+
+    def configure(self, config):
+        """按配置重建规则和输出，配置有误时抛出异常并保留原来的设置"""
+        rules = [build_from_config(spec, RULE_TYPES) for spec in config.get('rules', [])]
+        sinks = [build_from_config(spec, SINK_TYPES) for spec in config.get('sinks', [])]
+        with self.lock:
+            self.rules = rules
+            self.sinks = sinks
+            self.config = {'rules': list(config.get('rules', [])), 'sinks': list(config.get('sinks', []))}
+            self.latencies = {sink.describe(): deque(maxlen=500) for sink in sinks}
+        logging.debug(f"步骤: Alert manager configured with {len(rules)} rules and {len(sinks)} sinks")
+
+    def evaluate(self, previous, current, prices, new_stocks, processed_at, rank_history=None, rank_metric=None,
+                 previous_processed_at=None):
+        """对一次发布的快照执行全部规则，返回命中的告警；processed_at 和 previous_processed_at 为本次和上一次快照
+        处理完成的时间戳（秒）
+
+        rank_history 为以本次快照结尾的排名历史，排名规则直接读取其中的名次；评估期间不能被修改，
+        调用方在锁内用 RankHistory.tail 截取。
+        """
+        context = {'previous': previous, 'current': current, 'prices': prices, 'new_stocks': new_stocks,
+                   'processed_at': processed_at, 'previous_processed_at': previous_processed_at,
+                   'rank_history': rank_history, 'rank_metric': rank_metric}
+        with self.lock:
+            rules, sinks = list(self.rules), list(self.sinks)
+        alerts = []
+        for rule in rules:
+            try:
+                alerts.extend(rule.evaluate(context))
+            except Exception as e:
+                logging.error(f"Error evaluating alert rule {rule.describe()}: {str(e)}")
+        triggered_at = time.time()
+        for alert in alerts:
+            alert['processed_at'] = processed_at
+            alert['triggered_at'] = triggered_at
+        with self.lock:
+            self.stats['evaluations'] += 1
+            self.stats['alerts'] += len(alerts)
+            self.recent.extend(alerts)
+        if alerts:
+            logging.debug(f"步骤: {len(alerts)} alerts triggered "
+                          f"{(triggered_at - processed_at) * 1000:.1f} ms after processing")
+            if sinks:
+                self.ensure_worker()
+                self.queue.put((alerts, sinks))
+        return alerts
+
+    def ensure_worker(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.dispatch_loop, name="alert-dispatch", daemon=True)
+            self.thread.start()
+
+    def dispatch_loop(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self.dispatch(*item)
+            finally:
+                self.queue.task_done()
+
+    def dispatch(self, alerts, sinks):
+        for sink in sinks:
+            sent_at = time.time()
+            stamped = [{**alert, 'sent_at': sent_at, 'latency_ms': (sent_at - alert['processed_at']) * 1000}
+                       for alert in alerts]
+            try:
+                sink.send(stamped)
+            except Exception as e:
+                with self.lock:
+                    self.stats['failed'] += len(alerts)
+                logging.error(f"Error sending alerts to {sink.describe()}: {str(e)}")
+                continue
+            with self.lock:
+                self.stats['sent'] += len(alerts)
+                latencies = self.latencies.setdefault(sink.describe(), deque(maxlen=500))
+                latencies.append(stamped[0]['latency_ms'])
+
+    def flush(self):
+        """等待队列中的告警全部发送完"""
+        self.queue.join()
+
+    def latency_summary(self):
+        """每个输出最近发送批次的延迟（毫秒）"""
+        with self.lock:
+            latencies = {name: list(values) for name, values in self.latencies.items()}
+        return [
+            {
+                '输出': name,
+                '批次': len(values),
+                '中位数(ms)': float(np.median(values)),
+                'P95(ms)': float(np.percentile(values, 95)),
+                '最大(ms)': float(np.max(values)),
+            }
+            for name, values in latencies.items() if values
+        ]
+
+    def recent_alerts(self, n=50):
+        with self.lock:
+            return list(self.recent)[-n:][::-1]
+
+    def stop(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout=5)
+
+
+def load_alert_config(path):
+    """读取告警配置文件，不存在或损坏时使用默认配置"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return json.loads(json.dumps(DEFAULT_ALERT_CONFIG))
+    except Exception as e:
+        logging.error(f"Error loading alert config: {str(e)}")
+        return json.loads(json.dumps(DEFAULT_ALERT_CONFIG))
+
+
+def save_alert_config(path, config):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
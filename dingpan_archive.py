@@ -0,0 +1,181 @@
+# dingpan_archive.py
+# 原始导出文件归档: 按内容寻址去重压缩保存，附带查询和时间，供修复解析逻辑后批量重新处理
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 与监控应用相同的数据目录（DINGPAN_DATA_DIR，默认 ~/.dingpan）
+DEFAULT_ARCHIVE_DIR = os.path.join(
+    os.environ.get('DINGPAN_DATA_DIR', os.path.join(os.path.expanduser('~'), '.dingpan')), 'archive'
+)
+
+
+def default_codec():
+    """安装了 zstandard 时用 zstd，否则用标准库 gzip"""
+    return 'zstd' if zstandard is not None else 'gzip'
+
+
+# ====================== 归档 ======================
+class ExportArchive:
+    """objects/<sha256 前两位>/<sha256>.<codec> 保存压缩后的文件内容，index.json 记录每次下载的元数据
+
+    相同内容只保存一份对象；和上一次归档内容相同的连续下载不新增记录，只累加 repeat_count。
+    """
+    CODEC_SUFFIX = {'zstd': '.zst', 'gzip': '.gz'}
+
+    def __init__(self, root, retention_days=30, codec=None):
+        self.root = root
+        self.retention_days = retention_days
+        self.codec = codec or default_codec()
+        self.index_path = os.path.join(root, 'index.json')
+        self.lock = threading.Lock()
+        self.entries = []
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)['entries']
+        except FileNotFoundError:
+            self.entries = []
+        except Exception as e:
+            logging.error(f"Error loading export archive index: {str(e)}")
+            self.entries = []
+
+    def save(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'entries': self.entries}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+    def object_path(self, digest, codec):
+        return os.path.join(self.root, 'objects', digest[:2], digest + self.CODEC_SUFFIX[codec])
+
+    @staticmethod
+    def file_digest(file_path):
+        sha = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def _write_object(self, file_path, object_path):
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        tmp_path = object_path + '.tmp'
+        with open(file_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            if self.codec == 'zstd':
+                zstandard.ZstdCompressor(level=10).copy_stream(src, dst)
+            else:
+                with gzip.GzipFile(fileobj=dst, mode='wb', compresslevel=6, mtime=0) as gz:
+                    shutil.copyfileobj(src, gz)
+        os.replace(tmp_path, object_path)
+
+    def store(self, file_path, search_query='', fetched_at=None):
+        """归档一个下载文件，返回索引记录（重复内容返回已有记录）"""
+        fetched_at = fetched_at or time.time()
+        digest = self.file_digest(file_path)
+        ext = os.path.splitext(file_path)[1].lower()
+        with self.lock:
+            last = self.entries[-1] if self.entries else None
+            if last and last['sha256'] == digest and last['search_query'] == search_query:
+                last['repeat_count'] += 1
+                last['last_seen'] = fetched_at
+                self.save()
+                logging.debug(f"步骤: Archive: download identical to previous, repeat_count={last['repeat_count']}")
+                return last
+
+            existing = next((entry for entry in self.entries if entry['sha256'] == digest), None)
+            if existing:
+                codec = existing['codec']
+            else:
+                codec = self.codec
+                object_path = self.object_path(digest, codec)
+                if not os.path.exists(object_path):
+                    self._write_object(file_path, object_path)
+
+            entry = {
+                'sha256': digest,
+                'codec': codec,
+                'ext': ext,
+                'original_name': os.path.basename(file_path),
+                'size': os.path.getsize(file_path),
+                'stored_size': os.path.getsize(self.object_path(digest, codec)),
+                'search_query': search_query,
+                'fetched_at': fetched_at,
+                'last_seen': fetched_at,
+                'repeat_count': 1,
+            }
+            self.entries.append(entry)
+            self.prune(now=fetched_at)
+            self.save()
+        logging.debug(f"步骤: Archived {entry['original_name']} as {digest[:12]} "
+                      f"({entry['size']} -> {entry['stored_size']} bytes, {codec})")
+        return entry
+
+    def prune(self, now=None):
+        """删除超过保留天数的记录，以及不再被任何记录引用的对象"""
+        if not self.retention_days:
+            return 0
+        cutoff = (now or time.time()) - self.retention_days * 86400
+        expired = [entry for entry in self.entries if entry['last_seen'] < cutoff]
+        if not expired:
+            return 0
+        self.entries = [entry for entry in self.entries if entry['last_seen'] >= cutoff]
+        referenced = {(entry['sha256'], entry['codec']) for entry in self.entries}
+        for entry in expired:
+            if (entry['sha256'], entry['codec']) not in referenced:
+                try:
+                    os.remove(self.object_path(entry['sha256'], entry['codec']))
+                except FileNotFoundError:
+                    pass
+        logging.debug(f"步骤: Archive pruned {len(expired)} expired entries.")
+        return len(expired)
+
+    def select(self, since=None, until=None, query=None):
+        """按时间范围和查询内容筛选记录，按时间升序"""
+        with self.lock:
+            entries = list(self.entries)
+        return [
+            entry for entry in entries
+            if (since is None or entry['fetched_at'] >= since)
+            and (until is None or entry['fetched_at'] <= until)
+            and (query is None or query in entry['search_query'])
+        ]
+
+    def extract(self, entry, dest_dir):
+        """解压一条记录到 dest_dir，保留原扩展名以便按格式解析，返回文件路径"""
+        os.makedirs(dest_dir, exist_ok=True)
+        dest_path = os.path.join(dest_dir, f"{int(entry['fetched_at'] * 1000)}_{entry['sha256'][:12]}{entry['ext']}")
+        with open(self.object_path(entry['sha256'], entry['codec']), 'rb') as src, open(dest_path, 'wb') as dst:
+            if entry['codec'] == 'zstd':
+                if zstandard is None:
+                    raise RuntimeError("zstandard is required to read zstd archive objects")
+                zstandard.ZstdDecompressor().copy_stream(src, dst)
+            else:
+                with gzip.GzipFile(fileobj=src, mode='rb') as gz:
+                    shutil.copyfileobj(gz, dst)
+        return dest_path
+
+    def summary(self):
+        with self.lock:
+            entries = list(self.entries)
+        objects = {(entry['sha256'], entry['codec']): entry['stored_size'] for entry in entries}
+        return {
+            'entries': len(entries),
+            'downloads': sum(entry['repeat_count'] for entry in entries),
+            'objects': len(objects),
+            'raw_bytes': sum(entry['size'] * entry['repeat_count'] for entry in entries),
+            'stored_bytes': sum(objects.values()),
+            'codec': self.codec,
+        }
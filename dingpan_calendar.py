@@ -0,0 +1,229 @@
+# dingpan_calendar.py
+# A股交易日历和交易时段感知的监控调度，不依赖 Streamlit 和浏览器
+import hashlib
+import json
+import logging
+import os
+import re
+from datetime import datetime, timedelta, time as dtime
+
+import numpy as np
+
+# A股连续竞价时段
+SESSIONS = ((dtime(9, 30), dtime(11, 30)), (dtime(13, 0), dtime(15, 0)))
+
+# 默认休市日（只需列出落在工作日的日期），可在侧边栏修改并保存
+DEFAULT_HOLIDAYS = [
+    '2025-01-01', '2025-01-28', '2025-01-29', '2025-01-30', '2025-01-31', '2025-02-03', '2025-02-04',
+    '2025-04-04', '2025-05-01', '2025-05-02', '2025-05-05', '2025-06-02',
+    '2025-10-01', '2025-10-02', '2025-10-03', '2025-10-06', '2025-10-07', '2025-10-08',
+    '2026-01-01', '2026-01-02', '2026-02-16', '2026-02-17', '2026-02-18', '2026-02-19', '2026-02-20',
+    '2026-02-23', '2026-04-06', '2026-05-01', '2026-05-04', '2026-05-05', '2026-06-19', '2026-09-25',
+    '2026-10-01', '2026-10-02', '2026-10-05', '2026-10-06', '2026-10-07',
+]
+
+
+# ====================== 交易日历 ======================
+class TradingCalendar:
+    """工作日减去节假日即为交易日，每个交易日内按 SESSIONS 划分连续竞价时段"""
+
+    def __init__(self, holidays=None, sessions=SESSIONS):
+        self.sessions = sessions
+        self.set_holidays(DEFAULT_HOLIDAYS if holidays is None else holidays)
+
+    def set_holidays(self, holidays):
+        self.holidays = sorted({str(np.datetime64(day, 'D')) for day in holidays})
+        self.busday = np.busdaycalendar(holidays=np.array(self.holidays, dtype='datetime64[D]'))
+
+    def is_trading_day(self, day):
+        return bool(np.is_busday(np.datetime64(day, 'D'), busdaycal=self.busday))
+
+    def trading_days(self, start, end):
+        """[start, end] 之间的全部交易日（datetime64[D] 数组）"""
+        days = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + 1)
+        return days[np.is_busday(days, busdaycal=self.busday)]
+
+    def next_trading_day(self, day, offset=1):
+        """day 之后（offset 为负时是之前）第 |offset| 个交易日"""
+        return np.busday_offset(np.datetime64(day, 'D'), offset, roll='forward' if offset < 0 else 'backward',
+                                busdaycal=self.busday)
+
+    def current_session(self, now):
+        """now 所在的交易时段 (开始, 结束)，不在时段内时返回 None"""
+        if not self.is_trading_day(now.date()):
+            return None
+        for start, end in self.sessions:
+            if start <= now.time() < end:
+                return datetime.combine(now.date(), start), datetime.combine(now.date(), end)
+        return None
+
+    def next_session_start(self, now):
+        """now 之后最近的一个时段开始时间（now 在时段内时返回下一个时段）"""
+        day = now.date()
+        if self.is_trading_day(day):
+            for start, _ in self.sessions:
+                if now.time() < start:
+                    return datetime.combine(day, start)
+        next_day = self.next_trading_day(day).astype(datetime)
+        return datetime.combine(next_day, self.sessions[0][0])
+
+
+# ====================== 调度 ======================
+class MonitorScheduler:
+    """按交易时段调度监控周期: 休市时不执行，开盘/收盘附近可以加快轮询；下次执行时间从本次调度时刻起算，周期超时不会补跑"""
+
+    def __init__(self, trading_calendar, interval_minutes=5, sessions_only=True,
+                 fast_interval_minutes=None, fast_window_minutes=10):
+        self.calendar = trading_calendar
+        self.interval_minutes = interval_minutes
+        self.sessions_only = sessions_only
+        self.fast_interval_minutes = fast_interval_minutes
+        self.fast_window_minutes = fast_window_minutes
+        self.skipped = {'closed': 0, 'busy': 0}
+
+    def should_run(self, now):
+        return not self.sessions_only or self.calendar.current_session(now) is not None
+
+    def interval_at(self, now):
+        """now 时刻使用的轮询间隔（分钟）"""
+        if self.fast_interval_minutes:
+            session = self.calendar.current_session(now)
+            window = timedelta(minutes=self.fast_window_minutes)
+            if session and (now - session[0] < window or session[1] - now <= window):
+                return min(self.fast_interval_minutes, self.interval_minutes)
+        return self.interval_minutes
+
+    def next_run(self, now):
+        """下一次执行时间；落在休市时段时顺延到下一个时段开盘"""
+        candidate = now + timedelta(minutes=self.interval_at(now))
+        if self.sessions_only and self.calendar.current_session(candidate) is None:
+            candidate = self.calendar.next_session_start(candidate)
+        return candidate
+
+    def record_skip(self, reason):
+        self.skipped[reason] += 1
+        logging.debug(f"步骤: Scheduled cycle skipped ({reason}), total skipped: {self.skipped}")
+
+
+# ====================== 交易日序列与查询模板 ======================
+class TradingDayIndex:
+    """预先计算的交易日序列（datetime64[D] 升序数组），按节假日列表的指纹缓存到磁盘，查询用二分查找"""
+
+    def __init__(self, trading_calendar, cache_dir, start='2015-01-01', years_ahead=2):
+        self.calendar = trading_calendar
+        self.cache_dir = cache_dir
+        self.start = np.datetime64(start, 'D')
+        self.years_ahead = years_ahead
+        self.fingerprint = None
+        self.days = np.empty(0, dtype='datetime64[D]')
+        self.load_or_build()
+
+    def load_or_build(self, as_of=None):
+        as_of = np.datetime64(as_of or datetime.now().date(), 'D')
+        end = np.datetime64(str(as_of.astype(object).year + self.years_ahead) + '-12-31', 'D')
+        key = f"{self.start}|{end}|{','.join(self.calendar.holidays)}"
+        self.fingerprint = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        path = os.path.join(self.cache_dir, f"trading_days_{self.fingerprint}.npy")
+        try:
+            self.days = np.load(path)
+            logging.debug(f"步骤: Loaded {len(self.days)} trading days from {path}")
+            return
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.error(f"Error loading trading day cache: {str(e)}")
+        self.days = self.calendar.trading_days(self.start, end)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = path + '.tmp.npy'
+            np.save(tmp_path, self.days)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logging.error(f"Error saving trading day cache: {str(e)}")
+        logging.debug(f"步骤: Built {len(self.days)} trading days, cached to {path}")
+
+    def last_n(self, as_of, n):
+        """截至 as_of（含当天）的最近 n 个交易日，升序"""
+        as_of = np.datetime64(as_of, 'D')
+        if len(self.days) == 0 or as_of > self.days[-1]:
+            self.load_or_build(as_of.astype(object))
+        end = np.searchsorted(self.days, as_of, side='right')
+        return self.days[max(end - n, 0):end]
+
+    def latest(self, as_of):
+        days = self.last_n(as_of, 1)
+        return days[0] if len(days) else None
+
+
+def format_query_date(day):
+    day = day.astype(object)
+    return f"{day.year}年{day.month}月{day.day}日"
+
+
+class QueryTemplateExpander:
+    """展开查询模板中的滚动日期占位符，结果按 (模板, 最近交易日, 日历指纹) 缓存，每个交易日只展开一次
+
+    - {最近N个交易日:片段}: 对最近 N 个交易日各生成一次片段（片段中的 {日期} 替换为当天），用 "，" 连接
+    - {T} / {T-k}: 最近交易日 / 往前第 k 个交易日
+    """
+    ROLLING_PATTERN = re.compile(r'\{最近(\d+)个交易日:((?:[^{}]|\{[^{}]*\})*)\}')
+    DAY_PATTERN = re.compile(r'\{T(?:-(\d+))?\}')
+
+    def __init__(self, day_index, max_entries=64):
+        self.day_index = day_index
+        self.max_entries = max_entries
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def is_template(cls, query):
+        return bool(cls.ROLLING_PATTERN.search(query) or cls.DAY_PATTERN.search(query))
+
+    def expand(self, template, now=None):
+        if not self.is_template(template):
+            return template
+        now = now or datetime.now()
+        latest = self.day_index.latest(now.date())
+        key = (template, latest, self.day_index.fingerprint)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        
+        self.misses += 1
+        
+        def rolling(match):
+            days = self.day_index.last_n(latest, int(match.group(1)))
+            return '，'.join(match.group(2).replace('{日期}', format_query_date(day)) for day in days)
+        
+        def single(match):
+            days = self.day_index.last_n(latest, int(match.group(1) or 0) + 1)
+            return format_query_date(days[0])
+        
+        expanded = self.DAY_PATTERN.sub(single, self.ROLLING_PATTERN.sub(rolling, template))
+        if len(self.cache) >= self.max_entries:
+            self.cache.clear()
+        self.cache[key] = expanded
+        logging.debug(f"步骤: Expanded query template for {latest}: {expanded}")
+        return expanded
+
+
+def load_holidays(path):
+    """读取节假日配置文件，不存在或损坏时使用默认列表"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)['holidays']
+    except FileNotFoundError:
+        return list(DEFAULT_HOLIDAYS)
+    except Exception as e:
+        logging.error(f"Error loading holidays: {str(e)}")
+        return list(DEFAULT_HOLIDAYS)
+
+
+def save_holidays(path, holidays):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'holidays': list(holidays)}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
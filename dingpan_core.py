@@ -0,0 +1,1264 @@
+# dingpan_core.py
+# 问财导出数据的解析与计算，不依赖 Streamlit 和浏览器，可以在子进程中运行
+import os
+import re
+import sys
+import json
+import logging
+import mmap
+import multiprocessing
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+# ====================== 日期规范化 ======================
+DATE_FORMATS = ("%Y.%m.%d", "%Y-%m-%d", "%Y%m%d", "%Y/%m/%d")
+
+
+@lru_cache(maxsize=4096)
+def parse_date(date_str):
+    """按 DATE_FORMATS 解析一个日期字符串，返回 datetime64[D]，无法解析时为 NaT；每个不同的字符串只解析一次"""
+    date_str = str(date_str).split(' [')[0].strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return np.datetime64(datetime.strptime(date_str, fmt).date(), 'D')
+        except ValueError:
+            continue
+    return np.datetime64('NaT', 'D')
+
+
+def normalize_dates(date_strings):
+    """批量解析日期字符串，返回 datetime64[D] 数组（先去重，再按缓存逐个解析）"""
+    date_strings = np.asarray(date_strings, dtype=object).astype(str)
+    if len(date_strings) == 0:
+        return np.empty(0, dtype='datetime64[D]')
+    unique, inverse = np.unique(date_strings, return_inverse=True)
+    parsed = np.array([parse_date(date_str) for date_str in unique], dtype='datetime64[D]')
+    return parsed[inverse.reshape(-1)]
+
+
+def format_dates(axis, fallback=None):
+    """datetime64 日期轴转回 "%Y-%m-%d" 字符串，NaT 位置使用 fallback 中的原始字符串"""
+    labels = np.datetime_as_string(axis, unit='D').astype(object)
+    if fallback is not None:
+        invalid = np.isnat(axis)
+        labels[invalid] = np.asarray(fallback, dtype=object)[invalid]
+    return labels
+
+
+def trading_day_mask(axis, holidays=()):
+    """日期轴上的交易日掩码: 工作日且不在节假日列表中，NaT 为 False"""
+    mask = np.zeros(len(axis), dtype=bool)
+    valid = ~np.isnat(axis)
+    if valid.any():
+        mask[valid] = np.is_busday(axis[valid], holidays=np.asarray(holidays, dtype='datetime64[D]'))
+    return mask
+
+
+def date_sort_order(axis):
+    """日期轴升序排列的下标，无法解析的日期排在最前（与旧的按 1900-01-01 排序一致）"""
+    keys = np.where(np.isnat(axis), np.datetime64('1900-01-01', 'D'), axis)
+    return np.argsort(keys, kind='stable')
+
+
+# ====================== 导出文件解析 ======================
+class IwencaiExportParser:
+    """问财导出文件（Excel/CSV/页面表格）的解析、清洗和斜率计算，无状态"""
+
+    def read_export_file(self, file_path):
+        """按扩展名读取问财导出文件"""
+        logging.debug(f"步骤: Processing file: {os.path.basename(file_path)}")
+        if file_path.endswith('.csv'):
+            return self.read_iwencai_csv_improved(file_path)
+        elif file_path.endswith(('.xls', '.xlsx')):
+            return self.read_iwencai_excel_improved(file_path)
+        return self.auto_detect_iwencai_file_improved(file_path)
+
+    def read_iwencai_excel_improved(self, file_path):
+        """专门优化双表头处理的Excel读取方法 - 参考上传文件处理代码"""
+        try:
+            # 先读取前几行来检测表头结构
+            df_raw = pd.read_excel(file_path, header=None, nrows=10)
+            logging.debug("步骤: Raw Excel data preview:")
+            for i in range(min(10, len(df_raw))):
+                logging.debug(f"Row {i}: {df_raw.iloc[i].tolist()}")
+            
+            # 检测表头行数
+            header_rows = self.detect_header_rows_improved(df_raw)
+            logging.debug(f"步骤: Detected header rows: {header_rows}")
+            
+            if header_rows == 1:
+                # 单表头情况
+                df = pd.read_excel(file_path, header=0)
+                df.columns = [str(c).strip() for c in df.columns]
+            else:
+                # 多行表头情况 - 使用上传文件处理代码的方法
+                df = self.process_double_header_excel_improved(file_path, header_rows)
+            
+            df = self.basic_data_cleaning(df)
+            
+            logging.debug(f"步骤: Final columns after processing: {list(df.columns)}")
+            return df
+            
+        except Exception as e:
+            logging.error(f"Error reading improved Excel: {str(e)}")
+            return pd.read_excel(file_path)
+
+    def detect_header_rows_improved(self, df_preview):
+        """改进的表头行数检测 - 参考上传文件处理代码"""
+        header_keywords = ['代码', '名称', '收盘价', '开盘价', '5日均线', '均线', '财务诊断评分', 'undefined']
+        
+        for i in range(min(5, len(df_preview))):
+            row_text = ' '.join([str(x) for x in df_preview.iloc[i] if pd.notna(x)])
+            if any(keyword in row_text for keyword in header_keywords):
+                if i == 0:
+                    # 检查下一行是否包含日期或技术指标
+                    if len(df_preview) > 1:
+                        next_row_text = ' '.join([str(x) for x in df_preview.iloc[1] if pd.notna(x)])
+                        if self.contains_date_or_technical_improved(next_row_text):
+                            return 2
+                    return 1
+                else:
+                    return i + 1
+        
+        return 1
+
+    def contains_date_or_technical_improved(self, text):
+        """检查文本是否包含日期或技术指标信息 - 改进版本"""
+        date_indicators = ['收盘价', '开盘价', '均线', 'MA', 'undefined', '前', '后']
+        text_str = str(text).lower()
+        if re.search(r'(19|20)\d{2}[.\-/]?\d{2}', text_str):
+            return True
+        return any(indicator in text_str for indicator in date_indicators)
+
+    def process_double_header_excel_improved(self, file_path, header_rows):
+        """处理双表头 - 参考上传文件处理代码的方法"""
+        try:
+            # 读取原始数据
+            df_raw = pd.read_excel(file_path, header=None)
+            
+            # 处理表头行，向前填充空值
+            header_df = df_raw.iloc[:header_rows].ffill(axis=1)
+            df = df_raw.iloc[header_rows:].reset_index(drop=True)
+            
+            df.columns = self.merge_header_columns(header_df)
+            return df
+            
+        except Exception as e:
+            logging.error(f"Error processing double header improved: {str(e)}")
+            return pd.read_excel(file_path, header=1)
+
+    def merge_header_columns(self, header_df):
+        """把已向前填充的多行表头合并为列名 - 参考上传文件处理代码"""
+        columns = []
+        current_prefix = ""
+        
+        for col in header_df.values.T:
+            col_strs = [str(x).strip() for x in col if str(x) != "nan"]
+            if len(col_strs) == 0:
+                columns.append("")
+                continue
+                
+            # 识别列类型前缀
+            if "收盘价" in col_strs[0]:
+                current_prefix = "收盘价"
+            elif "5日均线" in col_strs[0] or "均线" in col_strs[0]:
+                current_prefix = "5日均线"
+            elif "开盘价" in col_strs[0]:
+                current_prefix = "开盘价"
+            elif "财务诊断评分" in col_strs[0]:
+                current_prefix = "财务诊断评分"
+            
+            # 提取日期部分
+            date_part = col_strs[-1] if len(col_strs) > 1 else col_strs[0]
+            
+            # 构建列名
+            if current_prefix and "undefined" in col_strs[0]:
+                merged = f"{current_prefix}_{date_part}"
+            else:
+                merged = "_".join(col_strs).strip("_")
+            
+            columns.append(merged)
+        
+        return columns
+
+    def basic_data_cleaning(self, df):
+        """基础数据清洗"""
+        if df is None or df.empty:
+            return df
+        
+        df_clean = df.copy()
+        
+        for col in df_clean.select_dtypes(include=['object']).columns:
+            try:
+                df_clean[col] = df_clean[col].astype(str).str.strip().replace({
+                    'nan': np.nan, 'None': np.nan, '': np.nan
+                })
+            except Exception:
+                pass
+        
+        replace_symbols = ["-", "—", "空值", "null", "None", "", "NaN", "--"]
+        df_clean.replace(replace_symbols, np.nan, inplace=True)
+        
+        for col in df_clean.columns:
+            if pd.api.types.is_object_dtype(df_clean[col]) or pd.api.types.is_string_dtype(df_clean[col]):
+                try:
+                    df_clean[col] = df_clean[col].astype(str).str.replace(',', '').str.replace(' ', '')
+                except Exception:
+                    pass
+                try:
+                    # errors='ignore' 在新版 pandas 中已移除，转换失败时保持原列
+                    df_clean[col] = pd.to_numeric(df_clean[col])
+                except Exception:
+                    pass
+        
+        df_clean = df_clean.dropna(how='all')
+        df_clean = df_clean.dropna(axis=1, how='all')
+        
+        df_clean = self.identify_stock_columns(df_clean)
+        
+        return df_clean
+
+    def find_closing_price_columns(self, df):
+        """查找收盘价列 - 改进版本，区分收盘价、开盘价和5日均线"""
+        close_cols = []
+        date_info = []
+        
+        for col in df.columns:
+            col_str = str(col)
+            
+            # 只识别明确标记为收盘价的列
+            is_closing_col = False
+            if col_str.startswith('收盘价_'):
+                is_closing_col = True
+            elif '收盘价' in col_str and '开盘价' not in col_str and '5日均线' not in col_str:
+                is_closing_col = True
+            
+            if is_closing_col and self.is_valid_price_column(df[col]):
+                # 从列名中提取日期，无法提取时使用列名本身
+                parts = col_str.split('_')
+                close_cols.append(col)
+                date_info.append(parts[-1].split(' [')[0].strip() if len(parts) > 1 else col_str)
+        
+        logging.debug(f"步骤: Closing price columns found: {close_cols}")
+        logging.debug(f"步骤: Corresponding dates: {date_info}")
+        
+        if close_cols and date_info:
+            close_cols, date_info = self.sort_columns_by_date(close_cols, date_info)
+            logging.debug(f"步骤: Sorted closing price columns: {close_cols}")
+            logging.debug(f"步骤: Sorted dates: {date_info}")
+        
+        return close_cols, date_info
+
+    def is_valid_price_column(self, series):
+        """检查列是否是有效的价格数据"""
+        if series.empty:
+            return False
+        
+        if not pd.api.types.is_numeric_dtype(series):
+            try:
+                series_numeric = pd.to_numeric(series, errors='coerce')
+                if series_numeric.isna().all():
+                    return False
+            except:
+                return False
+        
+        numeric_series = pd.to_numeric(series, errors='coerce')
+        valid_values = numeric_series.dropna()
+        if len(valid_values) == 0:
+            return False
+        
+        avg_value = valid_values.mean()
+        return 0.1 <= avg_value <= 10000
+
+    def sort_columns_by_date(self, columns, dates):
+        """按日期对列进行排序，返回排序后的列和规范化的 "%Y-%m-%d" 日期（无法解析的保留原始字符串）"""
+        axis = normalize_dates(dates)
+        order = date_sort_order(axis)
+        labels = format_dates(axis, fallback=dates)
+        return [columns[i] for i in order], labels[order].tolist()
+
+    def stock_keys(self, df):
+        """向量化提取股票代码、名称和 "代码 名称" 键，缺失值的占位规则与 get_stock_code/get_stock_name 一致"""
+        index_str = pd.Series(df.index, index=df.index).astype(str)
+        code_col = next((col for col in df.columns
+                         if any(keyword in str(col).lower() for keyword in ['代码', 'code', 'symbol', '股票代码'])), None)
+        name_col = next((col for col in df.columns
+                         if any(keyword in str(col).lower() for keyword in ['名称', 'name', '股票名称', '股票简称'])), None)
+        if code_col is not None:
+            codes = df[code_col].astype(str).where(df[code_col].notna(), '代码' + index_str)
+        else:
+            codes = '代码' + index_str
+        if name_col is not None:
+            names = df[name_col].astype(str).where(df[name_col].notna(), '股票' + index_str)
+        else:
+            names = '股票' + index_str
+        keys = (codes + ' ' + names).str.strip()
+        return codes.to_numpy(dtype=object), names.to_numpy(dtype=object), keys.to_numpy(dtype=object)
+
+    def build_price_snapshot(self, df, window=7):
+        """向量化构建价格快照并计算最近 window 天收盘价斜率"""
+        codes, names, keys = self.stock_keys(df)
+        close_cols, date_info = self.find_closing_price_columns(df)
+        logging.debug(f"步骤: Found {len(close_cols)} closing price columns: {close_cols}")
+        logging.debug(f"步骤: Date info: {date_info}")
+        
+        if len(close_cols) < 2:
+            logging.warning(f"步骤: Not enough closing price columns found. Need at least 2, found {len(close_cols)}")
+            return PriceSnapshot(keys, codes, names, [], np.empty((len(df), 0)))
+        
+        # 只取最近的7天数据
+        if len(close_cols) > window:
+            close_cols = close_cols[-window:]
+            date_info = date_info[-window:]
+            logging.debug(f"步骤: Using last {window} days data: {close_cols}")
+        
+        values = self.metric_matrix(df, close_cols)
+        return PriceSnapshot(keys, codes, names, date_info, values)
+
+    def metric_matrix(self, df, columns):
+        """把若干价格列转成 float64 股票×日期矩阵，无法解析的值为 NaN"""
+        values = np.full((len(df), len(columns)), np.nan, dtype=np.float64)
+        for i, col in enumerate(columns):
+            if col is None:
+                continue
+            series = df[col]
+            if not pd.api.types.is_numeric_dtype(series):
+                series = (series.astype(str).str.replace(',', '').str.replace('—', '')
+                          .str.replace('--', '').str.strip())
+            values[:, i] = pd.to_numeric(series, errors='coerce').to_numpy(dtype=np.float64)
+        return values
+
+    def find_metric_columns(self, df, prefix):
+        """查找以指标名开头的 "指标_日期" 列，返回 {日期: 列名}"""
+        columns = {}
+        for col in df.columns:
+            col_str = str(col)
+            if not col_str.startswith(prefix) or '_' not in col_str:
+                continue
+            date_str = col_str.split('_')[-1].split(' [')[0].strip()
+            axis = normalize_dates([date_str])
+            columns[format_dates(axis, fallback=[date_str])[0]] = col
+        return columns
+
+    def build_feature_table(self, df, prices):
+        """按收盘价的日期轴对齐开盘价和5日均线，批量计算全部技术指标"""
+        close_cols, date_info = self.find_closing_price_columns(df)
+        open_cols = self.find_metric_columns(df, '开盘价')
+        ma5_cols = self.find_metric_columns(df, '5日均线')
+        score_cols = self.find_metric_columns(df, '财务诊断评分')
+        
+        close = self.metric_matrix(df, close_cols)
+        open_ = self.metric_matrix(df, [open_cols.get(date) for date in date_info])
+        ma5 = self.metric_matrix(df, [ma5_cols.get(date) for date in date_info])
+        score = None
+        if score_cols:
+            score = self.metric_matrix(df, [score_cols[max(score_cols)]])[:, 0]
+        
+        return compute_feature_table(prices.codes, prices.names, close, open_, ma5, score)
+
+    def read_iwencai_csv_improved(self, file_path):
+        """改进的CSV读取方法"""
+        try:
+            encodings = ['gbk', 'utf-8', 'gb2312', 'utf-8-sig']
+            
+            for encoding in encodings:
+                try:
+                    df_raw = pd.read_csv(file_path, encoding=encoding, header=None, nrows=10)
+                    
+                    header_rows = self.detect_header_rows_improved(df_raw)
+                    
+                    if header_rows == 1:
+                        df = pd.read_csv(file_path, encoding=encoding, header=0)
+                    else:
+                        df = self.process_double_header_csv_improved(file_path, encoding, header_rows)
+                    
+                    df = self.basic_data_cleaning(df)
+                    return df
+                    
+                except UnicodeDecodeError:
+                    continue
+                except Exception as e:
+                    logging.debug(f"Failed to read CSV with encoding {encoding}: {str(e)}")
+                    continue
+            
+            return pd.read_csv(file_path)
+            
+        except Exception as e:
+            logging.error(f"Error reading improved CSV: {str(e)}")
+            return None
+
+    def process_double_header_csv_improved(self, file_path, encoding, header_rows):
+        """处理CSV的双表头 - 改进版本"""
+        try:
+            df_raw = pd.read_csv(file_path, encoding=encoding, header=None)
+            header_df = df_raw.iloc[:header_rows].ffill(axis=1)
+            df = df_raw.iloc[header_rows:].reset_index(drop=True)
+            
+            df.columns = self.merge_header_columns(header_df)
+            return df
+            
+        except Exception as e:
+            logging.error(f"Error processing double header CSV improved: {str(e)}")
+            return pd.read_csv(file_path, encoding=encoding, header=1)
+
+    def auto_detect_iwencai_file_improved(self, file_path):
+        """改进的自动文件检测"""
+        try:
+            df = self.read_iwencai_excel_improved(file_path)
+            if df is not None and not df.empty:
+                return df
+            
+            df = self.read_iwencai_csv_improved(file_path)
+            if df is not None and not df.empty:
+                return df
+                
+            return None
+        except Exception as e:
+            logging.error(f"Auto detect improved failed: {str(e)}")
+            return None
+
+    def identify_stock_columns(self, df):
+        """识别股票代码和名称列"""
+        df_clean = df.copy()
+        
+        code_patterns = ['代码', 'code', 'symbol']
+        for col in df_clean.columns:
+            col_lower = str(col).lower()
+            if any(pattern in col_lower for pattern in code_patterns):
+                df_clean = df_clean.rename(columns={col: '股票代码'})
+                break
+        
+        name_patterns = ['名称', 'name', '股票名称', '股票简称']
+        for col in df_clean.columns:
+            col_lower = str(col).lower()
+            if any(pattern in col_lower for pattern in name_patterns):
+                df_clean = df_clean.rename(columns={col: '股票名称'})
+                break
+        
+        return df_clean
+
+    def get_stock_code(self, row, columns):
+        code_keywords = ['代码', 'code', 'symbol', '股票代码']
+        for col in columns:
+            if any(keyword in str(col).lower() for keyword in code_keywords):
+                return str(row[col]) if pd.notna(row[col]) else f"代码{row.name}"
+        return f"代码{row.name}"
+
+    def get_stock_name(self, row, columns):
+        name_keywords = ['名称', 'name', '股票名称', '股票简称']
+        for col in columns:
+            if any(keyword in str(col).lower() for keyword in name_keywords):
+                return str(row[col]) if pd.notna(row[col]) else f"股票{row.name}"
+        return f"股票{row.name}"
+
+    def dom_table_to_dataframe(self, payload):
+        """把页面表格 JSON 转成与双表头 Excel 处理结果相同的列布局"""
+        header = [[np.nan if cell in (None, '') else cell for cell in row] for row in payload['header']]
+        header_df = pd.DataFrame(header)
+        df = pd.DataFrame(payload['rows']).reindex(columns=range(len(header_df.columns)))
+        
+        if len(header) == 1:
+            df.columns = [str(c).strip() for c in header[0]]
+        else:
+            df.columns = self.merge_header_columns(header_df.ffill(axis=1))
+        
+        # 页面单元格都是文本，数值类型由清洗步骤统一转换，和读取导出文件时相同
+        return self.basic_data_cleaning(df)
+
+    def merge_shard_frames(self, frames, key_column='股票代码'):
+        """合并分片查询的结果表格: 列取并集（保持第一个分片的列顺序），按股票代码去重保留第一次出现的行"""
+        frames = [df for df in frames if df is not None and not df.empty]
+        if not frames:
+            return None
+        merged = pd.concat(frames, ignore_index=True, sort=False)
+        if key_column in merged.columns:
+            before = len(merged)
+            merged = merged.drop_duplicates(subset=key_column, keep='first').reset_index(drop=True)
+            logging.debug(f"步骤: Merged {len(frames)} shards: {before} rows, {len(merged)} unique stocks")
+        return merged
+
+    def summarize_dataframe(self, df):
+        """快照的统计信息在解析时计算一次: 股票数、列数、数值列 describe 和每列缺失率"""
+        numeric = df.select_dtypes(include=[np.number])
+        null_rates = df.isna().mean()
+        return {
+            'stock_count': len(df),
+            'column_count': len(df.columns),
+            'numeric_column_count': len(numeric.columns),
+            'describe': numeric.describe() if len(numeric.columns) else pd.DataFrame(),
+            'null_rates': {str(col): float(rate) for col, rate in null_rates.items()},
+            'overall_null_rate': float(null_rates.mean()) if len(null_rates) else 0.0,
+        }
+
+    def build_snapshot(self, df):
+        """从解析好的表格构建价格快照，生成一次快照（新增股票在发布时计算）"""
+        try:
+            stock_count = len(df)
+            prices = self.build_price_snapshot(df)
+            features = self.build_feature_table(df, prices)
+            stats = self.summarize_dataframe(df)
+            
+            logging.debug(f"步骤: Successfully processed {stock_count} stocks")
+            
+            return {
+                'timestamp': datetime.now(),
+                'stock_count': stock_count,
+                'stock_list': df,
+                'prices': prices,
+                'features': features,
+                'stats': stats
+            }
+        except Exception as e:
+            logging.error(f"Error processing data: {str(e)}")
+            return None
+
+
+# ====================== 价格快照 ======================
+class PriceSnapshot:
+    """一次快照的紧凑表示: 驻留的股票键数组、共享的日期轴、float32 股票×日期收盘价矩阵和有效值掩码"""
+    __slots__ = ('keys', 'codes', 'names', 'dates', 'date_axis', 'prices', 'mask', 'slopes', 'key_index')
+
+    def __init__(self, keys, codes, names, dates, values, slopes=None):
+        # 股票键和名称在各次快照之间驻留，相同的字符串只保存一份
+        self.keys = np.array([sys.intern(str(key)) for key in keys], dtype=object)
+        self.codes = np.array([sys.intern(str(code)) for code in codes], dtype=object)
+        self.names = np.array([sys.intern(str(name)) for name in names], dtype=object)
+        self.dates = np.array([sys.intern(str(date)) for date in dates], dtype=object)
+        # 已按日期升序排列的 datetime64 日期轴，供图表和交易日过滤直接使用
+        self.date_axis = normalize_dates(self.dates)
+        values = np.asarray(values, dtype=np.float64).reshape(len(self.keys), len(self.dates))
+        self.mask = np.isfinite(values) & (values > 0)
+        self.prices = np.where(self.mask, values, 0).astype(np.float32)
+        # 斜率用 float64 原值计算，结果与逐只股票 linregress 一致
+        self.slopes = slopes if slopes is not None else self.compute_slopes(values, self.mask)
+        self.key_index = None
+
+    @staticmethod
+    def compute_slopes(values, mask):
+        """按行对有效收盘价做线性回归（x 为有效值的序号），返回斜率占均价的百分比，有效值不足 2 个时为 0"""
+        return regression_stats(values, mask)[0]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def index_of(self, key):
+        if self.key_index is None:
+            self.key_index = {k: i for i, k in enumerate(self.keys)}
+        return self.key_index.get(key)
+
+    def series(self, key, trading_only=False, last_n=None, holidays=()):
+        """单只股票的有效日期和收盘价；trading_only 时去掉非交易日，last_n 只保留最近 n 个"""
+        row = self.index_of(key)
+        if row is None:
+            return [], []
+        valid = self.mask[row]
+        if trading_only:
+            valid = valid & trading_day_mask(self.date_axis, holidays)
+        cols = np.nonzero(valid)[0]
+        if last_n is not None:
+            cols = cols[-last_n:]
+        return self.dates[cols].tolist(), self.prices[row, cols].astype(np.float64).round(4).tolist()
+
+    def nbytes(self):
+        """数组占用的字节数（驻留字符串在快照之间共享，不计入）"""
+        return sum(getattr(self, name).nbytes
+                   for name in ('keys', 'codes', 'names', 'dates', 'date_axis', 'prices', 'mask', 'slopes'))
+
+    def to_arrays(self):
+        """转成只含定长数组的字典，用于跨进程传输和落盘"""
+        return {
+            'keys': np.asarray(self.keys, dtype=str),
+            'codes': np.asarray(self.codes, dtype=str),
+            'names': np.asarray(self.names, dtype=str),
+            'dates': np.asarray(self.dates, dtype=str),
+            'prices': self.prices,
+            'mask': self.mask,
+            'slopes': self.slopes,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        values = np.where(arrays['mask'], arrays['prices'].astype(np.float64), np.nan)
+        return cls(arrays['keys'].tolist(), arrays['codes'].tolist(), arrays['names'].tolist(),
+                   arrays['dates'].tolist(), values, slopes=np.asarray(arrays['slopes']))
+
+
+# ====================== 技术指标 ======================
+FEATURE_WINDOWS = (3, 5, 7)
+
+
+def regression_stats(values, mask):
+    """按行对有效值做线性回归（x 为有效值的序号），返回 (斜率占均价的百分比, R²)，有效值不足 2 个时均为 0"""
+    n = mask.sum(axis=1)
+    if values.shape[1] == 0:
+        return np.zeros(len(values)), np.zeros(len(values))
+    y = np.where(mask, values, 0.0)
+    x = np.where(mask, np.cumsum(mask, axis=1) - 1, 0).astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_x = (n - 1) / 2.0
+        mean_y = y.sum(axis=1) / n
+        dx = np.where(mask, x - mean_x[:, None], 0.0)
+        dy = np.where(mask, y - mean_y[:, None], 0.0)
+        sxy = (dx * dy).sum(axis=1)
+        sxx = (dx * dx).sum(axis=1)
+        syy = (dy * dy).sum(axis=1)
+        slope = sxy / sxx
+        slope_pct = slope / mean_y * 100
+        r2 = sxy * sxy / (sxx * syy)
+    enough = n >= 2
+    return (np.where(enough & np.isfinite(slope_pct), slope_pct, 0.0),
+            np.where(enough & np.isfinite(r2), r2, 0.0))
+
+
+def compute_feature_table(codes, names, close, open_, ma5, score=None, windows=FEATURE_WINDOWS):
+    """对齐的收盘价/开盘价/5日均线矩阵（按日期升序）上逐列向量化计算技术指标，每只股票一行"""
+    close_ok = np.isfinite(close) & (close > 0)
+    open_ok = np.isfinite(open_) & (open_ > 0)
+    ma5_ok = np.isfinite(ma5) & (ma5 > 0)
+    features = {'股票代码': codes, '股票简称': names}
+    
+    if close.shape[1] == 0:
+        features['最新收盘价'] = np.full(len(codes), np.nan)
+        for window in windows:
+            features[f'{window}日斜率(%)'] = np.zeros(len(codes))
+            features[f'{window}日R²'] = np.zeros(len(codes))
+        for column in ('收盘价较5日均线(%)', '开盘至收盘(%)', '波动率(%)'):
+            features[column] = np.full(len(codes), np.nan)
+        features['连续站上5日均线天数'] = np.zeros(len(codes), dtype=np.int64)
+    else:
+        features['最新收盘价'] = np.where(close_ok[:, -1], close[:, -1], np.nan)
+        for window in windows:
+            slope, r2 = regression_stats(close[:, -window:], close_ok[:, -window:])
+            features[f'{window}日斜率(%)'] = slope
+            features[f'{window}日R²'] = r2
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            features['收盘价较5日均线(%)'] = np.where(
+                close_ok[:, -1] & ma5_ok[:, -1], (close[:, -1] / ma5[:, -1] - 1) * 100, np.nan)
+            features['开盘至收盘(%)'] = np.where(
+                close_ok[:, -1] & open_ok[:, -1], (close[:, -1] / open_[:, -1] - 1) * 100, np.nan)
+            
+            # 从最新交易日往前数，收盘价连续高于5日均线的天数
+            above = close_ok & ma5_ok & (close > ma5)
+            features['连续站上5日均线天数'] = np.cumprod(above[:, ::-1], axis=1).sum(axis=1)
+            
+            # 相邻两个有效收盘价的日收益率的样本标准差
+            pair_ok = close_ok[:, 1:] & close_ok[:, :-1]
+            returns = np.where(pair_ok, close[:, 1:] / np.where(close_ok[:, :-1], close[:, :-1], 1) - 1, 0.0)
+            n = pair_ok.sum(axis=1)
+            mean = returns.sum(axis=1) / n
+            var = (np.where(pair_ok, returns - mean[:, None], 0.0) ** 2).sum(axis=1) / (n - 1)
+            features['波动率(%)'] = np.where(n >= 2, np.sqrt(var) * 100, np.nan)
+    
+    if score is not None:
+        features['财务诊断评分'] = score
+    return pd.DataFrame(features)
+
+
+# ====================== 排名 ======================
+def top_k_indices(values, k):
+    """从高到低最大的 k 个值的下标: partition 找出第 k 大的值后只对前 k 个排序，NaN 排在最后"""
+    values = np.where(np.isnan(values), -np.inf, np.asarray(values, dtype=np.float64))
+    k = min(k, len(values))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(values):
+        # argpartition 在第 k 名的并列值中任选，这里先取严格更大的值，再按行号补齐并列的值
+        kth = -np.partition(-values, k - 1)[k - 1]
+        above = np.flatnonzero(values > kth)
+        candidates = np.concatenate([above, np.flatnonzero(values == kth)[:k - len(above)]])
+    else:
+        candidates = np.arange(len(values))
+    # 同值按原始行号排序，与稳定全排序的结果一致
+    return candidates[np.lexsort((candidates, -values[candidates]))]
+
+
+class RankHistory:
+    """跨快照的排名历史: 每次快照只记录前 depth 名，按股票代码累积成 股票×快照 的名次矩阵（0 表示未进入前 depth 名）"""
+
+    def __init__(self, depth=100, initial_stocks=256, initial_snapshots=64):
+        self.depth = depth
+        self.code_index = {}
+        self.codes = []
+        self.names = []
+        self.timestamps = []
+        self.ranks = np.zeros((initial_stocks, initial_snapshots), dtype=np.int16)
+        # 每次快照前 depth 名的指标值，按名次排列
+        self.top_values = []
+
+    def _ensure_capacity(self, n_stocks, n_snapshots):
+        rows, cols = self.ranks.shape
+        if n_stocks <= rows and n_snapshots <= cols:
+            return
+        new_rows, new_cols = max(rows, 1), max(cols, 1)
+        while new_rows < n_stocks:
+            new_rows *= 2
+        while new_cols < n_snapshots:
+            new_cols *= 2
+        ranks = np.zeros((new_rows, new_cols), dtype=np.int16)
+        ranks[:rows, :cols] = self.ranks
+        self.ranks = ranks
+
+    def append(self, codes, names, values, timestamp):
+        """追加一次快照的排名，只处理前 depth 名，历史快照不再重算"""
+        values = np.asarray(values, dtype=np.float64)
+        top = top_k_indices(values, self.depth)
+        rows = np.empty(len(top), dtype=np.int64)
+        for i, index in enumerate(top.tolist()):
+            code = codes[index]
+            row = self.code_index.get(code)
+            if row is None:
+                row = len(self.codes)
+                self.code_index[code] = row
+                self.codes.append(code)
+                self.names.append(names[index])
+            rows[i] = row
+        
+        col = len(self.timestamps)
+        self.top_values.append(values[top])
+        self.timestamps.append(timestamp)
+        self._ensure_capacity(len(self.codes), len(self.timestamps))
+        self.ranks[rows, col] = np.arange(1, len(top) + 1)
+        return col
+
+    def label(self, row):
+        return f"{self.codes[row]} {self.names[row]}".strip()
+
+    def trajectory(self, code):
+        """单只股票各次快照的名次，未进入前 depth 名为 None"""
+        row = self.code_index.get(code)
+        if row is None:
+            return [None] * len(self.timestamps)
+        return [int(rank) if rank else None for rank in self.ranks[row, :len(self.timestamps)]]
+
+    def current_top(self, n):
+        """最新一次快照的前 n 名所在行，按名次排序"""
+        if not self.timestamps:
+            return []
+        latest = self.ranks[:len(self.codes), len(self.timestamps) - 1]
+        rows = np.nonzero((latest > 0) & (latest <= n))[0]
+        return rows[np.argsort(latest[rows])].tolist()
+
+    def to_arrays(self):
+        n_stocks, n_snapshots = len(self.codes), len(self.timestamps)
+        return {
+            'depth': self.depth,
+            'codes': np.asarray(self.codes, dtype=str),
+            'names': np.asarray(self.names, dtype=str),
+            'timestamps': np.array([timestamp.timestamp() for timestamp in self.timestamps], dtype=np.float64),
+            'ranks': self.ranks[:n_stocks, :n_snapshots].copy(),
+            'top_values': np.array([np.pad(values, (0, self.depth - len(values)), constant_values=np.nan)
+                                    for values in self.top_values]).reshape(n_snapshots, self.depth),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        ranks = np.asarray(arrays['ranks'])
+        history = cls(depth=arrays['depth'], initial_stocks=max(ranks.shape[0], 1) * 2,
+                      initial_snapshots=max(ranks.shape[1], 1) * 2)
+        history.codes = [sys.intern(str(code)) for code in arrays['codes']]
+        history.names = [sys.intern(str(name)) for name in arrays['names']]
+        history.code_index = {code: row for row, code in enumerate(history.codes)}
+        history.timestamps = [datetime.fromtimestamp(ts) for ts in arrays['timestamps'].tolist()]
+        history.ranks[:ranks.shape[0], :ranks.shape[1]] = ranks
+        # 旧检查点没有记录指标值
+        top_values = arrays.get('top_values')
+        if top_values is None:
+            top_values = np.full((len(history.timestamps), history.depth), np.nan)
+        history.top_values = list(np.asarray(top_values, dtype=np.float64))
+        return history
+
+    def tail(self, n_snapshots):
+        """最近 n_snapshots 次快照的排名历史副本，只含其中进入过前 depth 名的股票；之后追加快照不影响副本"""
+        end = len(self.timestamps)
+        start = max(end - n_snapshots, 0)
+        ranks = self.ranks[:len(self.codes), start:end]
+        rows = np.flatnonzero(ranks.any(axis=1))
+        history = RankHistory(depth=self.depth, initial_stocks=max(len(rows), 1), initial_snapshots=max(end - start, 1))
+        history.codes = [self.codes[row] for row in rows]
+        history.names = [self.names[row] for row in rows]
+        history.code_index = {code: i for i, code in enumerate(history.codes)}
+        history.timestamps = self.timestamps[start:end]
+        history.ranks[:len(rows), :end - start] = ranks[rows]
+        # 已追加的指标值数组不再修改，副本直接引用
+        history.top_values = self.top_values[start:end]
+        return history
+
+    def climbers(self, top_n=20, lookback=1, at=None):
+        """第 at 次（默认最新一次）快照进入前 top_n、而 lookback 次快照之前不在前 top_n 的股票
+
+        返回 [(行, 当前名次, 之前名次或 None)]，按当前名次排序。
+        """
+        column = len(self.timestamps) - 1 if at is None else at
+        if column < lookback:
+            return []
+        ranks = self.ranks[:len(self.codes)]
+        latest = ranks[:, column]
+        before = ranks[:, column - lookback]
+        rows = np.nonzero((latest > 0) & (latest <= top_n) & ((before == 0) | (before > top_n)))[0]
+        rows = rows[np.argsort(latest[rows])]
+        return [(int(row), int(latest[row]), int(before[row]) or None) for row in rows]
+
+    def value_at(self, rank, at=None):
+        """第 at 次（默认最新一次）快照第 rank 名的指标值，没有记录时为 None"""
+        values = self.top_values[len(self.timestamps) - 1 if at is None else at]
+        value = values[rank - 1] if rank <= len(values) else np.nan
+        return float(value) if np.isfinite(value) else None
+
+
+# ====================== 增量价格库 ======================
+class PriceHistoryStore:
+    """跨周期累积的收盘价库，按 (股票代码, 交易日) 定位单元格，合并快照时只写入新增或变化的单元格"""
+
+    def __init__(self, initial_stocks=1024, initial_dates=32):
+        self.code_index = {}
+        self.date_index = {}
+        self.codes = []
+        self.names = []
+        self.dates = []
+        self.prices = np.zeros((initial_stocks, initial_dates), dtype=np.float32)
+        self.mask = np.zeros((initial_stocks, initial_dates), dtype=bool)
+        self.date_order = None
+        self.last_merge = None
+
+    def _ensure_capacity(self, n_stocks, n_dates):
+        rows, cols = self.prices.shape
+        if n_stocks <= rows and n_dates <= cols:
+            return
+        new_rows = max(rows, 1)
+        while new_rows < n_stocks:
+            new_rows *= 2
+        new_cols = max(cols, 1)
+        while new_cols < n_dates:
+            new_cols *= 2
+        prices = np.zeros((new_rows, new_cols), dtype=np.float32)
+        mask = np.zeros((new_rows, new_cols), dtype=bool)
+        prices[:rows, :cols] = self.prices
+        mask[:rows, :cols] = self.mask
+        self.prices, self.mask = prices, mask
+
+    def _rows_for(self, codes, names):
+        rows = np.empty(len(codes), dtype=np.int64)
+        for i, code in enumerate(codes):
+            row = self.code_index.get(code)
+            if row is None:
+                row = len(self.codes)
+                self.code_index[code] = row
+                self.codes.append(code)
+                self.names.append(names[i])
+            else:
+                self.names[row] = names[i]
+            rows[i] = row
+        return rows
+
+    def _cols_for(self, dates):
+        cols = np.empty(len(dates), dtype=np.int64)
+        for i, date in enumerate(dates):
+            col = self.date_index.get(date)
+            if col is None:
+                col = len(self.dates)
+                self.date_index[date] = col
+                self.dates.append(date)
+                self.date_order = None
+            cols[i] = col
+        return cols
+
+    def merge(self, snapshot):
+        """合并一次价格快照，返回新增、变化和未变化的单元格数量"""
+        rows = self._rows_for(snapshot.codes.tolist(), snapshot.names.tolist())
+        cols = self._cols_for(snapshot.dates.tolist())
+        self._ensure_capacity(len(self.codes), len(self.dates))
+        
+        grid = np.ix_(rows, cols)
+        existing_mask = self.mask[grid]
+        existing_prices = self.prices[grid]
+        is_new = snapshot.mask & ~existing_mask
+        is_changed = snapshot.mask & existing_mask & (existing_prices != snapshot.prices)
+        write = is_new | is_changed
+        
+        write_rows, write_cols = np.nonzero(write)
+        self.prices[rows[write_rows], cols[write_cols]] = snapshot.prices[write_rows, write_cols]
+        self.mask[rows[write_rows], cols[write_cols]] = True
+        
+        self.last_merge = {
+            'new_cells': int(is_new.sum()),
+            'changed_cells': int(is_changed.sum()),
+            'unchanged_cells': int((snapshot.mask & ~write).sum()),
+        }
+        logging.debug(f"步骤: Price store merge: {self.last_merge}")
+        return self.last_merge
+
+    def _sorted_cols(self):
+        if self.date_order is None:
+            self.date_order = date_sort_order(normalize_dates(self.dates))
+        return self.date_order
+
+    def series(self, code, last_n=None):
+        """单只股票累积的全部有效日期和收盘价（按日期排序），通过索引直接定位"""
+        row = self.code_index.get(code)
+        if row is None:
+            return [], []
+        cols = self._sorted_cols()
+        valid = cols[self.mask[row, cols]]
+        if last_n is not None:
+            valid = valid[-last_n:]
+        return [self.dates[c] for c in valid], self.prices[row, valid].astype(np.float64).round(4).tolist()
+
+    def window(self, codes, last_n):
+        """多只股票最近 last_n 个交易日的对齐矩阵，返回 (日期, 价格矩阵, 有效掩码)"""
+        cols = self._sorted_cols()[-last_n:]
+        rows = np.array([self.code_index.get(code, -1) for code in codes], dtype=np.int64)
+        known = rows >= 0
+        prices = np.zeros((len(codes), len(cols)), dtype=np.float32)
+        mask = np.zeros((len(codes), len(cols)), dtype=bool)
+        prices[known] = self.prices[np.ix_(rows[known], cols)]
+        mask[known] = self.mask[np.ix_(rows[known], cols)]
+        return [self.dates[c] for c in cols], prices, mask
+
+    def to_arrays(self):
+        n_stocks, n_dates = len(self.codes), len(self.dates)
+        return {
+            'codes': np.asarray(self.codes, dtype=str),
+            'names': np.asarray(self.names, dtype=str),
+            'dates': np.asarray(self.dates, dtype=str),
+            'prices': self.prices[:n_stocks, :n_dates].copy(),
+            'mask': self.mask[:n_stocks, :n_dates].copy(),
+            'last_merge': self.last_merge,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        prices = np.asarray(arrays['prices'])
+        store = cls(initial_stocks=max(prices.shape[0], 1) * 2, initial_dates=max(prices.shape[1], 1) * 2)
+        store.codes = [sys.intern(str(code)) for code in arrays['codes']]
+        store.names = [sys.intern(str(name)) for name in arrays['names']]
+        store.dates = [sys.intern(str(date)) for date in arrays['dates']]
+        store.code_index = {code: row for row, code in enumerate(store.codes)}
+        store.date_index = {date: col for col, date in enumerate(store.dates)}
+        store.prices[:prices.shape[0], :prices.shape[1]] = prices
+        store.mask[:prices.shape[0], :prices.shape[1]] = arrays['mask']
+        store.last_merge = arrays['last_merge']
+        return store
+
+    def stats(self):
+        n_stocks, n_dates = len(self.codes), len(self.dates)
+        return {
+            'stocks': n_stocks,
+            'dates': n_dates,
+            'cells': int(self.mask[:n_stocks, :n_dates].sum()),
+            'bytes': self.prices.nbytes + self.mask.nbytes,
+        }
+
+
+# ====================== 检查点文件 ======================
+CHECKPOINT_MAGIC = b'DPCKPT01'
+CHECKPOINT_ALIGN = 64
+
+
+def _flatten_state(obj, arrays):
+    """把嵌套的 dict/list/ndarray 状态拆成 JSON 结构和数组表，数组在 JSON 中以名字引用"""
+    if isinstance(obj, np.ndarray):
+        name = f"a{len(arrays)}"
+        if obj.dtype == object:
+            arrays[name] = np.asarray(obj.astype(str), dtype=str)
+            return {'__array__': name, 'object': True}
+        arrays[name] = np.ascontiguousarray(obj)
+        return {'__array__': name}
+    if isinstance(obj, dict):
+        return {'__dict__': [[key, _flatten_state(value, arrays)] for key, value in obj.items()]}
+    if isinstance(obj, (list, tuple)):
+        return [_flatten_state(item, arrays) for item in obj]
+    if isinstance(obj, datetime):
+        return {'__datetime__': obj.isoformat()}
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
+
+
+def _unflatten_state(obj, arrays):
+    if isinstance(obj, list):
+        return [_unflatten_state(item, arrays) for item in obj]
+    if isinstance(obj, dict):
+        if '__array__' in obj:
+            array = arrays[obj['__array__']]
+            return array.astype(object) if obj.get('object') else array
+        if '__datetime__' in obj:
+            return datetime.fromisoformat(obj['__datetime__'])
+        return {key: _unflatten_state(value, arrays) for key, value in obj['__dict__']}
+    return obj
+
+
+def save_checkpoint(path, state):
+    """把状态写成单个可内存映射的文件: 魔数 + 头部长度 + JSON 头部 + 按 64 字节对齐的原始数组"""
+    arrays = {}
+    structure = _flatten_state(state, arrays)
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += -(-array.nbytes // CHECKPOINT_ALIGN) * CHECKPOINT_ALIGN
+    header = json.dumps({'state': structure, 'arrays': layout}, ensure_ascii=False).encode('utf-8')
+    data_start = -(-(len(CHECKPOINT_MAGIC) + 8 + len(header)) // CHECKPOINT_ALIGN) * CHECKPOINT_ALIGN
+    
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(CHECKPOINT_MAGIC)
+        f.write(np.uint64(len(header)).tobytes())
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]['offset'])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+    return data_start + offset
+
+
+def load_checkpoint(path):
+    """读取检查点: 整个文件只映射一次，每个数组复制到内存后立即关闭映射
+
+    恢复出的状态不再引用检查点文件，Windows 上仍被映射的文件无法被下一次 os.replace 覆盖。
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(CHECKPOINT_MAGIC)) != CHECKPOINT_MAGIC:
+            raise ValueError(f"Not a checkpoint file: {path}")
+        header_length = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = json.loads(f.read(header_length).decode('utf-8'))
+        data_start = -(-(len(CHECKPOINT_MAGIC) + 8 + header_length) // CHECKPOINT_ALIGN) * CHECKPOINT_ALIGN
+        arrays = {}
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for name, spec in header['arrays'].items():
+                shape = tuple(spec['shape'])
+                count = int(np.prod(shape))
+                if count == 0:
+                    arrays[name] = np.empty(shape, dtype=spec['dtype'])
+                else:
+                    # 临时视图复制后即被释放，关闭映射时不会留下导出的缓冲区
+                    arrays[name] = np.array(np.frombuffer(mapped, dtype=spec['dtype'], count=count,
+                                                          offset=data_start + spec['offset']).reshape(shape),
+                                            copy=True)
+    return _unflatten_state(header['state'], arrays)
+
+
+# ====================== 查询结果缓存 ======================
+class QueryResultCache:
+    """处理好的快照按 (规范化查询, 抓取方式, 时间窗口) 缓存，带 TTL 和 LRU 容量上限，多个会话和查询共用
+
+    抓取方式 variant 是调用方给出的可哈希元组（如分片方式和数据来源），不同方式得到的结果不共用缓存。
+    时间窗口按 bucket_seconds 对齐（通常等于监控间隔），同一窗口内的相同查询共享一次抓取结果；
+    窗口内的结果超过 ttl_seconds 同样视为过期。ttl_seconds 为 0 时不缓存。
+    """
+
+    def __init__(self, ttl_seconds=120, max_entries=32, bucket_seconds=300):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.bucket_seconds = bucket_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(query):
+        """全角/半角统一（NFKC）、去掉空白、统一分隔符和末尾标点，大小写不敏感"""
+        text = unicodedata.normalize('NFKC', query)
+        text = re.sub(r'\s+', '', text).replace(';', ',').replace('、', ',')
+        return re.sub(r',{2,}', ',', text).strip(',.。').lower()
+
+    def key(self, query, now, variant=()):
+        bucket = int(now // self.bucket_seconds) if self.bucket_seconds else 0
+        return self.normalize(query), tuple(variant), bucket
+
+    def get(self, query, now=None, variant=()):
+        if not self.ttl_seconds:
+            return None
+        now = time.time() if now is None else now
+        key = self.key(query, now, variant)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now - entry['stored_at'] <= self.ttl_seconds:
+                self.entries.move_to_end(key)
+                entry['hits'] += 1
+                self.hits += 1
+                return entry['snapshot']
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, query, snapshot, now=None, variant=()):
+        if not self.ttl_seconds or snapshot is None:
+            return
+        now = time.time() if now is None else now
+        key = self.key(query, now, variant)
+        with self.lock:
+            self.entries[key] = {'snapshot': snapshot, 'stored_at': now, 'hits': 0}
+            self.entries.move_to_end(key)
+            # 顺带清掉过期项，再按最近使用顺序淘汰超出容量的项
+            for stale in [k for k, entry in self.entries.items() if now - entry['stored_at'] > self.ttl_seconds]:
+                del self.entries[stale]
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+# ====================== 进程池解析 ======================
+def encode_dataframe(df):
+    """把 DataFrame 拆成按列的 NumPy 数组；文本列转为定长 unicode 数组并附带空值掩码"""
+    columns = []
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+            columns.append((col, series.to_numpy(), None))
+        else:
+            mask = series.isna().to_numpy()
+            values = np.asarray(series.where(~mask, '').astype(str), dtype=str)
+            columns.append((col, values, mask))
+    return {'index': df.index.to_numpy(), 'columns': columns}
+
+
+def decode_dataframe(encoded):
+    data = {}
+    for i, (_, values, mask) in enumerate(encoded['columns']):
+        if mask is None:
+            data[i] = values
+        else:
+            restored = values.astype(object)
+            restored[mask] = np.nan
+            data[i] = restored
+    df = pd.DataFrame(data, index=encoded['index'])
+    df.columns = [col for col, _, _ in encoded['columns']]
+    return df
+
+
+def encode_snapshot(snapshot):
+    return {
+        'timestamp': snapshot['timestamp'],
+        'stock_count': snapshot['stock_count'],
+        'stock_list': encode_dataframe(snapshot['stock_list']),
+        'prices': snapshot['prices'].to_arrays(),
+        'features': encode_dataframe(snapshot['features']),
+        'stats': {**snapshot['stats'], 'describe': encode_dataframe(snapshot['stats']['describe'])},
+    }
+
+
+def decode_snapshot(encoded):
+    return {
+        'timestamp': encoded['timestamp'],
+        'stock_count': encoded['stock_count'],
+        'stock_list': decode_dataframe(encoded['stock_list']),
+        'prices': PriceSnapshot.from_arrays(encoded['prices']),
+        'features': decode_dataframe(encoded['features']),
+        'stats': {**encoded['stats'], 'describe': decode_dataframe(encoded['stats']['describe'])},
+    }
+
+
+def parse_export_worker(file_path):
+    """子进程入口: 解析一个导出文件并计算斜率，返回紧凑编码的快照"""
+    parser = IwencaiExportParser()
+    df = parser.read_export_file(file_path)
+    if df is None or df.empty:
+        return None
+    snapshot = parser.build_snapshot(df)
+    if snapshot is None:
+        return None
+    return encode_snapshot(snapshot)
+
+
+def _warmup_worker(_):
+    return os.getpid()
+
+
+def available_cpu_count():
+    """本进程可用的 CPU 核心数（容器和 taskset 限制后的数量）"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class ParsePool:
+    """解析/计算阶段的进程池，多个导出文件同时到达时利用全部 CPU 核心，绕开 GIL
+
+    只有一个可用核心、只有一个进程或文件数少于 min_batch 时进程池只有启动和传输开销，直接在本进程解析。
+    """
+
+    def __init__(self, max_workers=None, min_batch=2, inline_fallback=True):
+        self.cpu_count = available_cpu_count()
+        self.max_workers = max_workers or self.cpu_count
+        self.min_batch = min_batch
+        self.inline_fallback = inline_fallback
+        self.executor = None
+
+    def use_pool(self, n_files):
+        if not self.inline_fallback:
+            return True
+        return self.cpu_count >= 2 and self.max_workers >= 2 and n_files >= self.min_batch
+
+    def _get_executor(self):
+        if self.executor is None:
+            # spawn 避免在带有浏览器和 Streamlit 线程的进程里 fork
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return self.executor
+
+    def warmup(self):
+        """预先启动全部子进程，避免第一批文件承担进程启动和导入开销"""
+        return set(self._get_executor().map(_warmup_worker, range(self.max_workers * 2)))
+
+    def parse_files(self, file_paths):
+        """并行解析多个导出文件，按输入顺序返回快照，失败的文件对应 None"""
+        if not self.use_pool(len(file_paths)):
+            logging.debug(f"步骤: Parsing {len(file_paths)} files inline ({self.cpu_count} CPUs available)")
+            return [self.parse_inline(path) for path in file_paths]
+        executor = self._get_executor()
+        futures = [executor.submit(parse_export_worker, path) for path in file_paths]
+        snapshots = []
+        for path, future in zip(file_paths, futures):
+            try:
+                encoded = future.result()
+                snapshots.append(decode_snapshot(encoded) if encoded else None)
+            except Exception as e:
+                logging.error(f"Error parsing {os.path.basename(path)} in worker: {str(e)}")
+                snapshots.append(None)
+        return snapshots
+
+    @staticmethod
+    def parse_inline(file_path):
+        try:
+            parser = IwencaiExportParser()
+            df = parser.read_export_file(file_path)
+            if df is None or df.empty:
+                return None
+            return parser.build_snapshot(df)
+        except Exception as e:
+            logging.error(f"Error parsing {os.path.basename(file_path)}: {str(e)}")
+            return None
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
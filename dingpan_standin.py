@@ -0,0 +1,310 @@
+# dingpan_standin.py
+# 本地问财替身站点: 页面结构与自动化代码使用的选择器一致，导出模拟的双表头 xlsx，各环节延迟可配置；/webhook 接收告警
+import io
+import json
+import logging
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+from dingpan_tools import build_iwencai_grid
+
+STANDIN_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>问财本地替身</title>
+<style>
+body { font-family: sans-serif; margin: 20px; }
+textarea { width: 600px; height: 60px; }
+.search-icon { display: inline-block; padding: 6px 16px; background: #e93030; color: #fff; cursor: pointer; }
+.hidden { display: none; }
+.item { display: inline-flex; gap: 4px; margin: 10px 0; cursor: pointer; }
+.pager span { margin-right: 10px; cursor: pointer; }
+.pager .disabled { color: #aaa; }
+.login-mask { position: fixed; left: 0; top: 0; right: 0; bottom: 0; background: rgba(0, 0, 0, 0.4); }
+.login-mask .panel { width: 280px; margin: 120px auto; padding: 20px; background: #fff; }
+table { border-collapse: collapse; }
+td, th { border: 1px solid #ddd; padding: 2px 6px; }
+</style>
+</head>
+<body>
+<textarea placeholder="请输入您的问句"></textarea>
+<div class="search-icon">搜索</div>
+<div id="result" class="hidden">
+  <div class="item"><div class="download">&#8681;</div><div class="text">导数据</div></div>
+  <div class="table-container"><table><thead></thead><tbody></tbody></table></div>
+  <div class="pager"><span class="total"></span><span class="next">下一页</span></div>
+</div>
+<div id="login" class="login-mask hidden"><div class="panel"><div>扫码登录</div></div></div>
+<script>
+var CONFIG = __CONFIG__;
+var result = null;
+var page = 0;
+var query = '';
+function $(selector) {
+    return document.querySelector(selector);
+}
+function cell(tag, text, attrs) {
+    var el = document.createElement(tag);
+    el.textContent = text === null ? '' : text;
+    Object.keys(attrs || {}).forEach(function (name) {
+        el.setAttribute(name, attrs[name]);
+    });
+    return el;
+}
+function renderHeader() {
+    var thead = $('thead');
+    thead.innerHTML = '';
+    var top = document.createElement('tr');
+    result.header_top.forEach(function (group) {
+        top.appendChild(cell('th', group[0], {colspan: group[1], rowspan: group[2]}));
+    });
+    var dates = document.createElement('tr');
+    result.header_dates.forEach(function (date) {
+        dates.appendChild(cell('th', date));
+    });
+    thead.appendChild(top);
+    thead.appendChild(dates);
+}
+function renderPage() {
+    var tbody = $('tbody');
+    tbody.innerHTML = '';
+    result.rows.slice(page * CONFIG.page_size, (page + 1) * CONFIG.page_size).forEach(function (row) {
+        var tr = document.createElement('tr');
+        row.forEach(function (value) {
+            tr.appendChild(cell('td', value));
+        });
+        tbody.appendChild(tr);
+    });
+    $('.total').textContent = '共 ' + result.rows.length + ' 条';
+    var last = (page + 1) * CONFIG.page_size >= result.rows.length;
+    $('.next').className = last ? 'next disabled' : 'next';
+}
+$('.search-icon').addEventListener('click', function () {
+    query = $('textarea').value;
+    $('#result').className = 'hidden';
+    var xhr = new XMLHttpRequest();
+    xhr.open('GET', '/api/result?q=' + encodeURIComponent(query));
+    xhr.onload = function () {
+        result = JSON.parse(xhr.responseText);
+        page = 0;
+        renderHeader();
+        renderPage();
+        $('#result').className = '';
+    };
+    xhr.send();
+});
+$('.next').addEventListener('click', function () {
+    if ((page + 1) * CONFIG.page_size < result.rows.length) {
+        page++;
+        renderPage();
+    }
+});
+$('.item').addEventListener('click', function () {
+    if (CONFIG.login_required) {
+        // 模拟扫码: 弹窗显示 login_delay_ms 后自动关闭，之后再次点击导数据才会下载
+        $('#login').className = 'login-mask';
+        setTimeout(function () {
+            var xhr = new XMLHttpRequest();
+            xhr.open('POST', '/api/login');
+            xhr.send();
+            CONFIG.login_required = false;
+            $('#login').className = 'login-mask hidden';
+        }, CONFIG.login_delay_ms);
+        return;
+    }
+    window.location.href = '/export?q=' + encodeURIComponent(query);
+});
+</script>
+</body>
+</html>
+"""
+
+
+# 查询中出现板块条件时只返回该板块的股票（按代码前缀），用于分片查询
+STANDIN_BOARDS = {'沪市主板': ('60',), '深市主板': ('00',), '创业板': ('30',), '科创板': ('68',)}
+
+
+# ====================== 替身站点 ======================
+class IwencaiStandin:
+    """在后台线程运行的本地 HTTP 站点，模拟 搜索 → 结果表格 → 导数据 → 扫码登录 → 下载 的流程
+
+    轮换使用 variants 份预先生成的数据: 同一查询再次搜索时视为新周期，切换到下一份，连续周期的结果不同。
+    所有延迟单位为秒；查询和导出的延迟另按返回行数增加 seconds_per_1000_rows，模拟结果越大越慢。
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, n_stocks=500, variants=3, page_delay=0.0, search_delay=0.5,
+                 export_delay=0.5, seconds_per_1000_rows=0.0, login_required=False, login_delay=2.0, page_size=50):
+        self.n_stocks = n_stocks
+        self.page_delay = page_delay
+        self.search_delay = search_delay
+        self.export_delay = export_delay
+        self.seconds_per_1000_rows = seconds_per_1000_rows
+        self.login_required = login_required
+        self.login_delay = login_delay
+        self.page_size = page_size
+        self.logged_in = False
+        self.counters = {'pages': 0, 'searches': 0, 'exports': 0, 'logins': 0, 'webhooks': 0}
+        self.queries = []
+        # /webhook 收到的告警请求: (接收时间, JSON 内容)
+        self.webhook_events = []
+        self.lock = threading.Lock()
+        self.variants = [build_iwencai_grid(self.n_stocks, seed=seed) for seed in range(max(variants, 1))]
+        self.variant_index = 0
+        self.round_queries = set()
+        self.query_variants = {}
+        self.rendered = {}
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/unifiedwap/"
+
+    @property
+    def webhook_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/webhook"
+
+    def select_variant(self, query):
+        """搜索时为查询绑定一份数据；本轮已搜索过的查询再次出现说明进入了新周期，切换到下一份"""
+        with self.lock:
+            if query in self.round_queries:
+                self.variant_index = (self.variant_index + 1) % len(self.variants)
+                self.round_queries.clear()
+            self.round_queries.add(query)
+            self.query_variants[query] = self.variant_index
+            return self.variant_index
+
+    def render(self, variant_index, query):
+        """按查询中的板块条件筛选后的 xlsx 字节和页面表格 JSON（合并表头拆成 [文本, colspan, rowspan]），按需生成并缓存"""
+        boards = tuple(board for board in STANDIN_BOARDS if board in query)
+        key = (variant_index, boards)
+        with self.lock:
+            cached = self.rendered.get(key)
+        if cached is not None:
+            return cached
+        
+        grid = self.variants[variant_index]
+        body = grid.iloc[2:]
+        if boards:
+            prefixes = tuple(prefix for board in boards for prefix in STANDIN_BOARDS[board])
+            body = body[body.iloc[:, 0].str.startswith(prefixes)]
+        subset = pd.concat([grid.iloc[:2], body])
+        buffer = io.BytesIO()
+        subset.to_excel(buffer, header=False, index=False)
+        
+        header_top = []
+        for label, date in zip(grid.iloc[0], grid.iloc[1]):
+            if label == 'undefined':
+                header_top[-1][1] += 1
+            else:
+                header_top.append([label, 1, 2 if pd.isna(date) else 1])
+        rendered = {
+            'rows': len(body),
+            'xlsx': buffer.getvalue(),
+            'result': json.dumps({
+                'header_top': header_top,
+                'header_dates': [date for date in grid.iloc[1] if not pd.isna(date)],
+                'rows': [[str(value) for value in row] for row in body.itertuples(index=False)],
+            }, ensure_ascii=False).encode('utf-8'),
+        }
+        with self.lock:
+            self.rendered[key] = rendered
+        return rendered
+
+    def delay_for(self, base_delay, rows):
+        return base_delay + self.seconds_per_1000_rows * rows / 1000
+
+    def page_config(self):
+        with self.lock:
+            login_required = self.login_required and not self.logged_in
+        return json.dumps({
+            'login_required': login_required,
+            'login_delay_ms': int(self.login_delay * 1000),
+            'page_size': self.page_size,
+        })
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def handler_class(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logging.debug(f"步骤: Standin {self.address_string()} {format % args}")
+
+            def send_body(self, body, content_type, headers=None):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urllib.parse.urlparse(self.path)
+                query = urllib.parse.parse_qs(url.query).get('q', [''])[0]
+                if url.path.rstrip('/') in ('', '/unifiedwap'):
+                    standin.count('pages')
+                    time.sleep(standin.page_delay)
+                    page = STANDIN_PAGE.replace('__CONFIG__', standin.page_config())
+                    self.send_body(page.encode('utf-8'), 'text/html; charset=utf-8')
+                elif url.path == '/api/result':
+                    standin.count('searches')
+                    with standin.lock:
+                        standin.queries.append(query)
+                    rendered = standin.render(standin.select_variant(query), query)
+                    time.sleep(standin.delay_for(standin.search_delay, rendered['rows']))
+                    self.send_body(rendered['result'], 'application/json; charset=utf-8')
+                elif url.path == '/export':
+                    standin.count('exports')
+                    with standin.lock:
+                        variant_index = standin.query_variants.get(query, standin.variant_index)
+                    rendered = standin.render(variant_index, query)
+                    time.sleep(standin.delay_for(standin.export_delay, rendered['rows']))
+                    self.send_body(
+                        rendered['xlsx'],
+                        'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                        {'Content-Disposition': f'attachment; filename="iwencai_{int(time.time() * 1000)}.xlsx"'}
+                    )
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                path = urllib.parse.urlparse(self.path).path
+                if path == '/api/login':
+                    standin.count('logins')
+                    with standin.lock:
+                        standin.logged_in = True
+                    self.send_body(b'{}', 'application/json')
+                elif path == '/webhook':
+                    received_at = time.time()
+                    body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                    standin.count('webhooks')
+                    with standin.lock:
+                        standin.webhook_events.append((received_at, json.loads(body.decode('utf-8'))))
+                    self.send_body(b'{}', 'application/json')
+                else:
+                    self.send_error(404)
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="iwencai-standin", daemon=True)
+        self.thread.start()
+        logging.debug(f"步骤: Iwencai standin serving {self.n_stocks} stocks at {self.url}")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
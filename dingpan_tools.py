@@ -0,0 +1,604 @@
+# dingpan_tools.py
+# 命令行工具: 生成模拟的问财导出文件、基准测试
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from dingpan_archive import DEFAULT_ARCHIVE_DIR, ExportArchive
+from dingpan_core import IwencaiExportParser, ParsePool, available_cpu_count
+
+DEFAULT_EXPORT_DATES = [
+    '2025.11.12', '2025.11.13', '2025.11.14', '2025.11.17', '2025.11.18', '2025.11.19', '2025.11.20'
+]
+
+
+# ====================== 模拟导出文件 ======================
+def build_iwencai_grid(n_stocks=500, dates=None, seed=0):
+    """生成与问财导数据格式一致的双表头表格（前两行是表头，不含列名）"""
+    rng = np.random.default_rng(seed)
+    dates = list(dates or DEFAULT_EXPORT_DATES)
+    # 依次轮换沪市主板、深市主板、创业板、科创板的代码段
+    codes = [
+        (f"{600000 + i:06d}.SH", f"{i:06d}.SZ", f"{300000 + i:06d}.SZ", f"{688000 + i:06d}.SH")[i % 4]
+        for i in range(n_stocks)
+    ]
+    names = [f"测试股票{i}" for i in range(n_stocks)]
+    
+    base = rng.uniform(3, 80, n_stocks)
+    returns = rng.normal(0.002, 0.02, (n_stocks, len(dates)))
+    closes = np.round(base[:, None] * np.cumprod(1 + returns, axis=1), 2)
+    opens = np.round(closes * (1 + rng.normal(0, 0.01, closes.shape)), 2)
+    ma5 = np.round(closes * (1 - np.abs(rng.normal(0.01, 0.01, closes.shape))), 2)
+    scores = np.round(rng.uniform(2.5, 5, n_stocks), 2)
+    
+    # 第一行是指标名，合并单元格中后续列为 undefined；第二行是日期
+    header_top = ['股票代码', '股票简称']
+    header_dates = [None, None]
+    for label in ('收盘价:不复权(元)', '开盘价:不复权(元)', '5日均线(元)'):
+        header_top += [label] + ['undefined'] * (len(dates) - 1)
+        header_dates += dates
+    header_top.append('财务诊断评分')
+    header_dates.append(dates[-1])
+    
+    body = pd.concat([
+        pd.DataFrame({'code': codes, 'name': names}),
+        pd.DataFrame(closes),
+        pd.DataFrame(opens),
+        pd.DataFrame(ma5),
+        pd.DataFrame({'score': scores}),
+    ], axis=1)
+    body.columns = range(len(body.columns))
+    return pd.concat([pd.DataFrame([header_top, header_dates]), body], ignore_index=True)
+
+
+def generate_iwencai_export(path, n_stocks=500, dates=None, seed=0):
+    """生成与问财导数据格式一致的双表头导出文件（按扩展名写 xlsx 或 csv）"""
+    grid = build_iwencai_grid(n_stocks, dates, seed)
+    if path.endswith('.csv'):
+        grid.to_csv(path, header=False, index=False, encoding='gbk')
+    else:
+        grid.to_excel(path, header=False, index=False)
+    return path
+
+
+# ====================== 基准测试 ======================
+def bench_parse(args):
+    """解析/计算阶段吞吐量随进程数的变化"""
+    work_dir = tempfile.mkdtemp(prefix='dingpan_bench_')
+    paths = [
+        generate_iwencai_export(os.path.join(work_dir, f"export_{i}.xlsx"), n_stocks=args.stocks, seed=i)
+        for i in range(args.files)
+    ]
+    print(f"{args.files} 个导出文件，每个 {args.stocks} 只股票，可用 CPU 核心数 {available_cpu_count()}")
+    
+    parser = IwencaiExportParser()
+    start = time.perf_counter()
+    for path in paths:
+        parser.build_snapshot(parser.read_export_file(path))
+    baseline = time.perf_counter() - start
+    rows = [{'workers': '本进程顺序', 'seconds': baseline, 'files/s': args.files / baseline, 'speedup': 1.0}]
+    
+    # 各进程数强制使用进程池测量扩展性，最后一行是默认配置（核心不足或文件太少时本进程解析）的实际选择
+    for workers in list(args.workers) + ['默认']:
+        if workers == '默认':
+            pool = ParsePool()
+            label = f"默认（{'进程池 ' + str(pool.max_workers) if pool.use_pool(len(paths)) else '本进程'}）"
+        else:
+            pool = ParsePool(max_workers=workers, inline_fallback=False)
+            label = workers
+        if pool.use_pool(len(paths)):
+            pool.warmup()
+        start = time.perf_counter()
+        snapshots = pool.parse_files(paths)
+        elapsed = time.perf_counter() - start
+        pool.shutdown()
+        failed = sum(snapshot is None for snapshot in snapshots)
+        rows.append({
+            'workers': label,
+            'seconds': elapsed,
+            'files/s': args.files / elapsed,
+            'speedup': baseline / elapsed,
+            'failed': failed,
+        })
+    print(pd.DataFrame(rows).round(3).to_string(index=False))
+
+
+def deep_sizeof(obj, seen=None, include_str=True):
+    """递归统计 dict/list/str/float 组成的结构占用的字节数，共享对象只计一次"""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, str) and not include_str:
+        return 0
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen, include_str) + deep_sizeof(v, seen, include_str) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deep_sizeof(item, seen, include_str) for item in obj)
+    return size
+
+
+def bench_memory(args):
+    """每次快照的内存: 旧的逐股字典+列表结构 vs 价格矩阵快照"""
+    work_dir = tempfile.mkdtemp(prefix='dingpan_bench_')
+    path = generate_iwencai_export(os.path.join(work_dir, 'export.xlsx'), n_stocks=args.stocks)
+    parser = IwencaiExportParser()
+    prices = parser.build_price_snapshot(parser.read_export_file(path))
+    
+    # 按旧结构重建: slopes / closing_sequences / date_columns / stock_names 四个以 "代码 名称" 为键的字典
+    legacy = {'slopes': {}, 'closing_sequences': {}, 'date_columns': {}, 'stock_names': {}}
+    for row, key in enumerate(prices.keys.tolist()):
+        dates, closes = prices.series(key)
+        legacy['slopes'][key] = float(prices.slopes[row])
+        legacy['closing_sequences'][key] = [float(price) for price in closes]
+        legacy['date_columns'][key] = [str(date) for date in dates]
+        legacy['stock_names'][key] = str(prices.names[row])
+    
+    strings = {id(s): s for s in prices.keys.tolist() + prices.names.tolist() + prices.dates.tolist()}
+    string_bytes = sum(sys.getsizeof(s) for s in strings.values())
+    rows = [
+        {'结构': '逐股字典+列表', '不含字符串(KB)': deep_sizeof(legacy, include_str=False) / 1024,
+         '含字符串(KB)': deep_sizeof(legacy) / 1024},
+        {'结构': '价格矩阵快照', '不含字符串(KB)': prices.nbytes() / 1024,
+         '含字符串(KB)': (prices.nbytes() + string_bytes) / 1024},
+    ]
+    result = pd.DataFrame(rows).round(1)
+    print(f"{args.stocks} 只股票 × {len(prices.dates)} 个交易日")
+    print(result.to_string(index=False))
+    saving = 1 - rows[1]['不含字符串(KB)'] / rows[0]['不含字符串(KB)']
+    print(f"每次快照节省 {rows[0]['不含字符串(KB)'] - rows[1]['不含字符串(KB)']:.1f} KB（{saving:.0%}，"
+          f"股票键和名称驻留后在快照之间共享）")
+
+
+def bench_features(args):
+    """技术指标表: 逐只股票 linregress 循环 vs 向量化批量计算"""
+    from scipy import stats
+    
+    work_dir = tempfile.mkdtemp(prefix='dingpan_bench_')
+    path = generate_iwencai_export(os.path.join(work_dir, 'export.xlsx'), n_stocks=args.stocks)
+    parser = IwencaiExportParser()
+    df = parser.read_export_file(path)
+    prices = parser.build_price_snapshot(df)
+    close_cols, _ = parser.find_closing_price_columns(df)
+    close = parser.metric_matrix(df, close_cols)
+    
+    start = time.perf_counter()
+    for row in close:
+        for window in (3, 5, 7):
+            y = row[-window:]
+            result = stats.linregress(np.arange(len(y)), y)
+            _ = (result.slope / y.mean() * 100, result.rvalue ** 2)
+    loop_seconds = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    features = parser.build_feature_table(df, prices)
+    vector_seconds = time.perf_counter() - start
+    
+    print(f"{args.stocks} 只股票 × {len(close_cols)} 个交易日，{len(features.columns) - 2} 个指标")
+    print(f"逐只 linregress（仅斜率和R²）: {loop_seconds * 1000:.1f} ms")
+    print(f"向量化全部指标: {vector_seconds * 1000:.1f} ms（{loop_seconds / vector_seconds:.0f}x）")
+
+
+# ====================== 端到端基准测试 ======================
+def serve_standin(args):
+    """前台运行本地问财替身站点，供手动调试自动化流程"""
+    from dingpan_standin import IwencaiStandin
+    
+    standin = IwencaiStandin(port=args.port, n_stocks=args.stocks, page_delay=args.page_delay,
+                             search_delay=args.search_delay, export_delay=args.export_delay,
+                             seconds_per_1000_rows=args.per_1000_rows, login_required=args.login,
+                             login_delay=args.login_delay).start()
+    print(f"替身站点: {standin.url}（Ctrl+C 退出）")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        standin.stop()
+
+
+def process_tree_usage(root_pid):
+    """Linux 下进程树（驱动进程及其全部子进程）的内存和累计 CPU 时间，直接读取 /proc
+
+    内存优先使用 PSS（共享页按进程数分摊，多进程浏览器不会重复计算），不可用时退回 RSS。
+    """
+    parents = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            parents[int(name)] = (int(fields[1]), int(fields[11]) + int(fields[12]))
+        except (OSError, IndexError, ValueError):
+            continue
+    
+    tree = [root_pid]
+    for pid in tree:
+        tree += [child for child, (ppid, _) in parents.items() if ppid == pid]
+    
+    memory_kb = 0
+    for pid in tree:
+        try:
+            with open(f'/proc/{pid}/smaps_rollup') as f:
+                memory_kb += next(int(line.split()[1]) for line in f if line.startswith('Pss:'))
+        except (OSError, StopIteration):
+            try:
+                with open(f'/proc/{pid}/statm') as f:
+                    memory_kb += int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+            except OSError:
+                continue
+    cpu_ticks = sum(parents[pid][1] for pid in tree if pid in parents)
+    return {
+        'processes': len(tree),
+        'memory_mb': memory_kb / 1024,
+        'cpu_seconds': cpu_ticks / os.sysconf('SC_CLK_TCK'),
+    }
+
+
+def run_e2e_cycles(dingpan2, standin, args, headless):
+    """启动一个浏览器执行 args.cycles 个完整周期，返回每周期耗时和浏览器进程树的资源占用"""
+    monitor = dingpan2.StockMonitor()
+    monitor.target_url = standin.url
+    monitor.data_source = args.source
+    monitor.archive_enabled = False
+    monitor.headless = headless
+    monitor.shard_mode = args.shards
+    # 只测量一个浏览器的进程树，不启动热备浏览器
+    monitor.standby_enabled = False
+    
+    rows = []
+    try:
+        start = time.perf_counter()
+        if not monitor.initialize_driver():
+            return None
+        launch_seconds = time.perf_counter() - start
+        driver_pid = monitor.driver.service.process.pid
+        cpu_start = process_tree_usage(driver_pid)['cpu_seconds']
+        for cycle in range(1, args.cycles + 1):
+            start = time.perf_counter()
+            raw = monitor.fetch_raw(args.query)
+            fetched = time.perf_counter()
+            data = monitor.parse_raw(raw) if raw else None
+            parsed = time.perf_counter()
+            if data:
+                monitor.append_snapshot(data)
+            published = time.perf_counter()
+            usage = process_tree_usage(driver_pid)
+            rows.append({
+                '周期': cycle,
+                '抓取(秒)': fetched - start,
+                '解析(秒)': parsed - fetched,
+                '发布(秒)': published - parsed,
+                '端到端(秒)': published - start,
+                '股票数': data['stock_count'] if data else None,
+                '浏览器内存(MB)': usage['memory_mb'],
+                '浏览器进程数': usage['processes'],
+            })
+        cpu_seconds = process_tree_usage(driver_pid)['cpu_seconds'] - cpu_start
+    finally:
+        monitor.close()
+    return {'launch_seconds': launch_seconds, 'cycles': pd.DataFrame(rows), 'cpu_seconds': cpu_seconds}
+
+
+def fetch_raw_http(monitor, standin, query):
+    """不经过浏览器，按浏览器的请求顺序（页面 → 查询结果 → 导出）直接请求替身站点，返回和 fetch_raw 相同结构的原始结果
+
+    分片查询各自在一个线程中执行，对应浏览器里多个标签页的重叠请求。
+    """
+    base = standin.url.rstrip('/').rsplit('/', 1)[0]
+
+    def fetch_one(shard_query):
+        quoted = urllib.parse.quote(shard_query)
+        urllib.request.urlopen(standin.url).read()
+        urllib.request.urlopen(f"{base}/api/result?q={quoted}").read()
+        body = urllib.request.urlopen(f"{base}/export?q={quoted}").read()
+        path = os.path.join(monitor.staging_dir, f"{time.time_ns()}_iwencai.xlsx")
+        with open(path, 'wb') as f:
+            f.write(body)
+        return {'kind': 'file', 'path': path}
+
+    shards = monitor.shard_queries(query)
+    os.makedirs(monitor.staging_dir, exist_ok=True)
+    if len(shards) == 1:
+        return {**fetch_one(query), 'search_query': query, 'fetched_at': time.time()}
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        parts = list(executor.map(fetch_one, shards))
+    return {'kind': 'shards', 'parts': parts, 'search_query': query, 'fetched_at': time.time()}
+
+
+def run_http_cycles(dingpan2, standin, args):
+    """用 fetch_raw_http 代替浏览器执行 args.cycles 个周期，解析和发布走监控的正常路径"""
+    monitor = dingpan2.StockMonitor()
+    monitor.archive_enabled = False
+    monitor.shard_mode = args.shards
+    
+    rows = []
+    try:
+        for cycle in range(1, args.cycles + 1):
+            start = time.perf_counter()
+            raw = fetch_raw_http(monitor, standin, args.query)
+            fetched = time.perf_counter()
+            data = monitor.parse_raw(raw)
+            parsed = time.perf_counter()
+            if data:
+                monitor.append_snapshot(data)
+            published = time.perf_counter()
+            rows.append({
+                '周期': cycle,
+                '抓取(秒)': fetched - start,
+                '解析(秒)': parsed - fetched,
+                '发布(秒)': published - parsed,
+                '端到端(秒)': published - start,
+                '股票数': data['stock_count'] if data else None,
+            })
+    finally:
+        monitor.close()
+    return {'launch_seconds': None, 'cycles': pd.DataFrame(rows), 'cpu_seconds': None}
+
+
+def bench_e2e(args):
+    """对本地替身站点执行完整的监控周期（导航→搜索→导数据→下载→解析→发布），统计端到端延迟和浏览器资源占用"""
+    # 选择器缓存、检查点和归档写到临时目录，不影响正在使用的数据目录
+    os.environ['DINGPAN_DATA_DIR'] = tempfile.mkdtemp(prefix='dingpan_e2e_')
+    import logging
+    import dingpan2
+    from dingpan_standin import IwencaiStandin
+    logging.getLogger().setLevel(args.log_level)
+    
+    standin = IwencaiStandin(n_stocks=args.stocks, page_delay=args.page_delay, search_delay=args.search_delay,
+                             export_delay=args.export_delay, seconds_per_1000_rows=args.per_1000_rows,
+                             login_required=args.login, login_delay=args.login_delay).start()
+    site_seconds = (args.page_delay + args.search_delay + (args.export_delay if args.source == 'download' else 0)
+                    + args.per_1000_rows * args.stocks / 1000 * (2 if args.source == 'download' else 1))
+    print(f"{args.stocks} 只股票，数据来源 {args.source}，分片 {args.shards}，"
+          f"不分片时每周期站点模拟延迟 {site_seconds:.2f} 秒")
+    
+    if args.driver == 'http':
+        if args.source != 'download':
+            print("http 模式只支持 download 数据来源")
+            return
+        print("http 模式: 不启动浏览器，结果不含浏览器渲染和自动化的开销")
+    
+    summary = []
+    try:
+        for mode in (['http'] if args.driver == 'http' else args.modes):
+            if mode == 'headed' and sys.platform.startswith('linux') and not os.environ.get('DISPLAY'):
+                print("跳过有界面模式: 没有 DISPLAY（可用 xvfb-run 运行）")
+                continue
+            if mode == 'http':
+                result = run_http_cycles(dingpan2, standin, args)
+            else:
+                result = run_e2e_cycles(dingpan2, standin, args, headless=(mode == 'headless'))
+            if result is None:
+                print(f"{mode}: 浏览器初始化失败")
+                continue
+            cycles = result['cycles']
+            print(f"\n{mode} 模式" + ("" if mode == 'http' else f"，浏览器启动 {result['launch_seconds']:.2f} 秒"))
+            print(cycles.round(3).to_string(index=False))
+            row = {
+                '模式': mode,
+                '抓取中位数(秒)': cycles['抓取(秒)'].median(),
+                '解析中位数(秒)': cycles['解析(秒)'].median(),
+                '发布中位数(秒)': cycles['发布(秒)'].median(),
+                '端到端中位数(秒)': cycles['端到端(秒)'].median(),
+                '端到端P90(秒)': cycles['端到端(秒)'].quantile(0.9),
+            }
+            if result['cpu_seconds'] is not None:
+                row.update({
+                    '启动(秒)': result['launch_seconds'],
+                    '峰值内存(MB)': cycles['浏览器内存(MB)'].max(),
+                    '每周期CPU(秒)': result['cpu_seconds'] / max(len(cycles), 1),
+                    '进程数': cycles['浏览器进程数'].max(),
+                })
+            summary.append(row)
+    finally:
+        standin.stop()
+    
+    if summary:
+        print()
+        print(pd.DataFrame(summary).round(2).to_string(index=False))
+        by_mode = {row['模式']: row for row in summary}
+        if 'headless' in by_mode and 'headed' in by_mode:
+            headless, headed = by_mode['headless'], by_mode['headed']
+            print(f"无界面 / 有界面: 峰值内存 {headless['峰值内存(MB)'] / headed['峰值内存(MB)']:.2f}，"
+                  f"每周期 CPU {headless['每周期CPU(秒)'] / max(headed['每周期CPU(秒)'], 1e-9):.2f}，"
+                  f"端到端中位数 {headless['端到端中位数(秒)'] / headed['端到端中位数(秒)']:.2f}")
+    print(f"站点请求计数 {standin.counters}")
+
+
+# ====================== 告警延迟 ======================
+def bench_alerts(args):
+    """把模拟快照依次交给告警规则，告警经 webhook 发到本地替身站点，统计处理完成到发出和到站点收到的延迟"""
+    from dingpan_alerts import AlertManager
+    from dingpan_core import RankHistory
+    from dingpan_standin import IwencaiStandin
+    
+    standin = IwencaiStandin(n_stocks=10).start()
+    rules = [
+        {'type': 'enter'},
+        {'type': 'threshold', 'column': '7日斜率(%)', 'threshold': args.threshold, 'direction': 'up'},
+        {'type': 'rank', 'column': '7日斜率(%)', 'top_n': args.top_n},
+    ]
+    manager = AlertManager({'rules': rules, 'sinks': [{'type': 'webhook', 'url': standin.webhook_url}]})
+    parser = IwencaiExportParser()
+    
+    # 每个快照换掉前 churn×序号 只股票并重新生成价格，保证每轮都有进入/穿越/排名变化；文件读取不计入延迟
+    work_dir = tempfile.mkdtemp(prefix='dingpan_alerts_')
+    frames = []
+    for snapshot_index in range(args.snapshots):
+        grid = build_iwencai_grid(args.stocks + args.churn * snapshot_index, seed=snapshot_index)
+        path = os.path.join(work_dir, f"export_{snapshot_index}.csv")
+        pd.concat([grid.iloc[:2], grid.iloc[2 + args.churn * snapshot_index:]]).to_csv(
+            path, header=False, index=False, encoding='gbk')
+        frames.append(parser.read_export_file(path))
+    shutil.rmtree(work_dir, ignore_errors=True)
+    
+    rows = []
+    previous = None
+    previous_processed_at = None
+    previous_keys = set()
+    # 和监控一样，排名历史在发布时追加一次，排名规则直接读取
+    rank_history = RankHistory()
+    rank_metric = '7日斜率(%)'
+    try:
+        for snapshot_index, df in enumerate(frames):
+            data = parser.build_snapshot(df)
+            keys = set(data['prices'].keys)
+            new_stocks = sorted(keys - previous_keys)
+            features = data['features']
+            rank_history.append(features['股票代码'].tolist(), features['股票简称'].tolist(),
+                                features[rank_metric].to_numpy(dtype=np.float64), data['timestamp'])
+            start = time.perf_counter()
+            alerts = manager.evaluate(previous, features, data['prices'], new_stocks,
+                                      data['timestamp'].timestamp(), rank_history=rank_history.tail(2),
+                                      rank_metric=rank_metric, previous_processed_at=previous_processed_at)
+            rows.append({'快照': snapshot_index, '告警数': len(alerts), '规则耗时(ms)': (time.perf_counter() - start) * 1000})
+            previous, previous_keys = data['features'], keys
+            previous_processed_at = data['timestamp'].timestamp()
+            time.sleep(args.interval)
+        manager.flush()
+    finally:
+        manager.stop()
+        standin.stop()
+    
+    received = []
+    for received_at, payload in standin.webhook_events:
+        alerts = payload['alerts']
+        received.append({
+            '告警数': len(alerts),
+            '发出延迟(ms)': alerts[0]['latency_ms'],
+            '收到延迟(ms)': (received_at - alerts[0]['processed_at']) * 1000,
+        })
+    print(pd.DataFrame(rows).round(2).to_string(index=False))
+    if received:
+        received = pd.DataFrame(received)
+        print(f"\nwebhook 收到 {len(received)} 个批次，共 {received['告警数'].sum()} 条告警")
+        print(received.describe().loc[['mean', '50%', 'max']].round(2).to_string())
+    print(f"告警统计 {manager.stats}")
+
+
+# ====================== 归档重新处理 ======================
+def reprocess_archive(args):
+    """把归档中的导出文件解压后用当前的解析逻辑批量重新处理"""
+    archive = ExportArchive(args.archive, retention_days=None)
+    since = datetime.strptime(args.since, "%Y-%m-%d").timestamp() if args.since else None
+    until = (datetime.strptime(args.until, "%Y-%m-%d").timestamp() + 86400) if args.until else None
+    entries = archive.select(since=since, until=until, query=args.query)
+    if not entries:
+        print("没有符合条件的归档记录")
+        return
+    
+    work_dir = tempfile.mkdtemp(prefix='dingpan_reprocess_')
+    try:
+        paths = [archive.extract(entry, work_dir) for entry in entries]
+        pool = ParsePool(max_workers=args.workers)
+        start = time.perf_counter()
+        snapshots = pool.parse_files(paths)
+        elapsed = time.perf_counter() - start
+        pool.shutdown()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    rows = []
+    for entry, snapshot in zip(entries, snapshots):
+        fetched_at = datetime.fromtimestamp(entry['fetched_at'])
+        row = {
+            '时间': fetched_at.strftime("%Y-%m-%d %H:%M:%S"),
+            '重复次数': entry['repeat_count'],
+            '股票数': snapshot['stock_count'] if snapshot else None,
+            '状态': '成功' if snapshot else '失败',
+            '查询': entry['search_query'][:30],
+        }
+        if snapshot and args.out:
+            os.makedirs(args.out, exist_ok=True)
+            out_path = os.path.join(args.out, f"features_{fetched_at.strftime('%Y%m%d_%H%M%S')}_{entry['sha256'][:8]}.csv")
+            snapshot['features'].to_csv(out_path, index=False, encoding='utf-8-sig')
+            row['输出'] = out_path
+        rows.append(row)
+    print(pd.DataFrame(rows).to_string(index=False))
+    print(f"{len(entries)} 个归档文件，解析耗时 {elapsed:.2f} 秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="同花顺问财监控系统工具")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    generate = subparsers.add_parser('generate', help="生成模拟的双表头导出文件")
+    generate.add_argument('path')
+    generate.add_argument('--stocks', type=int, default=500)
+    generate.add_argument('--seed', type=int, default=0)
+    generate.set_defaults(func=lambda args: print(generate_iwencai_export(args.path, args.stocks, seed=args.seed)))
+    
+    parse_bench = subparsers.add_parser('bench-parse', help="进程池解析吞吐量基准测试")
+    parse_bench.add_argument('--files', type=int, default=16)
+    parse_bench.add_argument('--stocks', type=int, default=2000)
+    parse_bench.add_argument('--workers', type=int, nargs='+', default=sorted({1, 2, 4, available_cpu_count()}))
+    parse_bench.set_defaults(func=bench_parse)
+    
+    memory_bench = subparsers.add_parser('bench-memory', help="每次快照的内存占用对比")
+    memory_bench.add_argument('--stocks', type=int, default=5000)
+    memory_bench.set_defaults(func=bench_memory)
+    
+    feature_bench = subparsers.add_parser('bench-features', help="技术指标批量计算耗时")
+    feature_bench.add_argument('--stocks', type=int, default=5000)
+    feature_bench.set_defaults(func=bench_features)
+    
+    for name, help_text in (('serve-standin', "运行本地问财替身站点"), ('bench-e2e', "对替身站点测量端到端周期延迟")):
+        standin = subparsers.add_parser(name, help=help_text)
+        standin.add_argument('--stocks', type=int, default=2000)
+        standin.add_argument('--page-delay', type=float, default=0.3, help="页面加载延迟（秒）")
+        standin.add_argument('--search-delay', type=float, default=1.0, help="查询结果返回延迟（秒）")
+        standin.add_argument('--export-delay', type=float, default=1.0, help="导出文件返回延迟（秒）")
+        standin.add_argument('--per-1000-rows', type=float, default=0.5, help="查询和导出每 1000 行额外延迟（秒）")
+        standin.add_argument('--login', action='store_true', help="第一次导数据时弹出扫码登录")
+        standin.add_argument('--login-delay', type=float, default=2.0, help="扫码登录弹窗停留时间（秒）")
+        if name == 'serve-standin':
+            standin.add_argument('--port', type=int, default=8765)
+            standin.set_defaults(func=serve_standin)
+        else:
+            standin.add_argument('--cycles', type=int, default=5)
+            standin.add_argument('--source', choices=['download', 'dom'], default='download')
+            standin.add_argument('--shards', choices=['off', 'board'], default='off', help="按板块分片查询")
+            standin.add_argument('--query', default="非ST，非北交所")
+            standin.add_argument('--modes', nargs='+', choices=['headless', 'headed'], default=['headless'],
+                                 help="依次测试的浏览器模式，同时给出两种时对比内存和 CPU")
+            standin.add_argument('--driver', choices=['selenium', 'http'], default='selenium',
+                                 help="http: 不启动浏览器，直接按浏览器的请求顺序请求替身站点")
+            standin.add_argument('--log-level', default='WARNING')
+            standin.set_defaults(func=bench_e2e)
+    
+    alert_bench = subparsers.add_parser('bench-alerts', help="告警规则和 webhook 发送的延迟")
+    alert_bench.add_argument('--stocks', type=int, default=2000)
+    alert_bench.add_argument('--snapshots', type=int, default=10)
+    alert_bench.add_argument('--churn', type=int, default=50, help="每个快照换掉的股票数")
+    alert_bench.add_argument('--threshold', type=float, default=1.0, help="7日斜率阈值(%%)")
+    alert_bench.add_argument('--top-n', type=int, default=20)
+    alert_bench.add_argument('--interval', type=float, default=0.2, help="快照之间的间隔（秒）")
+    alert_bench.set_defaults(func=bench_alerts)
+    
+    reprocess = subparsers.add_parser('reprocess', help="用当前解析逻辑批量重新处理归档的导出文件")
+    reprocess.add_argument('--archive', default=DEFAULT_ARCHIVE_DIR)
+    reprocess.add_argument('--since', help="开始日期 YYYY-MM-DD")
+    reprocess.add_argument('--until', help="结束日期 YYYY-MM-DD（含当天）")
+    reprocess.add_argument('--query', help="只处理查询中包含该文本的记录")
+    reprocess.add_argument('--workers', type=int, default=None)
+    reprocess.add_argument('--out', help="把每个快照的技术指标表写成 CSV 的目录")
+    reprocess.set_defaults(func=reprocess_archive)
+    
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
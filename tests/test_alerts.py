@@ -0,0 +1,103 @@
+# 告警规则在相邻两次快照之间的触发条件，以及告警经文件输出发送
+import json
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from dingpan_alerts import AlertManager, EnterScreenRule, RankTopNRule, ThresholdCrossRule
+from dingpan_core import PriceSnapshot, RankHistory
+
+DATES = ['2026.10.15', '2026.10.16']
+NOW = datetime(2026, 10, 19, 10, 30).timestamp()
+
+
+def features(rows):
+    return pd.DataFrame(rows, columns=['股票代码', '股票简称', '7日斜率(%)'])
+
+
+def prices(codes):
+    return PriceSnapshot([f"{code}_{code}" for code in codes], codes, codes, DATES,
+                         np.arange(1, 2 * len(codes) + 1, dtype=np.float64))
+
+
+def context(previous, current, new_stocks=(), **extra):
+    codes = current['股票代码'].tolist()
+    return {'previous': previous, 'current': current, 'prices': prices(codes), 'new_stocks': list(new_stocks),
+            'processed_at': NOW, 'previous_processed_at': NOW - 300, 'rank_history': None, 'rank_metric': None,
+            **extra}
+
+
+def test_enter_rule_reports_new_stocks_after_first_snapshot():
+    current = features([['A', 'A', 1.0], ['B', 'B', 2.0]])
+    assert EnterScreenRule().evaluate(context(None, current, ['B_B'])) == []
+
+    alerts = EnterScreenRule().evaluate(context(features([['A', 'A', 1.0]]), current, ['B_B', 'Z_Z']))
+    assert [(alert['code'], alert['rule']) for alert in alerts] == [('B', 'enter')]
+
+
+def test_threshold_rule_needs_a_previous_value_on_the_other_side():
+    previous = features([['A', 'A', 4.0], ['B', 'B', 6.0], ['C', 'C', np.nan], ['D', 'D', 5.5]])
+    current = features([['A', 'A', 5.0], ['B', 'B', 4.0], ['C', 'C', 9.0], ['D', 'D', 7.0], ['E', 'E', 8.0]])
+
+    up = ThresholdCrossRule(threshold=5.0, direction='up').evaluate(context(previous, current))
+    assert [alert['code'] for alert in up] == ['A']
+    assert up[0]['value'] == 5.0
+    down = ThresholdCrossRule(threshold=5.0, direction='down').evaluate(context(previous, current))
+    assert [alert['code'] for alert in down] == ['B']
+    assert ThresholdCrossRule(column='缺失列').evaluate(context(previous, current)) == []
+
+
+def test_rank_rule_reads_monitor_history():
+    previous = features([['A', 'A', 3.0], ['B', 'B', 2.0], ['C', 'C', 1.0]])
+    current = features([['A', 'A', 3.0], ['B', 'B', 1.0], ['C', 'C', 5.0]])
+    history = RankHistory(depth=3)
+    for frame in (previous, previous, current):
+        history.append(frame['股票代码'].tolist(), frame['股票简称'].tolist(), frame['7日斜率(%)'].to_numpy(), None)
+
+    rule = RankTopNRule(top_n=2)
+    alerts = rule.evaluate(context(previous, current, rank_history=history.tail(2), rank_metric='7日斜率(%)'))
+    assert [(alert['code'], alert['value']) for alert in alerts] == [('C', 5.0)]
+    assert rule.history is None
+
+
+def test_rank_rule_keeps_own_history_for_other_columns():
+    first = features([['A', 'A', 3.0], ['B', 'B', 2.0], ['C', 'C', 1.0]])
+    second = features([['A', 'A', 3.0], ['B', 'B', 1.0], ['C', 'C', 5.0]])
+    third = features([['A', 'A', 3.0], ['B', 'B', 4.0], ['C', 'C', 5.0]])
+    rule = RankTopNRule(top_n=2)
+    # 监控按其他指标排名，规则自己只记前 top_n 名
+    other = {'rank_history': RankHistory(depth=10), 'rank_metric': '3日斜率(%)'}
+    alerts = rule.evaluate(context(first, second, **other))
+    assert [(alert['code'], alert['value']) for alert in alerts] == [('C', 5.0)]
+    assert rule.history.depth == 2 and rule.history.timestamps == [datetime.fromtimestamp(NOW)]
+
+    # 连续评估时只给本次快照排名，历史只保留上一次快照
+    alerts = rule.evaluate(context(second, third, processed_at=NOW + 300))
+    assert [(alert['code'], alert['value']) for alert in alerts] == [('B', 4.0)]
+    assert rule.history.timestamps == [datetime.fromtimestamp(NOW + 300)]
+    assert rule.history.trajectory('B') == [2] and rule.history.trajectory('A') == [None]
+
+    # 中间跳过的快照不参与比较；不知道上一次快照的时间时本次不触发
+    assert rule.evaluate(context(first, second, previous_processed_at=None)) == []
+    assert [alert['code'] for alert in rule.evaluate(context(second, third))] == ['B']
+
+
+def test_manager_sends_alerts_with_latency(tmp_path):
+    path = tmp_path / 'alerts.jsonl'
+    manager = AlertManager({'rules': [{'type': 'enter'}], 'sinks': [{'type': 'file', 'path': str(path)}]})
+    previous = features([['A', 'A', 1.0]])
+    current = features([['A', 'A', 1.0], ['B', 'B', 2.0]])
+    processed_at = time.time()
+    try:
+        alerts = manager.evaluate(previous, current, prices(['A', 'B']), ['B_B'], processed_at)
+        manager.flush()
+    finally:
+        manager.stop()
+
+    assert len(alerts) == 1 and alerts[0]['processed_at'] == processed_at
+    lines = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+    assert [line['code'] for line in lines] == ['B']
+    assert lines[0]['latency_ms'] >= 0 and lines[0]['sent_at'] >= lines[0]['triggered_at']
+    assert manager.stats['sent'] == 1 and manager.latency_summary()[0]['批次'] == 1
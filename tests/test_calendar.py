@@ -0,0 +1,77 @@
+# 交易时段边界（午休、收盘、节假日）上的调度，以及查询模板的日期展开
+from datetime import datetime
+
+import numpy as np
+
+from dingpan_calendar import MonitorScheduler, QueryTemplateExpander, TradingCalendar, TradingDayIndex
+from dingpan_core import PriceSnapshot
+
+
+def test_sessions_exclude_lunch_break_and_holidays():
+    calendar = TradingCalendar()
+    assert calendar.current_session(datetime(2026, 9, 30, 9, 30)) is not None
+    assert calendar.current_session(datetime(2026, 9, 30, 11, 29, 59)) is not None
+    assert calendar.current_session(datetime(2026, 9, 30, 11, 30)) is None
+    assert calendar.current_session(datetime(2026, 9, 30, 12, 59)) is None
+    assert calendar.current_session(datetime(2026, 9, 30, 13, 0))[0] == datetime(2026, 9, 30, 13, 0)
+    assert calendar.current_session(datetime(2026, 9, 30, 15, 0)) is None
+    # 国庆休市、周末
+    assert calendar.current_session(datetime(2026, 10, 1, 10, 0)) is None
+    assert calendar.current_session(datetime(2026, 10, 4, 10, 0)) is None
+
+
+def test_next_session_start_skips_lunch_weekends_and_holidays():
+    calendar = TradingCalendar()
+    assert calendar.next_session_start(datetime(2026, 9, 30, 11, 45)) == datetime(2026, 9, 30, 13, 0)
+    assert calendar.next_session_start(datetime(2026, 9, 30, 15, 0)) == datetime(2026, 10, 8, 9, 30)
+    assert calendar.next_session_start(datetime(2026, 10, 16, 15, 30)) == datetime(2026, 10, 19, 9, 30)
+    assert calendar.next_trading_day('2026-09-30') == np.datetime64('2026-10-08')
+    assert calendar.next_trading_day('2026-10-08', -1) == np.datetime64('2026-09-30')
+
+
+def test_interval_at_speeds_up_near_session_edges():
+    scheduler = MonitorScheduler(TradingCalendar(), interval_minutes=5, fast_interval_minutes=1, fast_window_minutes=10)
+    assert scheduler.interval_at(datetime(2026, 9, 30, 9, 35)) == 1
+    assert scheduler.interval_at(datetime(2026, 9, 30, 10, 30)) == 5
+    assert scheduler.interval_at(datetime(2026, 9, 30, 11, 20)) == 1
+    assert scheduler.interval_at(datetime(2026, 9, 30, 13, 5)) == 1
+    assert scheduler.interval_at(datetime(2026, 9, 30, 14, 0)) == 5
+    assert scheduler.interval_at(datetime(2026, 9, 30, 14, 55)) == 1
+    # 休市时不加快
+    assert scheduler.interval_at(datetime(2026, 9, 30, 12, 0)) == 5
+    assert scheduler.interval_at(datetime(2026, 10, 1, 9, 35)) == 5
+
+
+def test_next_run_rolls_over_lunch_break_and_holidays():
+    scheduler = MonitorScheduler(TradingCalendar(), interval_minutes=5)
+    assert scheduler.next_run(datetime(2026, 9, 30, 10, 0)) == datetime(2026, 9, 30, 10, 5)
+    assert scheduler.next_run(datetime(2026, 9, 30, 11, 27)) == datetime(2026, 9, 30, 13, 0)
+    assert scheduler.next_run(datetime(2026, 9, 30, 14, 58)) == datetime(2026, 10, 8, 9, 30)
+    assert not scheduler.should_run(datetime(2026, 10, 2, 10, 0))
+
+    scheduler.sessions_only = False
+    assert scheduler.should_run(datetime(2026, 10, 2, 10, 0))
+    assert scheduler.next_run(datetime(2026, 9, 30, 11, 27)) == datetime(2026, 9, 30, 11, 32)
+
+
+def test_query_template_uses_trading_days(tmp_path):
+    day_index = TradingDayIndex(TradingCalendar(), str(tmp_path))
+    expander = QueryTemplateExpander(day_index)
+    now = datetime(2026, 10, 8, 10, 0)
+    assert expander.expand("{T}收盘价，{T-1}收盘价", now) == "2026年10月8日收盘价，2026年9月30日收盘价"
+    assert expander.expand("{最近3个交易日:{日期}收盘价大于5日均线}，非ST", now) == (
+        "2026年9月29日收盘价大于5日均线，2026年9月30日收盘价大于5日均线，2026年10月8日收盘价大于5日均线，非ST")
+    # 节假日按最近一个交易日展开，同一个最近交易日只展开一次
+    misses = expander.misses
+    assert expander.expand("{T}", datetime(2026, 10, 5, 9, 0)) == "2026年9月30日"
+    assert expander.expand("{T}", datetime(2026, 10, 7, 9, 0)) == "2026年9月30日"
+    assert expander.misses == misses + 1 and expander.hits == 1
+    assert expander.expand("非ST", now) == "非ST"
+
+
+def test_price_series_skips_calendar_holidays():
+    dates = ['2026.09.29', '2026.09.30', '2026.10.01', '2026.10.08']
+    snapshot = PriceSnapshot(['A_A'], ['A'], ['A'], dates, [10.0, 11.0, 11.5, 12.0])
+    assert snapshot.series('A_A', trading_only=True)[1] == [10.0, 11.0, 11.5, 12.0]
+    days, closes = snapshot.series('A_A', trading_only=True, last_n=2, holidays=TradingCalendar().holidays)
+    assert closes == [11.0, 12.0] and len(days) == 2
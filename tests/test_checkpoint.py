@@ -0,0 +1,83 @@
+# 检查点文件的读写往返、数组对齐，以及读取后不再引用文件
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from dingpan_core import (CHECKPOINT_ALIGN, CHECKPOINT_MAGIC, decode_dataframe, encode_dataframe, load_checkpoint,
+                          save_checkpoint)
+
+
+def sample_state():
+    return {
+        'version': 1,
+        'saved_at': datetime(2026, 10, 19, 10, 30, 15),
+        'search_query': "非ST，非北交所",
+        'floats': np.linspace(0, 1, 13),
+        'ints': np.arange(7, dtype=np.int16).reshape(7, 1),
+        'texts': np.array(['600000.SH', '测试股票']),
+        'objects': np.array(['a', 'bb'], dtype=object),
+        'empty': np.empty((0, 3)),
+        'nested': [{'matrix': np.eye(3, dtype=np.float32), 'count': np.int64(5)}, None],
+    }
+
+
+def test_checkpoint_round_trip(tmp_path):
+    path = str(tmp_path / 'state.ckpt')
+    state = sample_state()
+    size = save_checkpoint(path, state)
+    assert size == os.path.getsize(path)
+
+    loaded = load_checkpoint(path)
+    assert loaded['saved_at'] == state['saved_at']
+    assert loaded['search_query'] == state['search_query']
+    assert loaded['nested'][0]['count'] == 5 and loaded['nested'][1] is None
+    for name in ('floats', 'ints', 'texts', 'empty'):
+        np.testing.assert_array_equal(loaded[name], state[name])
+        assert loaded[name].dtype == state[name].dtype and loaded[name].shape == state[name].shape
+    assert loaded['objects'].dtype == object and loaded['objects'].tolist() == ['a', 'bb']
+    np.testing.assert_array_equal(loaded['nested'][0]['matrix'], np.eye(3, dtype=np.float32))
+
+
+def test_checkpoint_arrays_are_aligned(tmp_path):
+    path = str(tmp_path / 'state.ckpt')
+    save_checkpoint(path, sample_state())
+    with open(path, 'rb') as f:
+        assert f.read(len(CHECKPOINT_MAGIC)) == CHECKPOINT_MAGIC
+        header_length = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = json.loads(f.read(header_length).decode('utf-8'))
+    data_start = -(-(len(CHECKPOINT_MAGIC) + 8 + header_length) // CHECKPOINT_ALIGN) * CHECKPOINT_ALIGN
+    assert data_start % CHECKPOINT_ALIGN == 0
+    assert all(spec['offset'] % CHECKPOINT_ALIGN == 0 for spec in header['arrays'].values())
+
+
+def test_loaded_state_does_not_map_the_file(tmp_path):
+    path = str(tmp_path / 'state.ckpt')
+    save_checkpoint(path, sample_state())
+    loaded = load_checkpoint(path)
+    for name in ('floats', 'ints', 'texts'):
+        assert type(loaded[name]) is np.ndarray and loaded[name].base is None
+        assert loaded[name].flags.writeable
+    # 数组仍在使用时覆盖检查点（Windows 上被映射的文件无法替换）
+    save_checkpoint(path, {'floats': np.zeros(2)})
+    np.testing.assert_array_equal(loaded['floats'], np.linspace(0, 1, 13))
+    np.testing.assert_array_equal(load_checkpoint(path)['floats'], np.zeros(2))
+
+
+def test_dataframe_encoding_round_trip(tmp_path):
+    df = pd.DataFrame({
+        '股票代码': ['600000.SH', None, '300001.SZ'],
+        '收盘价_2025.11.20': [10.5, np.nan, 3.25],
+        '连续站上5日均线天数': np.array([3, 0, 7], dtype=np.int64),
+    }, index=[5, 7, 9])
+    path = str(tmp_path / 'frame.ckpt')
+    save_checkpoint(path, {'frame': encode_dataframe(df)})
+    restored = decode_dataframe(load_checkpoint(path)['frame'])
+
+    assert list(restored.columns) == list(df.columns)
+    assert restored.index.tolist() == [5, 7, 9]
+    assert restored['股票代码'].tolist()[0] == '600000.SH' and pd.isna(restored['股票代码'].iloc[1])
+    pd.testing.assert_series_equal(restored['收盘价_2025.11.20'], df['收盘价_2025.11.20'])
+    pd.testing.assert_series_equal(restored['连续站上5日均线天数'], df['连续站上5日均线天数'])
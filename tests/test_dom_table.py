@@ -0,0 +1,66 @@
+# 页面表格（DOM）和导出文件两种数据来源解析出的表格必须逐列一致
+import json
+import re
+import shutil
+import subprocess
+
+import pandas as pd
+import pytest
+
+from dingpan_core import IwencaiExportParser
+from dingpan_standin import IwencaiStandin
+
+# 用浏览器里运行的同一段 expandRows 展开替身站点页面的表头和表体，只把 DOM 节点换成普通对象
+NODE_SCRIPT = """
+%s
+var table = JSON.parse(require('fs').readFileSync(0, 'utf8'));
+function element(text, colspan, rowspan) {
+    var attrs = {colspan: colspan, rowspan: rowspan};
+    return {textContent: text, getAttribute: function (name) { return attrs[name] || null; }};
+}
+function row(cells) {
+    return {children: cells};
+}
+var headerRows = [
+    row(table.header_top.map(function (group) { return element(group[0], String(group[1]), String(group[2])); })),
+    row(table.header_dates.map(function (date) { return element(date); }))
+];
+var bodyRows = table.rows.map(function (values) {
+    return row(values.map(function (value) { return element(value); }));
+});
+process.stdout.write(JSON.stringify({header: expandRows(headerRows, 'undefined'), rows: expandRows(bodyRows, null)}));
+"""
+
+
+def page_functions():
+    from dingpan2 import TABLE_EXTRACT_JS
+    return '\n'.join(
+        re.search(r'function %s\(.*?\n}\n' % name, TABLE_EXTRACT_JS, re.S).group(0)
+        for name in ('cellText', 'expandRows')
+    )
+
+
+@pytest.fixture(scope='module')
+def rendered():
+    standin = IwencaiStandin(n_stocks=120, variants=1)
+    try:
+        yield standin.render(0, '')
+    finally:
+        standin.server.server_close()
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason="需要 node 执行页面脚本")
+def test_dom_table_matches_export_file(rendered, tmp_path):
+    result = subprocess.run(['node', '-e', NODE_SCRIPT % page_functions()], input=rendered['result'],
+                            capture_output=True, check=True)
+    parser = IwencaiExportParser()
+    from_dom = parser.dom_table_to_dataframe(json.loads(result.stdout))
+    
+    path = tmp_path / 'export.xlsx'
+    path.write_bytes(rendered['xlsx'])
+    from_file = parser.read_export_file(str(path))
+    
+    assert list(from_dom.columns) == list(from_file.columns)
+    assert '收盘价_2025.11.13' in from_dom.columns
+    for column in from_file.columns:
+        pd.testing.assert_series_equal(from_dom[column], from_file[column], obj=column)
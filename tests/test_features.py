@@ -0,0 +1,124 @@
+# 向量化技术指标、top-k 排名和排名历史与逐行参考实现一致
+from datetime import datetime
+
+import numpy as np
+from scipy import stats
+
+from dingpan_core import RankHistory, compute_feature_table, regression_stats, top_k_indices
+
+
+def reference_regression(row):
+    """逐只股票 linregress: x 为有效值的序号"""
+    valid = row[np.isfinite(row) & (row > 0)]
+    if len(valid) < 2:
+        return 0.0, 0.0
+    result = stats.linregress(np.arange(len(valid)), valid)
+    if not np.isfinite(result.rvalue):
+        return result.slope / valid.mean() * 100, 0.0
+    return result.slope / valid.mean() * 100, result.rvalue ** 2
+
+
+def test_regression_matches_linregress():
+    rng = np.random.default_rng(0)
+    values = rng.uniform(5, 50, (200, 7))
+    values[rng.random(values.shape) < 0.2] = np.nan
+    values[0] = np.nan
+    values[1, 1:] = np.nan
+    values[2] = 10.0
+    mask = np.isfinite(values) & (values > 0)
+
+    slope, r2 = regression_stats(values, mask)
+    expected = np.array([reference_regression(row) for row in values])
+    np.testing.assert_allclose(slope, expected[:, 0], rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(r2, expected[:, 1], rtol=1e-9, atol=1e-12)
+    assert slope[0] == slope[1] == 0.0 and r2[2] == 0.0
+
+
+def test_regression_without_columns():
+    slope, r2 = regression_stats(np.empty((3, 0)), np.empty((3, 0), dtype=bool))
+    assert slope.tolist() == [0.0, 0.0, 0.0] and r2.tolist() == [0.0, 0.0, 0.0]
+
+
+def test_feature_table_matches_reference():
+    close = np.array([[10.0, 11.0, 12.0, 13.0, 14.0, 15.0, 16.0],
+                      [20.0, 19.0, np.nan, 21.0, 18.0, 22.0, 23.0]])
+    open_ = close * 0.99
+    ma5 = np.array([[9.0, 10.0, 11.0, 12.0, 13.0, 14.0, 15.0],
+                    [21.0, 20.0, 20.0, 20.0, 20.0, 21.0, 22.0]])
+    features = compute_feature_table(['600000.SH', '000001.SZ'], ['甲', '乙'], close, open_, ma5,
+                                     score=np.array([3.0, 4.0]))
+
+    assert features['最新收盘价'].tolist() == [16.0, 23.0]
+    for window in (3, 5, 7):
+        expected = [reference_regression(row[-window:]) for row in close]
+        np.testing.assert_allclose(features[f'{window}日斜率(%)'], [e[0] for e in expected])
+        np.testing.assert_allclose(features[f'{window}日R²'], [e[1] for e in expected])
+    np.testing.assert_allclose(features['7日R²'].iloc[0], 1.0)
+    np.testing.assert_allclose(features['收盘价较5日均线(%)'], (close[:, -1] / ma5[:, -1] - 1) * 100)
+    np.testing.assert_allclose(features['开盘至收盘(%)'], (1 / 0.99 - 1) * 100)
+    # 第二只股票最近两天站上均线，再往前一天（18 < 20）中断
+    assert features['连续站上5日均线天数'].tolist() == [7, 2]
+
+    # 波动率只用相邻两个交易日都有效的收益率
+    returns = [np.diff(close[0]) / close[0, :-1],
+               np.array([19 / 20 - 1, 18 / 21 - 1, 22 / 18 - 1, 23 / 22 - 1])]
+    np.testing.assert_allclose(features['波动率(%)'], [np.std(r, ddof=1) * 100 for r in returns])
+    assert features['财务诊断评分'].tolist() == [3.0, 4.0]
+
+
+def test_top_k_orders_ties_by_row_and_nan_last():
+    values = np.array([1.0, 3.0, np.nan, 3.0, 2.0, np.inf])
+    assert top_k_indices(values, 3).tolist() == [5, 1, 3]
+    assert top_k_indices(values, 10).tolist() == [5, 1, 3, 4, 0, 2]
+    assert top_k_indices(values, 0).tolist() == []
+    assert top_k_indices(np.array([]), 3).tolist() == []
+
+
+def test_top_k_matches_stable_sort():
+    rng = np.random.default_rng(1)
+    values = rng.integers(0, 20, 500).astype(np.float64)
+    values[rng.random(500) < 0.05] = np.nan
+    stable = np.argsort(-np.where(np.isnan(values), -np.inf, values), kind='stable')
+    for k in (1, 10, 100, 500):
+        assert top_k_indices(values, k).tolist() == stable[:k].tolist()
+
+
+def test_rank_history_climbers_and_round_trip():
+    history = RankHistory(depth=3, initial_stocks=1, initial_snapshots=1)
+    timestamps = [datetime(2026, 10, 19, 10, minute) for minute in (0, 5, 10)]
+    history.append(['A', 'B', 'C', 'D'], ['a', 'b', 'c', 'd'], [4.0, 3.0, 2.0, 1.0], timestamps[0])
+    history.append(['A', 'B', 'C', 'D'], ['a', 'b', 'c', 'd'], [4.0, 1.0, 2.0, 5.0], timestamps[1])
+    history.append(['E', 'A'], ['e', 'a'], [np.nan, 7.0], timestamps[2])
+
+    assert history.trajectory('D') == [None, 1, None]
+    assert history.trajectory('Z') == [None, None, None]
+    assert [history.codes[row] for row in history.current_top(3)] == ['A', 'E']
+    climbers = history.climbers(top_n=1, lookback=1, at=1)
+    assert [(history.codes[row], rank, before) for row, rank, before in climbers] == [('D', 1, None)]
+    assert history.climbers(top_n=2, lookback=1, at=0) == []
+    assert history.value_at(1, 1) == 5.0 and history.value_at(3, 1) == 2.0
+    assert history.value_at(2) is None and history.value_at(3) is None
+
+    restored = RankHistory.from_arrays(history.to_arrays())
+    assert restored.codes == history.codes and restored.timestamps == history.timestamps
+    for code in history.codes:
+        assert restored.trajectory(code) == history.trajectory(code)
+    assert restored.value_at(1, 1) == 5.0 and restored.value_at(2) is None
+
+
+def test_rank_history_tail_is_a_detached_copy():
+    history = RankHistory(depth=2, initial_stocks=1, initial_snapshots=1)
+    timestamps = [datetime(2026, 10, 19, 10, minute) for minute in (0, 5, 10)]
+    history.append(['A', 'B'], ['a', 'b'], [2.0, 1.0], timestamps[0])
+    history.append(['C', 'B'], ['c', 'b'], [3.0, 1.0], timestamps[1])
+    history.append(['B', 'D'], ['b', 'd'], [4.0, 1.0], timestamps[2])
+
+    tail = history.tail(2)
+    assert tail.codes == ['B', 'C', 'D'] and tail.timestamps == timestamps[1:]
+    assert [tail.trajectory(code) for code in tail.codes] == [[2, 1], [1, None], [None, 2]]
+    assert [(tail.codes[row], rank, before) for row, rank, before in tail.climbers(top_n=2)] == [('D', 2, None)]
+    assert tail.value_at(1) == 4.0
+
+    history.append(['E', 'D'], ['e', 'd'], [5.0, 1.0], timestamps[2])
+    assert len(tail.timestamps) == 2 and tail.trajectory('B') == [2, 1] and 'E' not in tail.code_index
+    assert history.tail(10).codes == history.codes
@@ -0,0 +1,55 @@
+# 查询结果缓存的键规范化、TTL、时间窗口、抓取方式和 LRU 容量
+from dingpan_core import QueryResultCache
+
+NOW = 1_000_000.0
+
+
+def test_normalized_queries_share_an_entry():
+    cache = QueryResultCache(ttl_seconds=120, bucket_seconds=300)
+    snapshot = {'timestamp': 1}
+    cache.put("非ST，非北交所。", snapshot, now=NOW)
+    assert cache.get(" 非st, 非北交所 ", now=NOW + 1) is snapshot
+    assert cache.get("非ST；非北交所", now=NOW + 1) is snapshot
+    assert cache.get("非ST、、非北交所", now=NOW + 1) is snapshot
+    assert cache.get("非ST，非创业板", now=NOW + 1) is None
+    assert cache.stats() == {'entries': 1, 'hits': 3, 'misses': 1, 'hit_rate': 0.75}
+
+
+def test_entries_expire_after_ttl_and_bucket():
+    cache = QueryResultCache(ttl_seconds=60, bucket_seconds=300)
+    start = 300 * 4000.0
+    cache.put("q", 'first', now=start)
+    assert cache.get("q", now=start + 60) == 'first'
+    assert cache.get("q", now=start + 61) is None
+    # 过期项在读取时删除
+    assert cache.stats()['entries'] == 0
+
+    cache.put("q", 'second', now=start + 290)
+    # 进入下一个时间窗口后即使没到 TTL 也不再命中
+    assert cache.get("q", now=start + 301) is None
+
+
+def test_zero_ttl_disables_cache():
+    cache = QueryResultCache(ttl_seconds=0)
+    cache.put("q", 'snapshot', now=NOW)
+    assert cache.get("q", now=NOW) is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_variants_are_cached_separately():
+    cache = QueryResultCache()
+    cache.put("q", 'unsharded', now=NOW, variant=('off', (), 'download'))
+    cache.put("q", 'board', now=NOW, variant=('board', (), 'download'))
+    assert cache.get("q", now=NOW, variant=('off', (), 'download')) == 'unsharded'
+    assert cache.get("q", now=NOW, variant=('board', (), 'download')) == 'board'
+    assert cache.get("q", now=NOW, variant=('off', (), 'dom')) is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = QueryResultCache(ttl_seconds=120, max_entries=2)
+    cache.put("a", 'A', now=NOW)
+    cache.put("b", 'B', now=NOW)
+    assert cache.get("a", now=NOW) == 'A'
+    cache.put("c", 'C', now=NOW)
+    assert cache.get("b", now=NOW) is None
+    assert cache.get("a", now=NOW) == 'A' and cache.get("c", now=NOW) == 'C'
@@ -0,0 +1,69 @@
+# 按板块分片查询合并后的结果必须和不分片的查询一致；两种方式的请求耗时只记录，不作比较
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+from dingpan_core import IwencaiExportParser
+from dingpan_standin import IwencaiStandin
+
+QUERY = "非ST，非北交所"
+
+
+@pytest.fixture(scope='module')
+def standin():
+    # 导出耗时主要按行数增加，分片之间的请求可以重叠
+    standin = IwencaiStandin(n_stocks=400, variants=1, export_delay=0.1, seconds_per_1000_rows=1.0).start()
+    try:
+        yield standin
+    finally:
+        standin.stop()
+
+
+def fetch_export(standin, query, tmp_path):
+    base = standin.url.rstrip('/').rsplit('/', 1)[0]
+    body = urllib.request.urlopen(f"{base}/export?q={urllib.parse.quote(query)}").read()
+    path = tmp_path / f"{time.time_ns()}.xlsx"
+    path.write_bytes(body)
+    return str(path)
+
+
+def test_merged_shards_match_unsharded(standin, tmp_path, record_property):
+    from dingpan2 import BOARD_SHARDS
+    shard_queries = [f"{QUERY}，{board}" for board in BOARD_SHARDS]
+    # 先让替身站点生成好各查询的导出文件，计时只包含请求本身
+    for query in [QUERY] + shard_queries:
+        standin.render(0, query)
+
+    start = time.perf_counter()
+    unsharded_path = fetch_export(standin, QUERY, tmp_path)
+    unsharded_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(shard_queries)) as executor:
+        shard_paths = list(executor.map(lambda query: fetch_export(standin, query, tmp_path), shard_queries))
+    sharded_seconds = time.perf_counter() - start
+    record_property('unsharded_seconds', round(unsharded_seconds, 3))
+    record_property('sharded_seconds', round(sharded_seconds, 3))
+
+    parser = IwencaiExportParser()
+    unsharded = parser.read_export_file(unsharded_path)
+    shards = [parser.read_export_file(path) for path in shard_paths]
+    assert all(len(shard) > 0 for shard in shards)
+    merged = parser.merge_shard_frames(shards)
+
+    assert list(merged.columns) == list(unsharded.columns)
+    expected = unsharded.sort_values('股票代码').reset_index(drop=True)
+    actual = merged.sort_values('股票代码').reset_index(drop=True)
+    pd.testing.assert_frame_equal(actual, expected)
+
+    # 合并后计算的技术指标同样一致
+    expected_features = parser.build_snapshot(unsharded)['features']
+    actual_features = parser.build_snapshot(merged)['features']
+    pd.testing.assert_frame_equal(
+        actual_features.sort_values('股票代码').reset_index(drop=True),
+        expected_features.sort_values('股票代码').reset_index(drop=True)
+    )